@@ -0,0 +1,337 @@
+# app/aggregator.py
+"""
+Gom dữ liệu cảm biến theo cửa sổ thời gian ngay trên thiết bị (edge aggregation).
+
+Mỗi metric (vd "env.temp_c", "co2.ppm", "soil.hum_pct") có cửa sổ riêng
+(cấu hình ở settings.yml -> aggregation.windows). Khi cửa sổ đóng lại, chỉ gửi
+min/max/mean/stddev/count/last lên server thay vì từng mẫu 1 Hz.
+
+Cửa sổ đã đóng đi qua AggregateOutbox: hàng đợi có giới hạn, lưu ra đĩa, 1 luồng
+riêng gửi + thử lại có back-off -> mạng chập chờn / server chậm không làm mất
+cửa sổ và không chặn vòng đọc cảm biến 1 Hz.
+
+Khi dừng chương trình, cửa sổ đang mở KHÔNG được gửi (gửi rồi lần chạy sau gửi tiếp
+đúng khoảng đó thì server nhận trùng) mà lưu vào aggregation.state_path; lần chạy sau
+nạp lại và gom tiếp, cửa sổ đã hết hạn thì đóng + gửi 1 lần như bình thường.
+"""
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+DEFAULT_WINDOW_S = 60
+DEFAULT_OUTBOX_MAX = 1440          # ~1 ngày cửa sổ 60 s
+
+
+def flatten_reading(data: dict, prefix: str = "") -> dict:
+    """Làm phẳng bản ghi collect_all() thành {"env.temp_c": 25.1, ...}.
+
+    Chỉ giữ giá trị số (bỏ None, chuỗi, bool) để có thể thống kê.
+    """
+    out = {}
+    if not isinstance(data, dict):
+        return out
+    for key, val in data.items():
+        name = f"{prefix}.{key}" if prefix else str(key)
+        if isinstance(val, dict):
+            out.update(flatten_reading(val, name))
+        elif isinstance(val, bool) or val is None:
+            continue
+        elif isinstance(val, (int, float)):
+            v = float(val)
+            if not math.isnan(v):
+                out[name] = v
+    return out
+
+
+class _WindowStat:
+    """Thống kê 1 cửa sổ của 1 metric (Welford, O(1) bộ nhớ)."""
+    __slots__ = ("start", "count", "mean", "m2", "min", "max", "last")
+
+    def __init__(self, start: float):
+        self.start = start
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, v: float):
+        self.count += 1
+        d = v - self.mean
+        self.mean += d / self.count
+        self.m2 += d * (v - self.mean)
+        self.min = v if self.min is None or v < self.min else self.min
+        self.max = v if self.max is None or v > self.max else self.max
+        self.last = v
+
+    def to_state(self) -> list:
+        return [self.start, self.count, self.mean, self.m2, self.min, self.max, self.last]
+
+    @classmethod
+    def from_state(cls, state: list) -> "_WindowStat":
+        st = cls(float(state[0]))
+        st.count, st.mean, st.m2, st.min, st.max, st.last = state[1:7]
+        return st
+
+    def to_dict(self) -> dict:
+        std = math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+        return {
+            "min": self.min,
+            "max": self.max,
+            "mean": round(self.mean, 4),
+            "stddev": round(std, 4),
+            "count": self.count,
+            "last": self.last,
+        }
+
+
+def _iso_local(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch).isoformat(timespec="seconds")
+
+
+class WindowAggregator:
+    """
+    Nhận từng bản ghi (dict của collect_all) và trả về các cửa sổ đã đóng.
+
+    Cửa sổ được căn theo bội số của window_s tính từ epoch, nên các metric
+    cùng độ dài cửa sổ luôn đóng cùng lúc và gom được vào 1 payload.
+    """
+
+    def __init__(self, windows: dict = None, default_window_s: float = DEFAULT_WINDOW_S,
+                 device_id: str = None, state_path: str = None):
+        self.windows = {k: float(v) for k, v in (windows or {}).items()}
+        self.default_window_s = float(default_window_s)
+        self.device_id = device_id
+        self.state_path = state_path
+        self._stats = {}   # metric -> _WindowStat
+        self._load()
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        agg_cfg = (cfg or {}).get("aggregation", {}) or {}
+        return cls(windows=agg_cfg.get("windows"),
+                   default_window_s=agg_cfg.get("default_window_s", DEFAULT_WINDOW_S),
+                   device_id=(cfg or {}).get("device_id"),
+                   state_path=agg_cfg.get("state_path"))
+
+    # ---------- cửa sổ dở dang giữa 2 lần chạy ----------
+    def _load(self):
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f) or {}
+            self._stats = {m: _WindowStat.from_state(v) for m, v in state.items()}
+        except FileNotFoundError:
+            return
+        except (ValueError, TypeError, IndexError) as e:
+            print(f"[Agg] Bỏ qua cửa sổ dở dang lỗi {self.state_path}: {e}", file=sys.stderr)
+        # Xoá ngay: crash trước lần save() sau thì không nạp (và gửi) lại cùng cửa sổ lần nữa
+        try:
+            os.remove(self.state_path)
+        except OSError:
+            pass
+        if self._stats:
+            print(f"[Agg] Gom tiếp {len(self._stats)} cửa sổ dở dang từ lần chạy trước")
+
+    def save(self) -> bool:
+        """Lưu cửa sổ đang mở (khi dừng chương trình) thay cho flush(). True nếu có lưu."""
+        if not self.state_path or not self._stats:
+            return False
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({m: st.to_state() for m, st in self._stats.items()}, f)
+        os.replace(tmp, self.state_path)
+        self._stats.clear()
+        return True
+
+    def window_for(self, metric: str) -> float:
+        return self.windows.get(metric, self.default_window_s)
+
+    def add(self, data: dict, now: float = None) -> list:
+        """Đưa 1 bản ghi vào. Trả list payload của các cửa sổ vừa đóng (có thể rỗng)."""
+        now = time.time() if now is None else now
+        closed = []
+        for metric, v in flatten_reading(data).items():
+            w = self.window_for(metric)
+            start = now - (now % w)
+            st = self._stats.get(metric)
+            if st is not None and st.start != start:
+                closed.append((metric, w, st))
+                st = None
+            if st is None:
+                st = self._stats[metric] = _WindowStat(start)
+            st.add(v)
+        # metric không còn xuất hiện (sensor rớt) nhưng cửa sổ đã hết hạn -> đóng luôn
+        for metric, st in list(self._stats.items()):
+            w = self.window_for(metric)
+            if now >= st.start + w:
+                closed.append((metric, w, st))
+                del self._stats[metric]
+        return self._build_payloads(closed)
+
+    def flush(self) -> list:
+        """Đóng tất cả cửa sổ đang mở (không có state_path để lưu cửa sổ dở dang)."""
+        closed = [(m, self.window_for(m), st) for m, st in self._stats.items()]
+        self._stats.clear()
+        return self._build_payloads(closed)
+
+    def _build_payloads(self, closed: list) -> list:
+        # Gom theo (start, window) để mỗi lần đóng chỉ sinh 1 payload
+        groups = {}
+        for metric, w, st in closed:
+            if st.count == 0:
+                continue
+            groups.setdefault((st.start, w), {})[metric] = st.to_dict()
+        payloads = []
+        for (start, w), metrics in sorted(groups.items()):
+            payloads.append({
+                "ts": _iso_local(start + w),
+                "device_id": self.device_id or None,
+                "window_start": _iso_local(start),
+                "window_s": w,
+                "metrics": metrics,
+            })
+        return payloads
+
+
+def _permanent_error(exc) -> bool:
+    """HTTP 4xx (trừ 408/429): server từ chối payload, gửi lại cũng vô ích."""
+    resp = getattr(exc, "response", None)
+    code = getattr(resp, "status_code", None)
+    return code is not None and 400 <= code < 500 and code not in (408, 429)
+
+
+class AggregateOutbox:
+    """
+    Hàng đợi payload aggregate chờ gửi.
+
+    put() chỉ thêm vào deque (giới hạn max_items, đầy thì bỏ cửa sổ CŨ nhất) và
+    ghi lại file path (tmp + os.replace) -> không bao giờ chặn vòng lấy mẫu.
+    Luồng gửi lấy payload đầu hàng, send(payload) lỗi thì chờ back-off (nhân đôi
+    tới backoff_max_s) rồi thử lại đúng payload đó; thành công mới bỏ khỏi hàng.
+    Payload còn lại khi thoát nằm trong file, lần chạy sau gửi tiếp.
+    """
+
+    def __init__(self, send, path: str = None, max_items: int = DEFAULT_OUTBOX_MAX,
+                 backoff_s: float = 5.0, backoff_max_s: float = 300.0):
+        self._send = send
+        self.path = path
+        self.backoff_s = float(backoff_s)
+        self.backoff_max_s = float(backoff_max_s)
+        self._q = deque(maxlen=max(1, int(max_items)))
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self.sent = 0
+        self.dropped = 0
+        self._load()
+
+    @classmethod
+    def from_config(cls, cfg: dict, send):
+        agg_cfg = (cfg or {}).get("aggregation", {}) or {}
+        return cls(send, path=agg_cfg.get("outbox_path"),
+                   max_items=agg_cfg.get("outbox_max", DEFAULT_OUTBOX_MAX),
+                   backoff_s=agg_cfg.get("retry_s", 5.0),
+                   backoff_max_s=agg_cfg.get("retry_max_s", 300.0))
+
+    def __len__(self):
+        with self._cond:
+            return len(self._q)
+
+    # ---------- lưu đĩa ----------
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                self._q.append(json.loads(line))
+            except ValueError:
+                continue        # dòng cắt dở do mất điện
+        if self._q:
+            print(f"[Agg] Outbox còn {len(self._q)} cửa sổ chưa gửi từ lần chạy trước")
+
+    def _save(self):
+        # Gọi khi đang giữ _cond; vài trăm KB tối đa, 1 lần / cửa sổ đóng
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                for p in self._q:
+                    f.write(json.dumps(p, ensure_ascii=False) + "\n")
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"[Agg] Không ghi được outbox {self.path}: {e}", file=sys.stderr)
+
+    # ---------- API ----------
+    def put(self, payloads: list):
+        if not payloads:
+            return
+        with self._cond:
+            for p in payloads:
+                if len(self._q) == self._q.maxlen:
+                    self.dropped += 1
+                    print(f"[Agg] Outbox đầy ({self._q.maxlen}), bỏ cửa sổ cũ nhất {self._q[0].get('ts')}",
+                          file=sys.stderr)
+                self._q.append(p)
+            self._save()
+            self._cond.notify()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="agg-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 10.0):
+        """Cho luồng gửi nốt trong tối đa timeout giây; phần còn lại giữ trong file."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._q and self._thread is not None and time.monotonic() < deadline:
+                self._cond.wait(min(0.2, max(0.0, deadline - time.monotonic())))
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+
+    def _run(self):
+        delay = self.backoff_s
+        while True:
+            with self._cond:
+                while not self._q and not self._stop:
+                    self._cond.wait()
+                if self._stop:
+                    return
+                p = self._q[0]
+            try:
+                code = self._send(p)
+                ok, keep = True, False
+                print(f"[Agg] {p['ts']} window={p['window_s']:.0f}s metrics={len(p['metrics'])} -> {code}")
+            except Exception as e:
+                ok, keep = False, not _permanent_error(e)
+                print(f"[Agg] Upload lỗi ({p['ts']}): {e}" + ("" if keep else " -> bỏ"), file=sys.stderr)
+            with self._cond:
+                if not keep:
+                    if self._q and self._q[0] is p:
+                        self._q.popleft()
+                    self.sent += ok
+                    self._save()
+                    self._cond.notify_all()
+                    delay = self.backoff_s
+                    continue
+                # Lỗi tạm thời: chờ back-off (stop() đánh thức sớm)
+                self._cond.wait(delay)
+                delay = min(delay * 2, self.backoff_max_s)
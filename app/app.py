@@ -1,44 +1,222 @@
-from flask import Flask, jsonify, request
+import os
+import json
+import threading
+from flask import Flask, jsonify, request, Response, stream_with_context
+from app.control import handle_control
 
 app = Flask(__name__)
 
-# Import GPIO controller và khởi tạo
+# WebSocket (flask-sock) là tuỳ chọn: thiếu thư viện thì chỉ mất /api/iot/ws
 try:
-    from app import gpio_controller as gpio
-    gpio.init_gpio()
-    print("[Flask] GPIO initialized successfully")
-except Exception as e:
-    print(f"[Flask] GPIO init error: {e}")
-    gpio = None
+    from flask_sock import Sock
+    app.config["SOCK_SERVER_OPTIONS"] = {"ping_interval": 25}
+    sock = Sock(app)
+except ImportError:
+    sock = None
+    print("[Warning] flask-sock not available. WebSocket /api/iot/ws disabled.")
+
+_cfg = None
+
+def _load_cfg():
+    """Đọc config/settings.yml 1 lần (trả {} nếu không có)."""
+    global _cfg
+    if _cfg is None:
+        try:
+            from app.config import load_config
+            _cfg = load_config("config/settings.yml") or {}
+        except Exception as e:
+            print(f"[Flask] Config load error: {e}")
+            _cfg = {}
+    return _cfg
+
+# GPIO, kênh lệnh, rules / climate_control / schedules và index lịch sử KHÔNG khởi tạo lúc
+# import (import app.app phải nằm trong ngân sách khởi động, xem app/bench_startup.py) mà trong
+# init_services(): gunicorn gọi ở post_worker_init (app/gunicorn_conf.py), create_app() /
+# request đầu tiên gọi nếu chưa chạy.
+# Chỉ 1 tiến trình làm chủ pin (flock trong gpio_controller); tiến trình khác chạy ở chế độ
+# proxy qua state service (app/gpio_state_service.py), không được thì API trả 503.
+# Production: gunicorn -c app/gunicorn_conf.py app.app:app (1 worker, nhiều thread)
+gpio = None
+_automation_ok = False
+_started = False
+_start_lock = threading.Lock()
+
+def _init_gpio():
+    try:
+        from app import gpio_controller
+        gpio_controller.configure(_load_cfg().get("gpio"))
+        if gpio_controller.init_gpio():
+            print("[Flask] GPIO initialized successfully")
+            return gpio_controller
+        print("[Flask] GPIO đang thuộc tiến trình khác (không proxy được), API điều khiển sẽ trả 503")
+    except Exception as e:
+        print(f"[Flask] GPIO init error: {e}")
+    return None
+
+def _start_automation(g):
+    global _automation_ok
+    cfg = _load_cfg()
+    # Kênh lệnh kéo từ server (Pi sau NAT): chỉ chạy ở tiến trình chủ GPIO (không chạy ở proxy)
+    if (cfg.get("command_channel", {}) or {}).get("enabled"):
+        from app.command_client import CommandClient
+        CommandClient.from_config(g, cfg).start()
+
+    # Mỗi thiết bị chỉ thuộc 1 bộ tự động (rules / climate_control / schedules), trùng thì không chạy bộ nào
+    try:
+        from app.control import check_device_owners
+        check_device_owners(cfg, g.normalize_device_name)
+        _automation_ok = True
+    except ValueError as e:
+        print(f"[Flask] {e} -> không chạy rules/climate_control/schedules, sửa settings.yml")
+        return
+
+    # Rules engine (settings.yml -> rules): xét mỗi reading mới của SensorCache
+    if (cfg.get("rules", {}) or {}).get("enabled"):
+        try:
+            from app.rules import start_rules
+            start_rules(cfg, g)
+        except Exception as e:
+            print(f"[Flask] Rules engine error: {e}")
+
+    # Vòng điều khiển PID/hysteresis (settings.yml -> climate_control)
+    if (cfg.get("climate_control", {}) or {}).get("enabled"):
+        try:
+            from app.climate_control import start_climate_control
+            start_climate_control(cfg, g)
+        except Exception as e:
+            print(f"[Flask] Climate control error: {e}")
+
+    # Lịch hẹn giờ thiết bị (settings.yml -> schedules)
+    if (cfg.get("schedules", {}) or {}).get("enabled"):
+        try:
+            from app.scheduler import start_scheduler
+            start_scheduler(cfg, g)
+        except Exception as e:
+            print(f"[Flask] Scheduler error: {e}")
+
+def init_services():
+    """Khởi tạo GPIO + các luồng nền đúng 1 lần mỗi tiến trình (gọi lại thì bỏ qua)."""
+    global gpio, _started
+    with _start_lock:
+        if _started:
+            return
+        g = _init_gpio()
+        if g is not None and g.is_owner():
+            _start_automation(g)
+        # Index lịch sử JSONL dựng ở luồng nền, /api/iot/history không tự dựng
+        try:
+            from app.history import get_history
+            get_history(_history_path()).start()
+        except Exception as e:
+            print(f"[Flask] History index error: {e}")
+        gpio = g
+        _started = True
+
+def create_app():
+    """App factory: `flask --app "app.app:create_app()" run` / gunicorn "app.app:create_app()"."""
+    init_services()
+    return app
+
+@app.before_request
+def _ensure_services():
+    # Chạy bằng đường không gọi init_services (vd `flask run`) -> khởi tạo ở request đầu
+    if not _started:
+        init_services()
 
 @app.route("/", methods=["GET"])
 def home():
     return jsonify({"msg": "GreenEco API alive"})
 
+LONG_POLL_MAX_S = 60
+SSE_HEARTBEAT_S = 15
+
+def _status_body(revision, states):
+    devices = []
+    for device_name, is_on in states.items():
+        devices.append({
+            "name": device_name,
+            "state": "ON" if is_on else "OFF",
+            "pin": gpio.DEVICES.get(device_name)
+        })
+    return {
+        "status": "OK",
+        "backend": gpio.backend_info(),
+        "revision": revision,
+        "devices": devices
+    }
+
+def _etag(revision):
+    return f'"rev-{revision}"'
+
+def _revision_from_etag(value):
+    """'"rev-12"' (hoặc danh sách If-None-Match) -> 12; không hợp lệ -> None."""
+    for tag in (value or "").split(","):
+        tag = tag.strip().lstrip("W/").strip('"')
+        if tag.startswith("rev-"):
+            try:
+                return int(tag[4:])
+            except ValueError:
+                pass
+    return None
+
 @app.route("/api/iot/status", methods=["GET"])
 def status():
-    """GET: Trả về trạng thái tất cả thiết bị GPIO"""
+    """
+    GET: Trả về trạng thái tất cả thiết bị GPIO (kèm "revision" + ETag).
+
+    - If-None-Match: "rev-N" -> 304 nếu chưa có gì đổi
+    - ?wait=30 (long-poll): nếu revision hiện tại vẫn là `since` (hoặc ETag gửi lên)
+      thì giữ request tới khi có thay đổi hoặc hết wait giây (tối đa 60)
+    """
     if gpio is None:
         return jsonify({"error": "GPIO not available"}), 503
     
     try:
-        states = gpio.get_all_states()
-        devices = []
-        for device_name, is_on in states.items():
-            devices.append({
-                "name": device_name,
-                "state": "ON" if is_on else "OFF",
-                "pin": gpio.DEVICES.get(device_name)
-            })
-        
-        return jsonify({
-            "status": "OK",
-            "backend": gpio.backend_info(),
-            "devices": devices
-        }), 200
+        since = request.args.get("since", type=int)
+        if since is None:
+            since = _revision_from_etag(request.headers.get("If-None-Match"))
+        wait = min(max(request.args.get("wait", 0, type=float), 0.0), LONG_POLL_MAX_S)
+
+        if since is not None and wait > 0:
+            revision, states = gpio.wait_for_change(since, wait)
+        else:
+            revision, states = gpio.get_state_snapshot()
+
+        if since is not None and revision == since and request.headers.get("If-None-Match"):
+            resp = Response(status=304)
+        else:
+            resp = jsonify(_status_body(revision, states))
+        resp.headers["ETag"] = _etag(revision)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route("/api/iot/status/stream", methods=["GET"])
+def status_stream():
+    """GET: Server-Sent Events, mỗi lần trạng thái GPIO đổi gửi 1 event "state"."""
+    if gpio is None:
+        return jsonify({"error": "GPIO not available"}), 503
+
+    last = request.headers.get("Last-Event-ID", request.args.get("since"))
+    try:
+        last = int(last) if last is not None else -1
+    except ValueError:
+        last = -1
+
+    def _events():
+        since = last
+        while True:
+            revision, states = gpio.wait_for_change(since, SSE_HEARTBEAT_S)
+            if revision == since:
+                yield ": keepalive\n\n"
+                continue
+            since = revision
+            yield f"id: {revision}\nevent: state\ndata: {json.dumps(_status_body(revision, states))}\n\n"
+
+    return Response(stream_with_context(_events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 @app.route("/api/iot/control", methods=["POST"])
 def control():
     """
@@ -73,140 +251,142 @@ def control():
     if gpio is None:
         return jsonify({"error": "GPIO not available"}), 503
     
-    data = request.get_json(silent=True) or {}
-    results = []
-    
+    body, code = handle_control(gpio, request.get_json(silent=True))
+    return jsonify(body), code
+
+@app.route("/api/iot/sensors", methods=["GET"])
+def sensors():
+    """
+    GET: Reading mới nhất từ cache RAM (vòng đọc nền cập nhật mỗi sensor_cache.interval_s).
+    Query: ?max_age=2 (giây) - cache cũ hơn thì đọc lại; các request đồng thời dùng chung 1 lần đọc.
+    """
     try:
-        # ===== FORMAT MỚI: deviceId + component + state =====
-        if "component" in data and "state" in data:
-            device_id = data.get("deviceId", "unknown")
-            component = data.get("component")
-            state = data.get("state", "").lower()
-            
-            if not component or not state:
-                return jsonify({
-                    "status": "FAILED",
-                    "error": "Missing component or state"
-                }), 400
-            
-            # Normalize state: "on"/"off"/"toggle"
-            if state not in ["on", "off", "toggle"]:
-                return jsonify({
-                    "status": "FAILED",
-                    "error": f"Invalid state: {state}. Use 'on', 'off', or 'toggle'"
-                }), 400
-            
-            success = False
-            if state == "on":
-                success = gpio.turn_on(component)
-            elif state == "off":
-                success = gpio.turn_off(component)
-            elif state == "toggle":
-                success = gpio.toggle_device(component)
-            
-            if not success:
-                return jsonify({
-                    "status": "FAILED",
-                    "deviceId": device_id,
-                    "component": component,
-                    "error": f"Failed to control '{component}'. Valid components: {list(gpio.DEVICES.keys())}"
-                }), 400
-            
-            # Lấy trạng thái hiện tại sau khi điều khiển
-            current_state = gpio.get_device_state(component)
-            
-            return jsonify({
-                "status": "OK",
-                "deviceId": device_id,
-                "component": component,
-                "state": "on" if current_state else "off",
-                "pin": gpio.DEVICES.get(gpio.normalize_device_name(component)),
-                "message": f"{component} turned {state}"
-            }), 200
-        
-        # ===== FORMAT CŨ: Giữ lại để tương thích ngược =====
-        # Trường hợp 1: Điều khiển tất cả
-        elif "action" in data and data["action"] in ["all_on", "all_off"]:
-            if data["action"] == "all_on":
-                gpio.turn_all_on()
-                results.append({"action": "all_on", "status": "OK"})
-            else:
-                gpio.turn_all_off()
-                results.append({"action": "all_off", "status": "OK"})
-        
-        # Trường hợp 2: Điều khiển nhiều thiết bị
-        elif "devices" in data and isinstance(data["devices"], list):
-            for item in data["devices"]:
-                device = item.get("device")
-                action = item.get("action", "").lower()
-                
-                if not device or not action:
-                    results.append({"device": device, "error": "Missing device or action"})
-                    continue
-                
-                success = False
-                if action == "on":
-                    success = gpio.turn_on(device)
-                elif action == "off":
-                    success = gpio.turn_off(device)
-                elif action == "toggle":
-                    success = gpio.toggle_device(device)
-                else:
-                    results.append({"device": device, "error": f"Invalid action: {action}"})
-                    continue
-                
-                results.append({
-                    "device": device,
-                    "action": action,
-                    "status": "OK" if success else "FAILED"
-                })
-
-        # Trường hợp 3: Điều khiển một thiết bị (format cũ)
-        elif "device" in data:
-            device = data.get("device")
-            action = data.get("action", "").lower()
-            
-            if not action:
-                return jsonify({"error": "Missing action"}), 400
-            
-            success = False
-            if action == "on":
-                success = gpio.turn_on(device)
-            elif action == "off":
-                success = gpio.turn_off(device)
-            elif action == "toggle":
-                success = gpio.toggle_device(device)
-            else:
-                return jsonify({"error": f"Invalid action: {action}"}), 400
-            
-            results.append({
-                "device": device,
-                "action": action,
-                "status": "OK" if success else "FAILED"
-            })
-        
-        else:
-            return jsonify({
-                "error": "Invalid request body. Use format: {\"deviceId\": \"...\", \"component\": \"pump\", \"state\": \"on\"}"
-            }), 400
-        
-        # Trả về trạng thái mới sau khi điều khiển
-        states = gpio.get_all_states()
-        devices = []
-        for device_name, is_on in states.items():
-            devices.append({
-                "name": device_name,
-                "state": "ON" if is_on else "OFF"
-            })
-        
-        return jsonify({
-            "status": "OK",
-            "results": results,
-            "current_states": devices
-        }), 200
-        
+        from app.sensor_cache import get_sensor_cache
+        cache = get_sensor_cache(_load_cfg())
+        max_age = request.args.get("max_age", type=float)
+        reading, age = cache.get(max_age)
+    except Exception as e:
+        return jsonify({"error": f"Sensors not available: {e}"}), 503
+
+    return jsonify({
+        "status": "OK",
+        "age_s": round(age, 3),
+        "reading": reading
+    }), 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """GET: Metric dạng Prometheus text (đọc sensor, relay, upload, hàng đợi, jitter vòng lặp)."""
+    from app import metrics as m
+    return Response(m.render(), mimetype=None, content_type=m.CONTENT_TYPE)
+
+def _history_path():
+    return (_load_cfg().get("export", {}) or {}).get("jsonl_path", "outbox/greeneco_stream.jsonl")
+
+@app.route("/api/iot/history", methods=["GET"])
+def history():
+    """
+    GET: Chuỗi lịch sử đã downsample từ JSONL local (export.jsonl_path).
+    Query:
+      metrics=env.temp_c,co2.ppm   (bắt buộc, tên metric dạng flatten)
+      from=2025-01-01T00:00:00 | epoch, to=... (mặc định: 24h gần nhất)
+      points=300 (3..2000), mode=minmax|lttb
+    series theo dạng cột: {metric: {"t": [...], "min": [...], "max": [...], "mean": [...],
+    "count": [...]}} (lttb: chỉ "t", "mean").
+    """
+    import time as _time
+    from app.history import get_history, to_epoch, HistoryIndexing
+
+    metrics = [m.strip() for m in request.args.get("metrics", "").split(",") if m.strip()]
+    if not metrics:
+        return jsonify({"error": "Missing metrics, e.g. ?metrics=env.temp_c,co2.ppm"}), 400
+    mode = request.args.get("mode", "minmax").lower()
+    if mode not in ("minmax", "lttb"):
+        return jsonify({"error": f"Invalid mode: {mode}. Use 'minmax' or 'lttb'"}), 400
+    try:
+        t_to = to_epoch(request.args["to"]) if "to" in request.args else _time.time()
+        t_from = to_epoch(request.args["from"]) if "from" in request.args else t_to - 86400
+        points = min(max(int(request.args.get("points", 300)), 3), 2000)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid parameter: {e}"}), 400
+    if t_from >= t_to:
+        return jsonify({"error": "'from' must be before 'to'"}), 400
+
+    try:
+        series = get_history(_history_path()).query(metrics, t_from, t_to, points=points, mode=mode)
+    except HistoryIndexing as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    return jsonify({
+        "status": "OK",
+        "from": t_from,
+        "to": t_to,
+        "mode": mode,
+        "points": points,
+        "series": series
+    }), 200
+
+WS_POLL_S = 1.0
+
+def _ws_subscription(msg):
+    """{"subscribe": ["env.temp_c", ...] | "env.temp_c,co2.ppm", "max_hz": 2} -> (metrics, hz)."""
+    metrics = msg.get("subscribe") or msg.get("metrics") or []
+    if isinstance(metrics, str):
+        metrics = [m.strip() for m in metrics.split(",")]
+    return [str(m) for m in metrics], msg.get("max_hz")
+
+def telemetry_ws(ws):
+    """
+    WebSocket /api/iot/ws: đẩy reading mới + thay đổi GPIO ngay khi có.
+    Query ban đầu: ?metrics=env.temp_c,co2.ppm&max_hz=1
+    Đổi đăng ký bất kỳ lúc nào: gửi {"subscribe": [...], "max_hz": 2}
+    Server gửi {"type": "reading", "ts", "values"} và {"type": "state", "revision", "devices", ...}
+    """
+    from app.telemetry_hub import get_hub
+    hub = get_hub(_load_cfg(), gpio, _status_body if gpio is not None else None)
+    metrics, max_hz = _ws_subscription({"metrics": request.args.get("metrics", ""),
+                                        "max_hz": request.args.get("max_hz", type=float)})
+    client = hub.connect(metrics, max_hz)
+    try:
+        while True:
+            for frame in client.take(WS_POLL_S):
+                ws.send(frame)
+            msg = ws.receive(timeout=0)
+            if msg is None:
+                continue
+            try:
+                metrics, max_hz = _ws_subscription(json.loads(msg))
+                hub.resubscribe(client, metrics, max_hz)
+            except (ValueError, TypeError, AttributeError):
+                ws.send(json.dumps({"type": "error", "error": "Invalid subscription"}))
+    finally:
+        hub.disconnect(client)
+
+if sock is not None:
+    telemetry_ws = sock.route("/api/iot/ws")(telemetry_ws)
+
+@app.route("/api/camera/stream.mjpg", methods=["GET"])
+def camera_stream():
+    """
+    GET: MJPEG stream (multipart/x-mixed-replace) từ 1 producer dùng chung.
+    Query: ?fps=10 (mỗi client tự chọn tốc độ, tối đa 30)
+    """
+    try:
+        from app.camera_stream import get_broadcaster, BOUNDARY, DEFAULT_FPS
+        fps = float(request.args.get("fps", DEFAULT_FPS))
+        broadcaster = get_broadcaster(_load_cfg())
+    except ValueError:
+        return jsonify({"error": "Invalid fps"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Camera stream not available: {e}"}), 503
+
+    return Response(stream_with_context(broadcaster.frames(fps)),
+                    mimetype=f"multipart/x-mixed-replace; boundary={BOUNDARY}",
+                    headers={"Cache-Control": "no-cache"})
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    # Dev server: không dùng reloader (reloader chạy 2 tiến trình -> init GPIO 2 lần).
+    # Production dùng gunicorn_conf.py thay vì app.run.
+    debug = os.environ.get("GREENECO_DEBUG", "0") == "1"
+    create_app().run(host="0.0.0.0", port=5000, debug=debug, use_reloader=False, threaded=True)
@@ -0,0 +1,67 @@
+# app/bench_startup.py
+"""
+Benchmark thời gian khởi động (import) của main.py, kiểm tra ngân sách.
+
+Mỗi lần đo chạy 1 tiến trình Python mới (cold start như systemd/cron), đo thời
+gian `import app.main` và liệt kê các module nặng bị kéo vào sớm.
+
+    python -m app.bench_startup                       # mặc định: app.main, 5 lần, ngân sách 150 ms
+    python -m app.bench_startup --budget-ms 120 --runs 9
+    python -m app.bench_startup --module app.json_export
+
+Exit code 1 nếu median vượt ngân sách hoặc có module bị cấm đã được import.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# Những thứ chỉ được import khi menu thực sự dùng tới
+FORBIDDEN = ("requests", "dateutil", "serial", "minimalmodbus", "smbus", "smbus2",
+             "modbus_tk", "RPi", "gpiozero", "cv2", "numpy", "picamera2",
+             "app.dashboard", "app.sen0501_i2c", "app.sen0220_uart", "app.es_soil7",
+             "app.uploader", "app.uploader_greenimage", "app.camera_service")
+
+_PROBE = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+print(json.dumps({{"s": dt, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure(module: str) -> dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", _PROBE.format(module=module)],
+                         cwd=root, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(module="app.main", runs=5, budget_ms=150.0, forbidden=FORBIDDEN) -> bool:
+    times, modules = [], set()
+    for _ in range(max(1, int(runs))):
+        r = measure(module)
+        times.append(r["s"] * 1000.0)
+        modules.update(r["modules"])
+    median = statistics.median(times)
+    leaked = sorted(m for m in forbidden if m in modules)
+    print(f"[Startup] import {module}: median {median:.1f} ms "
+          f"(min {min(times):.1f}, max {max(times):.1f}, {len(times)} lần) / ngân sách {budget_ms:.0f} ms")
+    if leaked:
+        print(f"[Startup] Module nặng bị import sớm: {', '.join(leaked)}")
+    ok = median <= budget_ms and not leaked
+    print("[Startup] OK" if ok else "[Startup] FAIL")
+    return ok
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Đo thời gian khởi động và kiểm tra ngân sách")
+    ap.add_argument("--module", default="app.main")
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--budget-ms", type=float, default=150.0)
+    args = ap.parse_args()
+    forbidden = FORBIDDEN if args.module == "app.main" else ()
+    sys.exit(0 if run(args.module, args.runs, args.budget_ms, forbidden) else 1)
@@ -0,0 +1,89 @@
+# app/bundle.py
+"""
+Bundle = 1 bản ghi sensor + 1 ảnh + chỉ số ảnh, chụp đồng thời dưới CÙNG 1 timestamp.
+
+- ENV / CO2 / SOIL / camera được kích hoạt song song (mỗi cái 1 bus riêng:
+  I2C/UART, UART, RS485, CSI) nên tổng thời gian ~ cảm biến chậm nhất.
+- Timestamp lấy 1 lần lúc bắt đầu theo uploader.LOCAL_TZ_NAME (không theo TZ hệ
+  thống): "ts" giờ địa phương và tên file ảnh theo UTC của chính thời điểm đó.
+- Gửi lên server bằng 1 request multipart duy nhất (uploader.post_bundle).
+"""
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timezone
+
+from app import uploader
+from app.json_export import open_sensors, build_record
+from app.metrics import read_sensor
+
+
+def _read_soil(soil):
+    try:
+        return read_sensor("es_soil7", soil)
+    except Exception:
+        return None
+
+
+def _stamp():
+    """(ts giờ địa phương không offset như uploader mong đợi, tên file ảnh UTC) từ cùng 1 thời điểm."""
+    now = uploader.local_now()
+    return (now.replace(tzinfo=None).isoformat(timespec="seconds"),
+            now.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ") + ".jpg")
+
+
+class BundleCapturer:
+    """Giữ sensor + pool luồng giữa các lần chụp để không phải mở lại cổng/camera."""
+
+    def __init__(self, cfg: dict, img_dir: str, width=1280, height=720, quality=80):
+        self.cfg = cfg
+        self.img_dir = os.path.expanduser(img_dir)
+        self.size = (int(width), int(height))
+        self.quality = int(quality)
+        self._sensors = open_sensors(cfg)
+        self._pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bundle")
+
+    def close(self):
+        self._pool.shutdown(wait=False)
+
+    def _grab_frame(self):
+        from app.camera_service import get_service
+        return get_service(size=self.size).capture_array()
+
+    def capture(self):
+        """Trả (record, jpeg_bytes). record["image"] trỏ tới file ảnh đã lưu local."""
+        import cv2
+        from app.canopy import metrics_from_config
+        from app.image_dedup import dhash
+
+        ts, name = _stamp()
+        s1, s2, soil = self._sensors
+        f_env = self._pool.submit(read_sensor, "sen0501", s1)
+        f_co2 = self._pool.submit(read_sensor, "sen0220", s2)
+        f_soil = self._pool.submit(_read_soil, soil)
+        f_cam = self._pool.submit(self._grab_frame)
+
+        frame = f_cam.result()
+        ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+        if not ok:
+            raise RuntimeError("cv2.imencode JPEG thất bại")
+        jpeg = buf.tobytes()
+        canopy = metrics_from_config(frame, self.cfg)
+        img_hash = f"{dhash(frame):016x}"
+
+        record = build_record(ts, self.cfg.get("device_id"),
+                              f_env.result(), f_co2.result(), f_soil.result())
+
+        os.makedirs(self.img_dir, exist_ok=True)
+        with open(os.path.join(self.img_dir, name), "wb") as f:
+            f.write(jpeg)
+        record["canopy"] = canopy
+        record["image"] = {
+            "file": name,
+            "width": int(frame.shape[1]),
+            "height": int(frame.shape[0]),
+            "bytes": len(jpeg),
+            "sha256": hashlib.sha256(jpeg).hexdigest(),
+            "dhash": img_hash,
+        }
+        return record, jpeg
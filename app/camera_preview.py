@@ -1,5 +1,5 @@
 # app/camera_preview.py
-from picamera2 import Picamera2, Preview
+from picamera2 import Picamera2, Preview, MappedArray
 import cv2
 import os
 import time
@@ -7,7 +7,88 @@ import shutil
 import subprocess
 import contextlib
 
-def run(res=(1280, 720)):
+WINDOW_TITLE = "Greenhouse Camera (Pi 5)"
+
+# Đồng hồ cùng gốc với SensorTimestamp của libcamera (ns kể từ lúc boot)
+_CLOCK = getattr(time, "CLOCK_BOOTTIME", time.CLOCK_MONOTONIC)
+
+
+class PreviewStats:
+    """Đo FPS hiển thị, độ trễ capture và số frame bị rơi từ metadata libcamera."""
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.fps = 0.0
+        self.latency_ms = None     # từ lúc sensor chụp tới lúc ta nhận được frame
+        self.wait_ms = 0.0         # thời gian block trong capture_request()
+        self.frames = 0
+        self.dropped = 0
+        self._last_wall = None
+        self._last_sensor_ts = None
+
+    def update(self, metadata: dict, wait_s: float):
+        now_wall = time.perf_counter()
+        if self._last_wall is not None:
+            dt = now_wall - self._last_wall
+            if dt > 0:
+                inst = 1.0 / dt
+                self.fps = inst if self.fps == 0 else self.fps + self.alpha * (inst - self.fps)
+        self._last_wall = now_wall
+        self.wait_ms = wait_s * 1000.0
+        self.frames += 1
+
+        sensor_ts = metadata.get("SensorTimestamp")
+        if sensor_ts:
+            lat = (time.clock_gettime_ns(_CLOCK) - sensor_ts) / 1e6
+            self.latency_ms = lat if 0 <= lat < 5000 else None
+            # Khoảng cách giữa 2 frame nhận được / FrameDuration - 1 = số frame bị rơi
+            frame_us = metadata.get("FrameDuration")
+            if self._last_sensor_ts is not None and frame_us:
+                gap = (sensor_ts - self._last_sensor_ts) / (frame_us * 1000.0)
+                if gap > 1.5:
+                    self.dropped += int(round(gap)) - 1
+            self._last_sensor_ts = sensor_ts
+
+    def lines(self):
+        lat = "n/a" if self.latency_ms is None else f"{self.latency_ms:.1f} ms"
+        return [
+            f"FPS: {self.fps:.1f}",
+            f"Latency: {lat}  wait: {self.wait_ms:.1f} ms",
+            f"Dropped: {self.dropped}/{self.frames + self.dropped}",
+        ]
+
+
+def _draw_overlay(frame, stats: PreviewStats):
+    for i, text in enumerate(stats.lines()):
+        y = 24 + i * 22
+        cv2.putText(frame, text, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 3, cv2.LINE_AA)
+        cv2.putText(frame, text, (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 1, cv2.LINE_AA)
+
+
+def _loop_zero_copy(cam):
+    """
+    Vòng lặp hiển thị không copy: vẽ overlay + imshow trực tiếp trên buffer DMA
+    của request (MappedArray), rồi trả buffer cho camera. Không capture_array/cvtColor.
+    """
+    stats = PreviewStats()
+    try:
+        while True:
+            t0 = time.perf_counter()
+            req = cam.capture_request()
+            wait_s = time.perf_counter() - t0
+            try:
+                stats.update(req.get_metadata(), wait_s)
+                with MappedArray(req, "main") as m:
+                    _draw_overlay(m.array, stats)
+                    cv2.imshow(WINDOW_TITLE, m.array)
+            finally:
+                req.release()
+            if cv2.waitKey(1) & 0xFF == ord('q'):
+                break
+    finally:
+        print(f"[Preview] {stats.frames} frames, ~{stats.fps:.1f} fps, dropped={stats.dropped}")
+
+def run(res=(1280, 720), zero_copy=True):
     def _fallback_cli():
         cmd = None
         if shutil.which("rpicam-hello"):
@@ -49,7 +130,6 @@ def run(res=(1280, 720)):
         _fallback_cli()
         return
 
-    # 2) Có GUI: chạy đường OpenCV
     # 2) Có GUI: chạy đường OpenCV
     cam = Picamera2()
     # Dùng đúng độ phân giải yêu cầu
@@ -58,7 +138,14 @@ def run(res=(1280, 720)):
         h = int(res[1]) if isinstance(res, (list, tuple)) and len(res) == 2 else 540
     except Exception:
         w, h = 960, 540
-    cam.configure(cam.create_preview_configuration(main={"size": (w, h)}))
+    if zero_copy:
+        # "RGB888" của Picamera2 = thứ tự byte B,G,R -> đúng layout cv2.imshow cần, khỏi cvtColor.
+        # 4 buffer để camera vẫn có chỗ ghi khi ta đang giữ 1 request để vẽ/hiển thị.
+        cam.configure(cam.create_preview_configuration(
+            main={"size": (w, h), "format": "RGB888"}, buffer_count=4,
+            controls={"FrameRate": 60.0}))
+    else:
+        cam.configure(cam.create_preview_configuration(main={"size": (w, h)}))
 
     try:
         cam.start()
@@ -66,16 +153,19 @@ def run(res=(1280, 720)):
         with contextlib.suppress(Exception):
             cam.set_controls({"FrameRate": 60.0})
         print("Preview running. Nhấn q để thoát.")
-        while True:
-            frame = cam.capture_array()
-            if frame.ndim == 3 and frame.shape[2] == 4:
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
-            elif frame.ndim == 3 and frame.shape[2] == 3:
-                frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        if zero_copy:
+            _loop_zero_copy(cam)
+        else:
+            while True:
+                frame = cam.capture_array()
+                if frame.ndim == 3 and frame.shape[2] == 4:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_RGBA2BGR)
+                elif frame.ndim == 3 and frame.shape[2] == 3:
+                    frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
 
-            cv2.imshow("Greenhouse Camera (Pi 5)", frame)
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+                cv2.imshow(WINDOW_TITLE, frame)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
 
     except Exception as e:
         msg = str(e).lower()
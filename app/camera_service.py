@@ -0,0 +1,202 @@
+# app/camera_service.py
+"""
+Camera service chạy trong tiến trình: giữ 1 instance Picamera2 đã cấu hình và
+đang stream (AE/AWB đã hội tụ), khi cần ảnh chỉ lấy frame mới nhất rồi encode
+JPEG trong RAM. Tránh mỗi lần chụp phải spawn rpicam-still + init camera (vài giây).
+
+Nếu không có picamera2/cv2 (hoặc camera lỗi) thì capture_jpeg() tự rơi về
+đường CLI cũ (cam_capture_cli.capture_jpeg_cli).
+
+Bên dùng camera lâu dài (MJPEG stream) giữ camera bằng acquire()/release():
+trong lúc còn user, reconfigure() không restart camera (bên chụp lẻ nhận frame ở
+độ phân giải hiện tại), và release() cuối cùng chỉ tắt camera nếu không có bên
+chụp lẻ nào (timelapse, bundle, canopy) đang cần camera "ấm".
+"""
+import atexit
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from app.cam_capture_cli import capture_jpeg_cli
+
+DEFAULT_SIZE = (1280, 720)
+WARMUP_S = 1.0   # thời gian chờ AE/AWB hội tụ sau khi start (chỉ 1 lần)
+
+
+class CameraService:
+    """Giữ Picamera2 luôn "ấm". Thread-safe; mọi truy cập camera đi qua _lock."""
+
+    def __init__(self, size=DEFAULT_SIZE, hflip=False, vflip=False, warmup_s=WARMUP_S):
+        self.size = (int(size[0]), int(size[1]))
+        self.hflip = bool(hflip)
+        self.vflip = bool(vflip)
+        self.warmup_s = warmup_s
+        self._cam = None
+        self._lock = threading.RLock()
+        self._users = 0            # số lease acquire() đang giữ
+        self._keep_warm = False    # có bên chụp lẻ dùng camera -> không tắt khi hết lease
+
+    @property
+    def running(self) -> bool:
+        return self._cam is not None
+
+    @property
+    def users(self) -> int:
+        return self._users
+
+    def acquire(self, size=None):
+        """Giữ camera cho 1 user lâu dài; chưa ai giữ thì đổi sang `size` trước khi chạy."""
+        with self._lock:
+            if self._users == 0 and size is not None:
+                self.reconfigure(size=size)
+            self._users += 1
+            try:
+                self.start()
+            except Exception:
+                self._users -= 1
+                raise
+            return self
+
+    def release(self):
+        """Nhả lease; lease cuối + không ai cần camera ấm -> tắt camera."""
+        with self._lock:
+            self._users = max(0, self._users - 1)
+            if self._users == 0 and not self._keep_warm:
+                self.stop()
+
+    def start(self):
+        """Mở + cấu hình camera (idempotent)."""
+        with self._lock:
+            if self._cam is not None:
+                return
+            from picamera2 import Picamera2
+            cam = Picamera2()
+            kwargs = {}
+            if self.hflip or self.vflip:
+                from libcamera import Transform
+                kwargs["transform"] = Transform(hflip=int(self.hflip), vflip=int(self.vflip))
+            # "RGB888" của Picamera2 có thứ tự byte B,G,R -> dùng thẳng cho OpenCV
+            config = cam.create_video_configuration(
+                main={"size": self.size, "format": "RGB888"}, buffer_count=2, **kwargs)
+            cam.configure(config)
+            try:
+                cam.start()
+            except Exception:
+                cam.close()
+                raise
+            time.sleep(self.warmup_s)
+            self._cam = cam
+            print(f"[Camera] Service started {self.size[0]}x{self.size[1]}")
+
+    def stop(self):
+        with self._lock:
+            cam, self._cam = self._cam, None
+            self._keep_warm = False
+            if cam is None:
+                return
+            try:
+                cam.stop()
+            except Exception:
+                pass
+            try:
+                cam.close()
+            except Exception:
+                pass
+            print("[Camera] Service stopped")
+
+    def reconfigure(self, size=None, hflip=None, vflip=None):
+        """Đổi độ phân giải/lật ảnh. Chỉ restart camera nếu thực sự khác."""
+        with self._lock:
+            new_size = self.size if size is None else (int(size[0]), int(size[1]))
+            new_h = self.hflip if hflip is None else bool(hflip)
+            new_v = self.vflip if vflip is None else bool(vflip)
+            if (new_size, new_h, new_v) == (self.size, self.hflip, self.vflip):
+                return
+            if self._users:
+                # Đang stream: restart sẽ cắt stream -> giữ cấu hình, caller nhận frame hiện tại
+                print(f"[Camera] Đang có {self._users} user, giữ {self.size[0]}x{self.size[1]} "
+                      f"(bỏ qua yêu cầu {new_size[0]}x{new_size[1]})")
+                return
+            was_running = self.running
+            self.stop()
+            self.size, self.hflip, self.vflip = new_size, new_h, new_v
+            if was_running:
+                self.start()
+
+    def capture_array(self, keep_warm=True):
+        """Lấy frame BGR (numpy HxWx3) mới nhất từ stream.
+
+        keep_warm=False dành cho user đã acquire(): lần chụp không đánh dấu camera
+        là cần giữ ấm sau khi lease cuối được nhả.
+        """
+        with self._lock:
+            if keep_warm:
+                self._keep_warm = True
+            self.start()
+            return self._cam.capture_array("main")
+
+    def capture_jpeg_bytes(self, quality=80) -> bytes:
+        import cv2
+        frame = self.capture_array()
+        ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        if not ok:
+            raise RuntimeError("cv2.imencode JPEG thất bại")
+        return buf.tobytes()
+
+    def capture_jpeg(self, path: str, quality=80):
+        """Giống capture_jpeg_cli: ghi file, trả (path, ts_utc_iso)."""
+        data = self.capture_jpeg_bytes(quality=quality)
+        ts = datetime.utcnow().isoformat()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path, ts
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_service(size=None, hflip=None, vflip=None) -> CameraService:
+    """Singleton cho cả tiến trình (camera chỉ mở được bởi 1 chủ). None = giữ cấu hình hiện tại."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = CameraService(size=size or DEFAULT_SIZE, hflip=bool(hflip), vflip=bool(vflip))
+            atexit.register(_service.stop)
+        else:
+            _service.reconfigure(size=size, hflip=hflip, vflip=vflip)
+        return _service
+
+
+def release_service():
+    """Nhả camera nếu service đang giữ (vd trước khi mở preview dùng Picamera2 riêng)."""
+    with _service_lock:
+        if _service is not None:
+            _service.stop()
+
+
+def capture_jpeg(path: str, width=1280, height=720, quality=80, hflip=False, vflip=False):
+    """
+    Chụp JPEG qua camera service (nhanh, camera giữ mở); lỗi thì fallback CLI.
+    Cùng chữ ký/kết quả với capture_jpeg_cli để thay thế trực tiếp.
+    """
+    try:
+        svc = get_service(size=(width, height), hflip=hflip, vflip=vflip)
+        return svc.capture_jpeg(path, quality=quality)
+    except Exception as e:
+        print(f"[Camera] Service không dùng được ({e}), fallback rpicam-still")
+        return capture_jpeg_cli(path, width=width, height=height, quality=quality,
+                                hflip=hflip, vflip=vflip)
+
+
+if __name__ == "__main__":
+    # Đo nhanh độ trễ chụp khi camera đã "ấm"
+    svc = get_service()
+    svc.start()
+    for i in range(5):
+        t0 = time.perf_counter()
+        jpg = svc.capture_jpeg_bytes()
+        print(f"Shot {i+1}: {len(jpg)} bytes in {(time.perf_counter() - t0) * 1000:.1f} ms")
+    svc.stop()
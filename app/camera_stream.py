@@ -0,0 +1,153 @@
+# app/camera_stream.py
+"""
+MJPEG stream dùng chung 1 producer cho nhiều client HTTP.
+
+- Producer duy nhất giữ CameraService (acquire ở đúng stream_resolution -> ISP trả
+  frame cỡ stream, không resize trên CPU), encode JPEG 1 lần/tick
+  (tick = tốc độ của client đòi nhanh nhất), rồi phát cho mọi client.
+- Mỗi client tự giới hạn fps của mình (chỉ lấy frame mới nhất khi tới lượt),
+  nên thêm viewer không làm tăng CPU encode.
+- Không còn viewer -> sau IDLE_RELEASE_S producer dừng và nhả lease camera
+  (camera chỉ tắt khi không còn ai khác dùng, xem CameraService.release).
+"""
+import threading
+import time
+
+from app.camera_service import get_service
+
+BOUNDARY = "frame"
+DEFAULT_FPS = 10.0
+MAX_FPS = 30.0
+IDLE_RELEASE_S = 5.0
+
+
+class MjpegBroadcaster:
+    def __init__(self, size=(960, 540), quality=70, idle_release_s=IDLE_RELEASE_S):
+        self.size = (int(size[0]), int(size[1]))
+        self.quality = int(quality)
+        self.idle_release_s = idle_release_s
+        self._cond = threading.Condition()
+        self._clients = {}          # client_id -> fps yêu cầu
+        self._next_id = 0
+        self._frame = None          # bytes JPEG mới nhất
+        self._seq = 0
+        self._thread = None
+        self.encoded_frames = 0
+
+    @property
+    def viewers(self) -> int:
+        with self._cond:
+            return len(self._clients)
+
+    def _target_fps(self) -> float:
+        return max(self._clients.values()) if self._clients else 0.0
+
+    def _register(self, fps: float) -> tuple:
+        with self._cond:
+            cid = self._next_id
+            self._next_id += 1
+            self._clients[cid] = fps
+            self._ensure_producer()
+            self._cond.notify_all()
+            # Bỏ qua frame cũ còn sót từ phiên trước, chờ frame mới
+            return cid, self._seq
+
+    def _ensure_producer(self):
+        # Gọi khi đang giữ self._cond
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mjpeg-producer", daemon=True)
+            self._thread.start()
+
+    def _unregister(self, cid: int):
+        with self._cond:
+            self._clients.pop(cid, None)
+            self._cond.notify_all()
+
+    def _run(self):
+        import cv2
+        svc = None
+        idle_since = None
+        print("[Stream] Producer started")
+        try:
+            svc = get_service().acquire(size=self.size)
+            while True:
+                with self._cond:
+                    fps = self._target_fps()
+                    if fps <= 0:
+                        idle_since = idle_since or time.monotonic()
+                        if time.monotonic() - idle_since >= self.idle_release_s:
+                            break
+                        self._cond.wait(timeout=0.5)
+                        continue
+                    idle_since = None
+
+                t0 = time.monotonic()
+                frame = svc.capture_array(keep_warm=False)
+                # Chỉ xảy ra khi camera đang bị user khác giữ ở cỡ khác
+                if (frame.shape[1], frame.shape[0]) != self.size:
+                    frame = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+                ok, buf = cv2.imencode(".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), self.quality])
+                if ok:
+                    with self._cond:
+                        self._frame = buf.tobytes()
+                        self._seq += 1
+                        self.encoded_frames += 1
+                        self._cond.notify_all()
+                delay = 1.0 / fps - (time.monotonic() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            print(f"[Stream] Producer lỗi: {e}")
+            with self._cond:
+                # Báo các client đang chờ kết thúc stream
+                self._clients.clear()
+        finally:
+            if svc is not None:
+                svc.release()
+            print("[Stream] Producer stopped")
+            with self._cond:
+                self._thread = None
+                # Có viewer mới vào đúng lúc đang nhả camera -> chạy producer lại
+                if self._clients:
+                    self._ensure_producer()
+                self._cond.notify_all()
+
+    def frames(self, fps: float = DEFAULT_FPS):
+        """Generator multipart MJPEG cho 1 client, tối đa `fps` khung/giây."""
+        fps = min(max(float(fps), 0.1), MAX_FPS)
+        period = 1.0 / fps
+        cid, last_seq = self._register(fps)
+        try:
+            while True:
+                t0 = time.monotonic()
+                with self._cond:
+                    while self._seq == last_seq:
+                        if cid not in self._clients:
+                            return   # producer lỗi -> kết thúc stream
+                        self._cond.wait(timeout=1.0)
+                    data, last_seq = self._frame, self._seq
+                yield (b"--" + BOUNDARY.encode() + b"\r\n"
+                       b"Content-Type: image/jpeg\r\n"
+                       b"Content-Length: " + str(len(data)).encode() + b"\r\n\r\n"
+                       + data + b"\r\n")
+                # Client chậm hơn producer: bỏ qua các frame ở giữa, chỉ lấy mới nhất
+                delay = period - (time.monotonic() - t0)
+                if delay > 0:
+                    time.sleep(delay)
+        finally:
+            self._unregister(cid)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster(cfg: dict = None) -> MjpegBroadcaster:
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            cam_cfg = (cfg or {}).get("camera", {}) or {}
+            _broadcaster = MjpegBroadcaster(
+                size=tuple(cam_cfg.get("stream_resolution", cam_cfg.get("resolution", (960, 540)))),
+                quality=cam_cfg.get("stream_quality", 70))
+        return _broadcaster
@@ -0,0 +1,94 @@
+# app/canopy.py
+"""
+Phân tích tán lá (canopy) ngay trên Pi từ frame camera, vector hoá bằng NumPy.
+
+compute_metrics(frame_bgr) trả:
+  {
+    "green_ratio": 0..1,      # tỉ lệ pixel "xanh lá" theo chỉ số ExG
+    "exg_mean": float,        # ExG trung bình toàn khung
+    "brightness": 0..255,     # độ sáng trung bình (luma)
+    "growth_area_m2": float,  # ước lượng diện tích lá = green_ratio * fov_area_m2
+  }
+
+ExG (Excess Green) = 2g - r - b với r,g,b là toạ độ màu chuẩn hoá (R/(R+G+B)...).
+"""
+import time
+
+import numpy as np
+
+DEFAULTS = {
+    "exg_threshold": 0.05,   # ExG > ngưỡng -> coi là lá
+    "min_intensity": 60,     # R+G+B tối thiểu, bỏ pixel quá tối (nhiễu ban đêm)
+    "downsample": 4,         # lấy 1 pixel mỗi N theo mỗi chiều (1280x720 -> 320x180)
+    "fov_area_m2": 1.0,      # diện tích mặt phẳng luống mà camera nhìn thấy
+}
+
+
+def canopy_config(cfg: dict) -> dict:
+    c = dict(DEFAULTS)
+    c.update(((cfg or {}).get("camera", {}) or {}).get("canopy", {}) or {})
+    return c
+
+
+def compute_metrics(frame_bgr, exg_threshold=DEFAULTS["exg_threshold"],
+                    min_intensity=DEFAULTS["min_intensity"],
+                    downsample=DEFAULTS["downsample"],
+                    fov_area_m2=DEFAULTS["fov_area_m2"]) -> dict:
+    """Tính chỉ số canopy cho 1 frame BGR (HxWx3 uint8). Không copy frame gốc."""
+    step = max(1, int(downsample))
+    px = frame_bgr[::step, ::step, :3].astype(np.float32)   # view -> 1 lần cast
+    b, g, r = px[..., 0], px[..., 1], px[..., 2]
+    total = b + g + r
+    valid = total >= float(min_intensity)
+    denom = np.where(total > 0, total, 1.0)
+    exg = (2.0 * g - r - b) / denom
+    exg = np.where(valid, exg, 0.0)
+
+    green = exg > float(exg_threshold)
+    green_ratio = float(green.mean())
+    brightness = float((0.114 * b + 0.587 * g + 0.299 * r).mean())
+    return {
+        "green_ratio": round(green_ratio, 4),
+        "exg_mean": round(float(exg.mean()), 4),
+        "brightness": round(brightness, 1),
+        "growth_area_m2": round(green_ratio * float(fov_area_m2), 4),
+    }
+
+
+def metrics_from_config(frame_bgr, cfg: dict) -> dict:
+    c = canopy_config(cfg)
+    return compute_metrics(frame_bgr, exg_threshold=c["exg_threshold"],
+                           min_intensity=c["min_intensity"], downsample=c["downsample"],
+                           fov_area_m2=c["fov_area_m2"])
+
+
+class CanopyChangeGate:
+    """
+    Quyết định có cần gửi ảnh full hay không: chỉ khi canopy thay đổi đáng kể
+    hoặc đã quá lâu kể từ lần gửi trước. Metric luôn được gửi kèm reading.
+    """
+
+    def __init__(self, green_ratio_delta=0.02, brightness_delta=20.0, max_interval_s=3600):
+        self.green_ratio_delta = float(green_ratio_delta)
+        self.brightness_delta = float(brightness_delta)
+        self.max_interval_s = float(max_interval_s)
+        self._last = None
+        self._last_ts = None
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        c = (canopy_config(cfg).get("image_on_change") or {})
+        return cls(green_ratio_delta=c.get("green_ratio_delta", 0.02),
+                   brightness_delta=c.get("brightness_delta", 20.0),
+                   max_interval_s=c.get("max_interval_s", 3600))
+
+    def should_upload(self, metrics: dict, now: float = None) -> bool:
+        now = time.time() if now is None else now
+        if self._last is None or now - self._last_ts >= self.max_interval_s:
+            return True
+        return (abs(metrics["green_ratio"] - self._last["green_ratio"]) >= self.green_ratio_delta
+                or abs(metrics["brightness"] - self._last["brightness"]) >= self.brightness_delta)
+
+    def mark_uploaded(self, metrics: dict, now: float = None):
+        self._last = dict(metrics)
+        self._last_ts = time.time() if now is None else now
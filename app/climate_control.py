@@ -0,0 +1,381 @@
+# app/climate_control.py
+"""
+Điều khiển phản hồi (feedback) khí hậu: soil.hum_pct -> pump, env.temp_c -> fan1/fan2.
+
+- Bộ điều khiển: PID (chống windup, đạo hàm theo giá trị đo) hoặc bang-bang có
+  hysteresis, chọn theo từng vòng trong settings.yml -> climate_control.
+- Relay không điều chế được -> PID ra duty 0..1, TimeProportionalRelay bật
+  duty * window_s giây đầu mỗi cửa sổ: tối đa 1 lần bật/tắt mỗi cửa sổ, duty quá
+  nhỏ/quá lớn so với min_on_s/min_off_s được dồn sang cửa sổ sau (không mất năng lượng).
+- Nhiều output (fan1, fan2) = bậc: duty 0..0.5 chạy fan1, 0.5..1 thêm fan2.
+- Reading vào bất đồng bộ (listener SensorCache chỉ ghi giá trị mới nhất);
+  vòng điều khiển chạy ở luồng riêng theo tick_s. Reading cũ quá stale_s -> tắt output.
+
+Chỉnh tham số offline bằng mô hình nhà kính đơn giản:
+    python -m app.climate_control --simulate --hours 24
+    python -m app.climate_control --simulate --mode hysteresis
+"""
+import threading
+import time
+
+from app.aggregator import flatten_reading
+
+
+def _clamp(v, lo, hi):
+    return lo if v < lo else hi if v > hi else v
+
+
+class PID:
+    """PID dạng song song, output kẹp [out_min, out_max], chống windup bằng tích phân có điều kiện."""
+
+    def __init__(self, kp: float, ki: float = 0.0, kd: float = 0.0, out_min=0.0, out_max=1.0):
+        self.kp, self.ki, self.kd = float(kp), float(ki), float(kd)
+        self.out_min, self.out_max = float(out_min), float(out_max)
+        self.reset()
+
+    def reset(self):
+        self._i = 0.0
+
+    def update(self, error: float, dt: float, d_error: float = 0.0) -> float:
+        """error: sai số có dấu (dương -> cần tăng output). d_error: tốc độ đổi sai số (/s)."""
+        p = self.kp * error
+        i = self._i + self.ki * error * dt
+        u = p + i + self.kd * d_error
+        # Output đã bão hoà mà sai số còn đẩy tiếp cùng chiều -> không tích phân thêm
+        if not ((u > self.out_max and error > 0) or (u < self.out_min and error < 0)):
+            self._i = _clamp(i, self.out_min, self.out_max)
+        return _clamp(p + self._i + self.kd * d_error, self.out_min, self.out_max)
+
+
+class Hysteresis:
+    """Bang-bang có vùng chết; nhiều bậc thì ngưỡng bậc i lệch thêm i * band."""
+
+    def __init__(self, band: float, stages: int = 1):
+        self.band = float(band)
+        self.stages = max(1, int(stages))
+        self._on = [False] * self.stages
+
+    def reset(self):
+        self._on = [False] * self.stages
+
+    def update(self, error: float) -> list:
+        """error > 0 nghĩa là cần tác động (vd nhiệt cao hơn setpoint cho quạt)."""
+        half = self.band / 2.0
+        for i in range(self.stages):
+            offset = i * self.band
+            if error > half + offset:
+                self._on[i] = True
+            elif error < -half + offset:
+                self._on[i] = False
+        return [1.0 if on else 0.0 for on in self._on]
+
+
+class TimeProportionalRelay:
+    """
+    Relay chạy theo duty trong cửa sổ window_s (duty chốt ở đầu mỗi cửa sổ).
+    immediate=True (bang-bang): duty 0/1 áp ngay, chỉ tôn trọng min_on_s/min_off_s.
+    """
+
+    def __init__(self, window_s: float, min_on_s: float = 0.0, min_off_s: float = 0.0,
+                 immediate: bool = False):
+        self.window_s = float(window_s)
+        self.min_on_s = float(min_on_s)
+        self.min_off_s = float(min_off_s)
+        self.immediate = immediate
+        self.duty = 0.0
+        self.state = False
+        self.cycles = 0               # số lần chuyển OFF -> ON
+        self._window_start = None
+        self._on_until = 0.0
+        self._carry = 0.0             # giây bật còn nợ / dư từ cửa sổ trước
+        self._changed_at = -1e18
+
+    def set_duty(self, duty: float):
+        self.duty = _clamp(float(duty), 0.0, 1.0)
+
+    def force_off(self, now: float):
+        self.duty, self._carry = 0.0, 0.0
+        self._on_until = now
+        self._set(False, now)
+
+    def _set(self, on: bool, now: float):
+        if on != self.state:
+            if on:
+                self.cycles += 1
+            self.state = on
+            self._changed_at = now
+
+    def update(self, now: float) -> bool:
+        if self.immediate:
+            want = self.duty >= 0.5
+            held = now - self._changed_at
+            if want != self.state and held >= (self.min_on_s if self.state else self.min_off_s):
+                self._set(want, now)
+            return self.state
+
+        if self._window_start is None or now - self._window_start >= self.window_s:
+            self._window_start = now
+            wanted = self.duty * self.window_s + self._carry
+            on_s = _clamp(wanted, 0.0, self.window_s)
+            if on_s < self.min_on_s:
+                on_s = 0.0
+            elif self.window_s - on_s < self.min_off_s:
+                on_s = self.window_s
+            self._carry = _clamp(wanted - on_s, -self.window_s, self.window_s)
+            self._on_until = now + on_s
+        self._set(now < self._on_until, now)
+        return self.state
+
+
+class ControlLoop:
+    """1 vòng: metric -> bộ điều khiển -> 1..n relay (bậc)."""
+
+    def __init__(self, spec: dict):
+        self.name = spec.get("name") or spec["metric"]
+        self.metric = spec["metric"]
+        self.setpoint = float(spec["setpoint"])
+        # raise: output làm TĂNG giá trị (bơm -> độ ẩm), lower: làm GIẢM (quạt -> nhiệt độ)
+        self.sign = 1.0 if str(spec.get("action", "raise")).lower() == "raise" else -1.0
+        self.mode = str(spec.get("mode", "pid")).lower()
+        self.sample_s = float(spec.get("sample_s", 5))
+        self.outputs = list(spec.get("outputs") or [])
+        if not self.outputs:
+            raise ValueError(f"Loop {self.name}: cần outputs")
+        p = spec.get("pid", {}) or {}
+        self.pid = PID(p.get("kp", 0.1), p.get("ki", 0.0), p.get("kd", 0.0))
+        self.hyst = Hysteresis((spec.get("hysteresis", {}) or {}).get("band", 2.0), len(self.outputs))
+        immediate = self.mode == "hysteresis"
+        self.relays = {dev: TimeProportionalRelay(spec.get("window_s", 120), spec.get("min_on_s", 0),
+                                                  spec.get("min_off_s", 0), immediate=immediate)
+                       for dev in self.outputs}
+        self.pv = None
+        self.pv_t = None
+        self.output = 0.0
+        self._last_sample = None
+        self._last_error = None
+
+    def on_value(self, v: float, t: float):
+        self.pv, self.pv_t = float(v), t
+
+    def _duties(self, error: float, dt: float, d_error: float) -> list:
+        n = len(self.outputs)
+        if self.mode == "hysteresis":
+            duties = self.hyst.update(error)
+            self.output = sum(duties) / n
+            return duties
+        self.output = self.pid.update(error, dt, d_error)
+        # Chia bậc: output * n -> bậc 0 đầy trước rồi mới tới bậc 1...
+        return [_clamp(self.output * n - i, 0.0, 1.0) for i in range(n)]
+
+    def step(self, now: float, stale_s: float) -> dict:
+        """Trả {device: bool} trạng thái relay mong muốn tại thời điểm now."""
+        if self.pv is None or now - self.pv_t > stale_s:
+            # Mất dữ liệu cảm biến -> an toàn: tắt hết, xoá tích phân
+            for relay in self.relays.values():
+                relay.force_off(now)
+            self.pid.reset()
+            self.hyst.reset()
+            self._last_sample, self._last_error = None, None
+            self.output = 0.0
+            return {dev: False for dev in self.outputs}
+
+        if self._last_sample is None or now - self._last_sample >= self.sample_s:
+            error = self.sign * (self.setpoint - self.pv)
+            dt = self.sample_s if self._last_sample is None else now - self._last_sample
+            d_error = 0.0 if self._last_error is None else (error - self._last_error) / dt
+            for dev, duty in zip(self.outputs, self._duties(error, dt, d_error)):
+                self.relays[dev].set_duty(duty)
+            self._last_sample, self._last_error = now, error
+        return {dev: relay.update(now) for dev, relay in self.relays.items()}
+
+
+class ClimateController:
+    """Gom các vòng, nhận reading bất đồng bộ, áp thay đổi relay qua gpio.apply_batch."""
+
+    def __init__(self, loops, gpio=None, tick_s: float = 1.0, stale_s: float = 60.0):
+        self.loops = list(loops)
+        self.gpio = gpio
+        self.tick_s = float(tick_s)
+        self.stale_s = float(stale_s)
+        self._by_metric = {}
+        for lp in self.loops:
+            self._by_metric.setdefault(lp.metric, []).append(lp)
+        self._applied = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @classmethod
+    def from_config(cls, cfg: dict, gpio=None):
+        c = (cfg or {}).get("climate_control", {}) or {}
+        return cls([ControlLoop(s) for s in c.get("loops") or []], gpio=gpio,
+                   tick_s=c.get("tick_s", 1), stale_s=c.get("stale_s", 60))
+
+    def on_reading(self, reading: dict, now: float = None):
+        """Listener SensorCache: chỉ ghi giá trị mới nhất, không chặn vòng đọc."""
+        now = time.monotonic() if now is None else now
+        flat = flatten_reading(reading)
+        with self._lock:
+            for metric in self._by_metric.keys() & flat.keys():
+                for lp in self._by_metric[metric]:
+                    lp.on_value(flat[metric], now)
+
+    def step(self, now: float = None) -> dict:
+        now = time.monotonic() if now is None else now
+        desired = {}
+        with self._lock:
+            for lp in self.loops:
+                desired.update(lp.step(now, self.stale_s))
+        changes = [(dev, on) for dev, on in desired.items() if self._applied.get(dev) != on]
+        if changes and self.gpio is not None:
+            ok, results = self.gpio.apply_batch(changes)
+            if not ok:
+                return desired
+            # Lệnh bị hoãn (min dwell / giới hạn tần suất) hoặc bị lệnh khác thay chưa áp:
+            # không ghi nhận, tick sau gửi lại (hoặc gửi trạng thái ngược để huỷ lệnh hoãn)
+            changes = [c for c, r in zip(changes, results) if "pending" not in r and not r.get("superseded")]
+        for dev, on in changes:
+            self._applied[dev] = on
+        return desired
+
+    def _run(self):
+        next_due = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.step()
+            except Exception as e:
+                print(f"[Climate] Lỗi: {e}")
+            next_due += self.tick_s
+            self._stop.wait(max(0.0, next_due - time.monotonic()))
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="climate-control", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def start_climate_control(cfg: dict, gpio):
+    """Gắn vào SensorCache của tiến trình chủ GPIO (app.py) và chạy luồng điều khiển."""
+    from app.sensor_cache import get_sensor_cache
+    ctl = ClimateController.from_config(cfg, gpio=gpio)
+    get_sensor_cache(cfg).add_listener(ctl.on_reading)
+    ctl.start()
+    print(f"[Climate] {len(ctl.loops)} vòng: " +
+          ", ".join(f"{lp.metric}->{'/'.join(lp.outputs)} ({lp.mode})" for lp in ctl.loops))
+    return ctl
+
+
+# ===== Mô phỏng offline =====
+class GreenhousePlant:
+    """
+    Mô hình nhà kính 1 nút, bước 1 s:
+      - nhiệt: kéo về T_drive (ngoài trời + nắng) với hằng số 20 phút; mỗi quạt kéo về
+        nhiệt ngoài trời với hằng số ~7 phút
+      - độ ẩm đất: bốc hơi ~3 %/h quanh 35 %, bơm +0.05 %/s, trễ thấm 60 s
+    """
+
+    def __init__(self, t0_h: float = 0.0, seed: int = 1):
+        import random
+        self.rng = random.Random(seed)
+        self.t = t0_h * 3600.0
+        self.temp = 27.0
+        self.soil = 33.0
+        self._water = [0.0] * 60      # hàng đợi trễ thấm nước
+
+    def _outdoor(self):
+        import math
+        phase = math.sin((self.t / 3600.0 - 9.0) / 24.0 * 2 * math.pi)   # đỉnh ~15h
+        return 26.0 + 3.0 * phase, 26.0 + 3.0 * phase + 10.0 * max(0.0, phase)
+
+    def step(self, relays: dict, dt: float = 1.0):
+        t_out, t_drive = self._outdoor()
+        fans = int(bool(relays.get("fan1"))) + int(bool(relays.get("fan2")))
+        self.temp += ((t_drive - self.temp) / 1200.0 - fans * (self.temp - t_out) / 400.0) * dt
+        self._water.append(0.05 * dt if relays.get("pump") else 0.0)
+        self.soil += self._water.pop(0) - 3.0 / 3600.0 * (self.soil - 10.0) / 25.0 * dt
+        self.t += dt
+
+    def reading(self) -> dict:
+        return {"ts": self.t,
+                "env": {"temp_c": round(self.temp + self.rng.gauss(0, 0.1), 2)},
+                "soil": {"hum_pct": round(self.soil + self.rng.gauss(0, 0.3), 1)}}
+
+
+def simulate(cfg: dict, hours: float = 24.0, mode: str = None, read_every_s: float = 1.0) -> dict:
+    """Chạy vòng kín trên GreenhousePlant, trả thống kê từng vòng."""
+    c = dict((cfg or {}).get("climate_control", {}) or {})
+    specs = [dict(s, mode=mode) if mode else dict(s) for s in c.get("loops") or []]
+    ctl = ClimateController([ControlLoop(s) for s in specs], gpio=None,
+                            tick_s=c.get("tick_s", 1), stale_s=c.get("stale_s", 60))
+    plant = GreenhousePlant()
+    stats = {lp.name: {"abs_err": 0.0, "in_band": 0, "n": 0} for lp in ctl.loops}
+    states, next_read = {}, 0.0
+    steps = int(hours * 3600)
+    for i in range(steps):
+        now = float(i)
+        if now >= next_read:
+            ctl.on_reading(plant.reading(), now=now)
+            next_read += read_every_s
+        states = ctl.step(now)
+        plant.step(states)
+        if i >= 3600:                  # bỏ 1 h đầu (khởi động)
+            for lp in ctl.loops:
+                pv = plant.temp if lp.metric == "env.temp_c" else plant.soil
+                # Lệch về phía output không sửa được (vd đêm lạnh, quạt đang tắt) thì không tính lỗi
+                no_authority = lp.sign * (lp.setpoint - pv) < 0 and not any(states.get(d) for d in lp.outputs)
+                err = 0.0 if no_authority else abs(pv - lp.setpoint)
+                band = lp.hyst.band / 2.0
+                s = stats[lp.name]
+                s["abs_err"] += err
+                s["in_band"] += err <= band
+                s["n"] += 1
+    out = {}
+    for lp in ctl.loops:
+        s = stats[lp.name]
+        out[lp.name] = {
+            "mode": lp.mode,
+            "mean_abs_err": round(s["abs_err"] / max(1, s["n"]), 3),
+            "in_band_pct": round(100.0 * s["in_band"] / max(1, s["n"]), 1),
+            "cycles": {dev: r.cycles for dev, r in lp.relays.items()},
+        }
+    return out
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.config import load_config
+
+    ap = argparse.ArgumentParser(description="Điều khiển khí hậu PID / hysteresis")
+    ap.add_argument("--simulate", action="store_true", help="chạy mô phỏng offline")
+    ap.add_argument("--hours", type=float, default=24.0)
+    ap.add_argument("--mode", choices=["pid", "hysteresis"], help="ghi đè mode của mọi vòng")
+    ap.add_argument("--config", default="config/settings.yml")
+    args = ap.parse_args()
+    cfg = load_config(args.config) or {}
+
+    if args.simulate:
+        for name, r in simulate(cfg, args.hours, args.mode).items():
+            print(f"[Sim] {name:8s} {r['mode']:10s} |sai số| TB {r['mean_abs_err']:.2f}  "
+                  f"trong dải {r['in_band_pct']:5.1f}%  số lần bật {r['cycles']}")
+    else:
+        from app import gpio_controller as gpio
+        gpio.configure(cfg.get("gpio"))
+        if not gpio.init_gpio() or not gpio.is_owner():
+            raise SystemExit(f"GPIO đang thuộc tiến trình khác (pid {gpio.owner_pid()}). "
+                             "Bật climate_control.enabled trong tiến trình đó thay vì chạy riêng.")
+        ctl = start_climate_control(cfg, gpio)
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            ctl.stop()
+            gpio.cleanup_gpio()
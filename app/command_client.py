@@ -0,0 +1,190 @@
+# app/command_client.py
+"""
+Kênh lệnh kéo (pull) từ server: Pi nằm sau NAT của nhà mạng nên server không gọi
+được POST /api/iot/control. Pi tự mở 1 kết nối long-poll ra ngoài (requests.Session,
+keep-alive), server giữ request tới khi có lệnh hoặc hết wait_s -> lệnh tới gần như
+ngay lập tức mà không phải poll dày.
+
+Giao thức (server phải hỗ trợ):
+  GET  {base}/api/iot/commands/poll?deviceId=..&cursor=..&wait=25
+       -> 200 {"commands": [{"id": "...", "body": {...}}], "cursor": "..."}
+       -> 204 (hết wait mà không có lệnh)
+  POST {base}/api/iot/commands/{id}/ack
+       {"deviceId", "status": <http code>, "result": {...}, "revision": N}
+"body" đúng định dạng POST /api/iot/control (xử lý chung qua app/control.py),
+"result"/"status" là đúng những gì route REST sẽ trả.
+
+Lệnh đã áp dụng được nhớ theo id: server gửi lại (vì ack trước bị mất) thì chỉ
+ack lại kết quả cũ, không áp dụng lần 2 (quan trọng với "toggle"). Lệnh không có id
+thì không áp dụng (không chống lặp được) và cũng không ack được (ack gửi theo id):
+chỉ ghi log + đếm vào `rejected`.
+"revision" trong ack là revision do chính lệnh đó tạo ra; lệnh không đổi gì (trùng
+trạng thái / bị hoãn) thì là revision lúc nhận lệnh.
+
+Chạy độc lập (khi không chạy web server):
+    python -m app.command_client
+"""
+import collections
+import random
+import threading
+
+from app.control import handle_control
+
+
+class CommandClient:
+    def __init__(self, gpio, api_base: str, device_id: str, token: str = None,
+                 wait_s: float = 25.0, max_backoff_s: float = 60.0):
+        self.gpio = gpio
+        self.base = api_base.rstrip("/") + "/api/iot/commands"
+        self.device_id = device_id
+        self.token = token
+        self.wait_s = float(wait_s)
+        self.max_backoff_s = float(max_backoff_s)
+        self.cursor = None
+        self._session = None
+        self._done = collections.OrderedDict()   # id -> ack payload (giữ DONE_MAX cái gần nhất)
+        self._inbox = collections.deque()          # lệnh đã nhận (cursor đã qua) nhưng chưa xử lý xong
+        self._pending_acks = collections.deque()
+        self._stop = threading.Event()
+        self._thread = None
+        self.applied = 0
+        self.rejected = 0
+
+    DONE_MAX = 256
+
+    @classmethod
+    def from_config(cls, gpio, cfg: dict):
+        c = (cfg or {}).get("command_channel", {}) or {}
+        return cls(gpio, c.get("api_base", "https://h2-api-z7sq.onrender.com"),
+                   c.get("device_id") or (cfg or {}).get("device_id") or "UNKNOWN",
+                   token=c.get("token"), wait_s=c.get("wait_s", 25),
+                   max_backoff_s=c.get("max_backoff_s", 60))
+
+    # ---------- HTTP ----------
+    def _http(self):
+        if self._session is None:
+            import requests
+            s = requests.Session()
+            if self.token:
+                s.headers["Authorization"] = f"Bearer {self.token}"
+            self._session = s
+        return self._session
+
+    def poll_once(self) -> list:
+        """1 long-poll. Trả list lệnh (rỗng nếu hết wait)."""
+        params = {"deviceId": self.device_id, "wait": int(self.wait_s)}
+        if self.cursor is not None:
+            params["cursor"] = self.cursor
+        # Timeout đọc rộng hơn wait để server kịp trả 204
+        r = self._http().get(self.base + "/poll", params=params,
+                             timeout=(10, self.wait_s + 15))
+        if r.status_code == 204:
+            return []
+        r.raise_for_status()
+        j = r.json() or {}
+        if j.get("cursor") is not None:
+            self.cursor = j["cursor"]
+        return j.get("commands") or []
+
+    def _send_ack(self, ack: dict):
+        r = self._http().post(f"{self.base}/{ack['id']}/ack", json=ack, timeout=15)
+        r.raise_for_status()
+
+    def _flush_acks(self):
+        while self._pending_acks:
+            self._send_ack(self._pending_acks[0])
+            self._pending_acks.popleft()
+
+    # ---------- xử lý lệnh ----------
+    def apply(self, cmd: dict) -> dict:
+        """
+        Áp dụng 1 lệnh (hoặc lấy lại kết quả cũ nếu id đã làm). Trả payload ack.
+        Lệnh thiếu id -> ack status 400 với "id": None, không áp dụng, không nhớ.
+        """
+        cid = cmd.get("id") if isinstance(cmd, dict) else None
+        if cid is None or str(cid).strip() == "":
+            self.rejected += 1
+            print(f"[Command] Bỏ lệnh không có id: {cmd!r}")
+            return {"id": None, "deviceId": self.device_id, "status": 400,
+                    "result": {"status": "FAILED", "error": "Missing command id"}, "revision": None}
+        cid = str(cid)
+        if cid in self._done:
+            return self._done[cid]
+        if self.gpio is None:
+            body, code, revision = {"error": "GPIO not available"}, 503, None
+        else:
+            revision = self.gpio.get_state_snapshot()[0]
+            self.gpio.committed_revision(clear=True)
+            body, code = handle_control(self.gpio, cmd.get("body"))
+            produced = self.gpio.committed_revision(clear=True)
+            if produced is not None:
+                revision = produced
+        ack = {"id": cid, "deviceId": self.device_id, "status": code,
+               "result": body, "revision": revision}
+        self._done[cid] = ack
+        while len(self._done) > self.DONE_MAX:
+            self._done.popitem(last=False)
+        self.applied += 1
+        print(f"[Command] {cid} -> {code} (revision {revision})")
+        return ack
+
+    def step(self):
+        """Gửi ack còn nợ, 1 long-poll, áp dụng + ack từng lệnh theo thứ tự."""
+        self._flush_acks()
+        if not self._inbox:
+            self._inbox.extend(self.poll_once())
+        while self._inbox:
+            ack = self.apply(self._inbox.popleft())
+            if ack["id"] is not None:      # không có id thì không có URL để ack
+                self._pending_acks.append(ack)
+            self._flush_acks()
+
+    # ---------- vòng chạy ----------
+    def run(self):
+        failures = 0
+        print(f"[Command] Long-poll {self.base} (deviceId={self.device_id}, wait={self.wait_s:.0f}s)")
+        while not self._stop.is_set():
+            try:
+                self.step()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                # Backoff mũ + jitter: mất mạng không biến thành poll dồn dập
+                delay = min(self.max_backoff_s, 2 ** min(failures, 6)) * (0.5 + random.random() / 2)
+                print(f"[Command] Lỗi ({e}), thử lại sau {delay:.1f}s")
+                self._stop.wait(delay)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="command-client", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._session is not None:
+            try:
+                self._session.close()   # vòng chạy dừng sau lần poll hiện tại
+            except Exception:
+                pass
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+if __name__ == "__main__":
+    from app.config import load_config
+    from app import gpio_controller as gpio
+
+    cfg = load_config("config/settings.yml") or {}
+    gpio.configure(cfg.get("gpio"))
+    if not gpio.init_gpio() or not gpio.is_owner():
+        raise SystemExit(f"GPIO đang thuộc tiến trình khác (pid {gpio.owner_pid()}). "
+                         "Bật command_channel.enabled trong tiến trình đó thay vì chạy riêng.")
+    client = CommandClient.from_config(gpio, cfg)
+    try:
+        client.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gpio.cleanup_gpio()
@@ -0,0 +1,210 @@
+# app/control.py
+"""
+Xử lý lệnh điều khiển GPIO dùng chung cho:
+  - POST /api/iot/control (app/app.py)
+  - kênh lệnh kéo từ server (app/command_client.py)
+=> 2 đường nhận lệnh có đúng cùng định dạng body và cùng kết quả trả về.
+"""
+
+
+def handle_control(gpio, data):
+    """
+    Xử lý 1 lệnh điều khiển GPIO theo body:
+    
+    Format mới (khuyến nghị):
+    {
+        "deviceId": "H2-RASPI-01",
+        "component": "pump",    // "fan1", "fan2", "pump", "light"
+        "state": "on"           // "on", "off", "toggle"
+    }
+    
+    Format cũ (vẫn hỗ trợ):
+    {
+        "device": "fan1",
+        "action": "on"
+    }
+    
+    Hoặc điều khiển nhiều thiết bị:
+    {
+        "devices": [
+            {"device": "fan1", "action": "on"},
+            {"device": "pump", "action": "off"}
+        ]
+    }
+    
+    Hoặc điều khiển tất cả:
+    {
+        "action": "all_on"    // "all_on" hoặc "all_off"
+    }
+
+    Trả (body_dict, http_status).
+    """
+    data = data or {}
+    results = []
+    
+    try:
+        # ===== FORMAT MỚI: deviceId + component + state =====
+        if "component" in data and "state" in data:
+            device_id = data.get("deviceId", "unknown")
+            component = data.get("component")
+            state = data.get("state", "").lower()
+            
+            if not component or not state:
+                return {
+                    "status": "FAILED",
+                    "error": "Missing component or state"
+                }, 400
+            
+            # Normalize state: "on"/"off"/"toggle"
+            if state not in ["on", "off", "toggle"]:
+                return {
+                    "status": "FAILED",
+                    "error": f"Invalid state: {state}. Use 'on', 'off', or 'toggle'"
+                }, 400
+            
+            success = False
+            if state == "on":
+                success = gpio.turn_on(component)
+            elif state == "off":
+                success = gpio.turn_off(component)
+            elif state == "toggle":
+                success = gpio.toggle_device(component)
+            
+            if not success:
+                return {
+                    "status": "FAILED",
+                    "deviceId": device_id,
+                    "component": component,
+                    "error": f"Failed to control '{component}'. Valid components: {list(gpio.DEVICES.keys())}"
+                }, 400
+            
+            # Lấy trạng thái hiện tại sau khi điều khiển
+            current_state = gpio.get_device_state(component)
+            resolved = gpio.normalize_device_name(component)
+            body = {
+                "status": "OK",
+                "deviceId": device_id,
+                "component": component,
+                "state": "on" if current_state else "off",
+                "pin": gpio.DEVICES.get(resolved),
+                "message": f"{component} turned {state}"
+            }
+            # Lệnh bị hoãn bởi lớp bảo vệ relay (min dwell / giới hạn tần suất)
+            pending = gpio.get_pending().get(resolved)
+            if pending is not None:
+                body["pending"] = "on" if pending[0] else "off"
+                body["apply_in_s"] = round(pending[1], 2)
+                body["message"] = f"{component} will turn {body['pending']} in {body['apply_in_s']}s"
+            return body, 200
+        
+        # ===== FORMAT CŨ: Giữ lại để tương thích ngược =====
+        # Trường hợp 1: Điều khiển tất cả
+        elif "action" in data and data["action"] in ["all_on", "all_off"]:
+            if data["action"] == "all_on":
+                gpio.turn_all_on()
+                results.append({"action": "all_on", "status": "OK"})
+            else:
+                gpio.turn_all_off()
+                results.append({"action": "all_off", "status": "OK"})
+        
+        # Trường hợp 2: Điều khiển nhiều thiết bị (validate hết rồi ghi 1 lượt)
+        elif "devices" in data and isinstance(data["devices"], list):
+            commands = [(item.get("device"), item.get("action", "")) if isinstance(item, dict)
+                        else (None, None) for item in data["devices"]]
+            ok, batch = gpio.apply_batch(commands)
+            for r in batch:
+                entry = {"device": r["device"], "action": r["action"], "status": r["status"]}
+                for k in ("error", "pending", "apply_in_s", "superseded"):
+                    if k in r:
+                        entry[k] = r[k]
+                results.append(entry)
+            if not ok:
+                return {
+                    "status": "FAILED",
+                    "error": "Invalid command in batch, nothing was applied",
+                    "results": results
+                }, 400
+
+        # Trường hợp 3: Điều khiển một thiết bị (format cũ)
+        elif "device" in data:
+            device = data.get("device")
+            action = data.get("action", "").lower()
+            
+            if not action:
+                return {"error": "Missing action"}, 400
+            
+            success = False
+            if action == "on":
+                success = gpio.turn_on(device)
+            elif action == "off":
+                success = gpio.turn_off(device)
+            elif action == "toggle":
+                success = gpio.toggle_device(device)
+            else:
+                return {"error": f"Invalid action: {action}"}, 400
+            
+            results.append({
+                "device": device,
+                "action": action,
+                "status": "OK" if success else "FAILED"
+            })
+        
+        else:
+            return {
+                "error": "Invalid request body. Use format: {\"deviceId\": \"...\", \"component\": \"pump\", \"state\": \"on\"}"
+            }, 400
+        
+        # Trả về trạng thái mới sau khi điều khiển
+        states = gpio.get_all_states()
+        devices = []
+        for device_name, is_on in states.items():
+            devices.append({
+                "name": device_name,
+                "state": "ON" if is_on else "OFF"
+            })
+        
+        return {
+            "status": "OK",
+            "results": results,
+            "current_states": devices
+        }, 200
+        
+    except Exception as e:
+        return {"error": str(e)}, 500
+
+
+
+AUTOMATION_SECTIONS = ("rules", "climate_control", "schedules")
+
+
+def _automation_targets(section: str, c: dict) -> set:
+    """Tên thiết bị (và "vent" cho servo) mà 1 bộ tự động trong settings.yml điều khiển."""
+    if section == "climate_control":
+        return {str(d) for lp in c.get("loops") or [] for d in lp.get("outputs") or []}
+    out = set()
+    for item in c.get("items") or []:
+        spec = (item.get("action") or {}) if section == "rules" else item
+        if "device" in spec:
+            out.add(str(spec["device"]))
+        elif "servo" in spec:
+            out.add("vent")
+    return out
+
+
+def check_device_owners(cfg: dict, normalize=None):
+    """
+    Mỗi thiết bị chỉ được 1 bộ tự động đang bật (rules / climate_control / schedules)
+    điều khiển: 2 bộ cùng ghi 1 relay sẽ giành nhau bật/tắt. normalize: chuẩn hoá tên
+    (gpio.normalize_device_name) để alias không lọt qua. Raise ValueError nếu trùng.
+    """
+    owners = {}
+    for section in AUTOMATION_SECTIONS:
+        c = (cfg or {}).get(section, {}) or {}
+        if not c.get("enabled"):
+            continue
+        for dev in _automation_targets(section, c):
+            owners.setdefault((normalize(dev) if normalize else None) or dev, []).append(section)
+    shared = {dev: secs for dev, secs in owners.items() if len(secs) > 1}
+    if shared:
+        raise ValueError("Thiết bị bị nhiều bộ tự động điều khiển: " +
+                         ", ".join(f"{dev} ({'/'.join(secs)})" for dev, secs in sorted(shared.items())))
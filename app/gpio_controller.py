@@ -3,8 +3,13 @@
 Module điều khiển các thiết bị qua GPIO (relay/transistor).
 Mỗi thiết bị được map với một GPIO pin cụ thể.
 """
+import os
+import sys
 import time
+import threading
 from typing import Optional
+
+from app.metrics import GPIO_DEFERRED, GPIO_SWITCH_S
 try:
     import RPi.GPIO as GPIO
 except ImportError:
@@ -38,8 +43,254 @@ ACTIVE_LOW = {
     "light": True,
 }
 
+# Giãn cách (giây) giữa các lần BẬT relay trong 1 lệnh batch để hạn chế dòng khởi động
+# (bơm + 2 quạt cùng đóng 1 lúc). 0 = ghi tất cả trong 1 lượt.
+SWITCH_STAGGER_S = 0.0
+# Thời gian chờ phần cứng ổn định trước khi đọc lại mức pin
+SETTLE_S = 0.02
+
+# Bảo vệ relay (settings.yml -> gpio.protect). Lệnh vi phạm không bị từ chối mà được
+# hoãn: chỉ giữ trạng thái mong muốn CUỐI CÙNG của mỗi thiết bị, áp khi hết hạn chế.
+MIN_DWELL_S = 0.0          # mỗi trạng thái phải giữ tối thiểu bấy nhiêu giây
+MAX_PER_MIN = 0.0          # số lần chuyển tối đa / phút / thiết bị (token bucket), 0 = không giới hạn
+BURST = 3                  # số lần chuyển liền nhau được phép trước khi bị giới hạn tần suất
+_device_limits = {}        # device -> {"min_dwell_s": .., "max_per_min": ..} ghi đè mặc định
+
 # Trạng thái hiện tại của các thiết bị
 _device_states = {dev: False for dev in DEVICES}
+# Lệnh đang bị hoãn: device -> trạng thái mong muốn mới nhất
+_pending = {}
+_last_switch = {}          # device -> monotonic lần đổi trạng thái gần nhất
+_buckets = {}              # device -> (token, monotonic lần cập nhật)
+_last_on_at = None         # monotonic lần BẬT relay gần nhất / đã đặt chỗ (giãn cách dòng khởi động)
+# Lệnh đã cho phép nhưng đang chờ tới lượt ghi (giãn cách): device -> (state, token, due).
+# Lệnh sau cho cùng thiết bị thay token -> lần ghi cũ bị bỏ khi tới lượt.
+_inflight = {}
+_plan_seq = 0
+_deferred_thread = None
+
+# Trạng thái dùng chung giữa các tiến trình (app/gpio_state_service.py):
+# tiến trình chủ chạy _service, tiến trình khác dùng _proxy (đọc mmap, gửi lệnh qua socket)
+STATE_SERVICE = True
+_service = None
+_proxy = None
+
+# Nhật ký trạng thái (app/state_journal.py) để khôi phục relay sau crash / mất điện.
+# RESTORE_POLICY: "last" (trạng thái mong muốn cuối) | "off" | "on", ghi đè theo thiết bị.
+JOURNAL_PATH = None
+JOURNAL_FSYNC = True
+RESTORE_DEFAULT = "last"
+RESTORE_POLICY = {}
+_journal = None
+# Ghi nhật ký (fsync vài ms trên thẻ SD) ngoài _lock; khoá riêng giữ thứ tự các dòng
+_journal_lock = threading.Lock()
+
+# Khoá bảo vệ _device_states + thao tác pin khi nhiều luồng (web server) cùng gọi
+_lock = threading.RLock()
+# Revision tăng dần mỗi khi trạng thái đổi; client chờ thay đổi qua _state_cond
+_revision = 0
+_state_cond = threading.Condition(_lock)
+_pending_cond = threading.Condition(_lock)
+
+# Chỉ 1 tiến trình được làm chủ các pin relay (flock trên file khoá)
+LOCK_PATH = os.environ.get("GREENECO_GPIO_LOCK", "/tmp/greeneco-gpio.lock")
+_owner_fd = None
+
+def acquire_ownership(path: str = LOCK_PATH) -> bool:
+    """Giành quyền chủ GPIO cho tiến trình này (không chặn). True nếu đã/đang là chủ."""
+    global _owner_fd
+    if _owner_fd is not None:
+        return True
+    try:
+        import fcntl
+    except ImportError:
+        return True   # không có flock (Windows dev) -> coi như chủ
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        os.close(fd)
+        return False
+    os.ftruncate(fd, 0)
+    os.write(fd, str(os.getpid()).encode())
+    _owner_fd = fd
+    return True
+
+def owner_pid(path: str = LOCK_PATH) -> Optional[int]:
+    """PID của tiến trình đang giữ quyền chủ GPIO (đọc từ file khoá)."""
+    try:
+        with open(path, "r") as f:
+            return int(f.read().strip() or 0) or None
+    except Exception:
+        return None
+
+# Revision mà luồng hiện tại vừa commit (xem committed_revision)
+_commit_local = threading.local()
+
+def _commit_states(updates: dict):
+    """Ghi trạng thái mới (đang giữ _lock). Chỉ tăng revision nếu có thay đổi thật."""
+    global _revision
+    changed = {d: v for d, v in updates.items() if _device_states.get(d) != v}
+    if not changed:
+        return False
+    _device_states.update(changed)
+    _revision += 1
+    _commit_local.revision = _revision
+    _state_cond.notify_all()
+    _publish()
+    return True
+
+def _intent() -> dict:
+    """(Đang giữ _lock) Trạng thái mong muốn mới nhất: trạng thái thật < đang chờ ghi < đang hoãn."""
+    intent = dict(_device_states)
+    intent.update({dev: v[0] for dev, v in _inflight.items()})
+    intent.update(_pending)
+    return intent
+
+def _journal_flush():
+    """(Ngoài _lock) Ghi trạng thái mong muốn vào nhật ký; fsync không chặn các luồng đọc/ghi trạng thái."""
+    if _journal is None:
+        return
+    with _journal_lock:
+        with _lock:
+            intent, revision = _intent(), _revision
+        try:
+            _journal.append(intent, revision)
+        except Exception as e:
+            print(f"[GPIO] Lỗi ghi nhật ký trạng thái: {e}")
+
+def _policy_name(v) -> str:
+    # YAML 1.1 đọc on/off không ngoặc thành True/False
+    if isinstance(v, bool):
+        return "on" if v else "off"
+    return str(v).strip().lower()
+
+def _restore_targets() -> dict:
+    """Trạng thái cần đặt khi khởi động theo nhật ký + chính sách từng thiết bị."""
+    global _journal, _revision
+    last = None
+    if JOURNAL_PATH:
+        try:
+            from app.state_journal import StateJournal
+            _journal = StateJournal(JOURNAL_PATH, fsync=JOURNAL_FSYNC)
+            last, rev = _journal.load()
+            # Đếm tiếp revision của lần chạy trước (client có thể đang giữ since cao)
+            with _lock:
+                _revision = max(_revision, rev)
+        except Exception as e:
+            print(f"[GPIO] Không đọc được nhật ký trạng thái: {e}")
+    targets = {}
+    for dev in DEVICES:
+        policy = RESTORE_POLICY.get(dev, RESTORE_DEFAULT)
+        if policy == "on":
+            targets[dev] = True
+        elif policy == "last" and last is not None:
+            targets[dev] = bool(last.get(dev, False))
+        else:
+            targets[dev] = False
+    return targets
+
+def _publish():
+    """(Đang giữ _lock) Cập nhật bảng trạng thái dùng chung cho các tiến trình khác."""
+    if _service is None:
+        return
+    try:
+        now = time.monotonic()
+        pending = {dev: v[0] for dev, v in _inflight.items()}
+        due = {dev: v[2] for dev, v in _inflight.items()}
+        pending.update(_pending)
+        due.update({dev: _allowed_at(dev, now) for dev in _pending})
+        _service.publish(_revision, _device_states, pending, due)
+    except Exception as e:
+        print(f"[GPIO] Lỗi cập nhật bảng trạng thái: {e}")
+
+def _start_service():
+    global _service
+    if not STATE_SERVICE or _service is not None:
+        return
+    try:
+        from app.gpio_state_service import StateService
+        svc = StateService(sys.modules[__name__])
+        with _lock:
+            _service = svc
+            _publish()
+        svc.start()
+    except Exception as e:
+        print(f"[GPIO] Không chạy được state service: {e}")
+
+def _attach_proxy() -> bool:
+    global _proxy
+    if not STATE_SERVICE:
+        return False
+    try:
+        from app.gpio_state_service import StateClient
+        _proxy = StateClient()
+        return True
+    except Exception as e:
+        print(f"[GPIO] Không kết nối được state service của pid {owner_pid()}: {e}")
+        return False
+
+def _proxy_call(op: str, **kwargs) -> dict:
+    try:
+        return _proxy.call(op, **kwargs)
+    except Exception as e:
+        print(f"[GPIO] Lỗi gửi lệnh tới tiến trình chủ GPIO (pid {owner_pid()}): {e}")
+        return {"ok": False, "error": f"GPIO owner unavailable: {e}"}
+
+def is_proxy() -> bool:
+    """True nếu tiến trình này điều khiển GPIO thông qua tiến trình chủ."""
+    return _proxy is not None
+
+def get_state_snapshot():
+    """Trả (revision, {device: bool}) nhất quán với nhau."""
+    if _proxy is not None:
+        return _proxy.table.snapshot()
+    with _lock:
+        return _revision, _device_states.copy()
+
+# Chỉ dùng khi không chờ được qua state service (chủ vừa khởi động lại...)
+PROXY_POLL_S = 0.25
+
+def committed_revision(clear: bool = False) -> Optional[int]:
+    """
+    Revision do chính luồng gọi commit gần nhất (None nếu chưa commit gì), khác với
+    get_state_snapshot() có thể đã gồm thay đổi của luồng khác. clear=True: xoá mốc sau khi đọc.
+    """
+    rev = getattr(_commit_local, "revision", None)
+    if clear:
+        _commit_local.revision = None
+    return rev
+
+def wait_for_change(since: int, timeout: float):
+    """
+    Chặn tới khi revision khác since hoặc hết timeout. Trả (revision, states).
+    So khác (không so lớn hơn): since từ trước khi tiến trình chủ khởi động lại có thể
+    cao hơn revision hiện tại, client vẫn phải nhận trạng thái mới ngay.
+    """
+    deadline = time.monotonic() + max(0.0, float(timeout))
+    if _proxy is not None:
+        if _proxy.table.revision() == since and timeout > 0:
+            try:
+                # Tiến trình chủ giữ request tới khi đổi (Condition bên đó) -> không poll
+                _proxy.wait(since, max(0.0, deadline - time.monotonic()))
+            except Exception as e:
+                print(f"[GPIO] Không chờ được qua state service ({e}), đọc bảng định kỳ")
+                while _proxy.table.revision() == since and time.monotonic() < deadline:
+                    if not _proxy.table.owner_alive():
+                        from app.gpio_state_service import OwnerGone
+                        raise OwnerGone(f"Tiến trình chủ GPIO (pid {_proxy.table.owner_pid()}) không còn chạy")
+                    time.sleep(min(PROXY_POLL_S, max(0.0, deadline - time.monotonic())))
+        return _proxy.table.snapshot()
+    with _state_cond:
+        while _revision == since:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            _state_cond.wait(remaining)
+        return _revision, _device_states.copy()
+
+def is_owner() -> bool:
+    return _owner_fd is not None or (GPIO is None and _proxy is None)
 
 def normalize_device_name(name: str) -> Optional[str]:
     """Chuẩn hóa tên thiết bị về key trong DEVICES.
@@ -63,32 +314,302 @@ def normalize_device_name(name: str) -> Optional[str]:
         return ALIASES[key_nospace]
     return None
 
-def init_gpio():
-    """Khởi tạo GPIO mode và setup các pin output."""
+def init_gpio() -> bool:
+    """Khởi tạo GPIO mode và setup các pin output.
+
+    Tiến trình khác đang làm chủ GPIO -> không đụng vào pin, chuyển sang chế độ proxy
+    (đọc trạng thái dùng chung, gửi lệnh cho tiến trình chủ). Trả False nếu không
+    proxy được (state service tắt hoặc tiến trình chủ không phục vụ).
+    """
+    if _proxy is not None:
+        return True
+    if not acquire_ownership():
+        if _attach_proxy():
+            print(f"[GPIO] Tiến trình khác (pid {owner_pid()}) đang làm chủ GPIO -> điều khiển qua state service")
+            return True
+        if GPIO is not None:
+            print(f"[GPIO] Tiến trình khác (pid {owner_pid()}) đang làm chủ GPIO - không khởi tạo lại pin")
+            return False
+
+    t0 = time.perf_counter()
     if GPIO is None:
         print("[GPIO] Backend: MOCK (RPi.GPIO không sẵn có) - bỏ qua setup phần cứng")
-        return
+        if _owner_fd is not None:
+            _restore(_restore_targets(), t0)
+            _start_service()
+        return True
     
     try:
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
 
+        # Đặt thẳng mức khôi phục ngay lúc setup pin (không qua OFF -> ON), BẬT thì giãn cách
+        targets = _restore_targets()
+        turned_on = 0
         for device, pin in DEVICES.items():
-            # OFF mặc định theo cực tính ACTIVE_LOW
-            off_level = GPIO.HIGH if ACTIVE_LOW.get(device, False) else GPIO.LOW
-            GPIO.setup(pin, GPIO.OUT, initial=off_level)
-            _device_states[device] = False  # OFF
+            if targets[device] and SWITCH_STAGGER_S:
+                if turned_on:
+                    time.sleep(SWITCH_STAGGER_S)
+                turned_on += 1
+            GPIO.setup(pin, GPIO.OUT, initial=_level_for(device, targets[device]))
+        _restore(targets, t0)
         try:
             ver = getattr(GPIO, "__version__", "unknown")
         except Exception:
             ver = "unknown"
         print(f"[GPIO] Backend: RPi.GPIO v{ver}")
         print("[GPIO] Initialized successfully:", list(DEVICES.keys()))
+        _start_service()
+        return True
     except Exception as e:
         print(f"[GPIO] Init error: {e}")
+        return False
+
+def _restore(targets: dict, t0: float):
+    """Ghi nhận trạng thái vừa khôi phục (revision, mốc dwell, nhật ký)."""
+    global _last_on_at, _revision
+    with _lock:
+        if not _commit_states(targets):
+            # Khởi động lại luôn là 1 revision mới, kể cả khi trạng thái khôi phục trùng mặc định
+            _revision += 1
+            _state_cond.notify_all()
+            _publish()
+        now = time.monotonic()
+        for dev, on in targets.items():
+            if on:
+                _last_switch[dev] = now
+                _last_on_at = now
+        revision = _revision
+    if _journal is not None:
+        # Viết lại file: bỏ dòng cắt dở do mất điện (nếu không, dòng ghi tiếp sẽ dính vào nó)
+        with _journal_lock:
+            try:
+                _journal.compact(targets, revision)
+            except Exception as e:
+                print(f"[GPIO] Lỗi ghi nhật ký trạng thái: {e}")
+    on = [d for d, v in targets.items() if v]
+    print(f"[GPIO] Khôi phục trạng thái trong {(time.perf_counter() - t0) * 1000:.1f} ms: "
+          + (", ".join(f"{d}=ON" for d in on) if on else "tất cả OFF"))
+
+def configure(gpio_cfg: Optional[dict]):
+    """Áp cấu hình từ settings.yml -> gpio (gọi trước/sau init_gpio đều được)."""
+    global SWITCH_STAGGER_S, MIN_DWELL_S, MAX_PER_MIN, BURST, STATE_SERVICE
+    global JOURNAL_PATH, JOURNAL_FSYNC, RESTORE_DEFAULT
+    gpio_cfg = gpio_cfg or {}
+    STATE_SERVICE = bool(gpio_cfg.get("state_service", STATE_SERVICE))
+    JOURNAL_PATH = gpio_cfg.get("state_journal", JOURNAL_PATH)
+    restore = gpio_cfg.get("restore") or {}
+    JOURNAL_FSYNC = bool(restore.get("fsync", JOURNAL_FSYNC))
+    RESTORE_DEFAULT = _policy_name(restore.get("default", RESTORE_DEFAULT))
+    for dev, policy in (restore.get("devices") or {}).items():
+        resolved = normalize_device_name(str(dev))
+        if resolved:
+            RESTORE_POLICY[resolved] = _policy_name(policy)
+    for policy in [RESTORE_DEFAULT, *RESTORE_POLICY.values()]:
+        if policy not in ("last", "off", "on"):
+            raise ValueError(f"gpio.restore: chính sách '{policy}' không hợp lệ (last/off/on)")
+    if "stagger_ms" in gpio_cfg:
+        SWITCH_STAGGER_S = max(0.0, float(gpio_cfg["stagger_ms"]) / 1000.0)
+    protect = gpio_cfg.get("protect") or {}
+    MIN_DWELL_S = max(0.0, float(protect.get("min_dwell_s", MIN_DWELL_S)))
+    MAX_PER_MIN = max(0.0, float(protect.get("max_per_min", MAX_PER_MIN)))
+    BURST = max(1, int(protect.get("burst", BURST)))
+    for dev, lim in (protect.get("devices") or {}).items():
+        resolved = normalize_device_name(str(dev))
+        if resolved:
+            _device_limits[resolved] = dict(lim or {})
+
+# ===== Bảo vệ relay: min dwell, giới hạn tần suất, giãn cách khi bật =====
+def _allowed_at(device: str, now: float) -> float:
+    """Thời điểm (monotonic) sớm nhất thiết bị được đổi trạng thái lần nữa."""
+    lim = _device_limits.get(device, {})
+    dwell = float(lim.get("min_dwell_s", MIN_DWELL_S))
+    per_min = float(lim.get("max_per_min", MAX_PER_MIN))
+    t = 0.0
+    last = _last_switch.get(device)
+    if last is not None and dwell > 0:
+        t = last + dwell
+    if per_min > 0:
+        rate = per_min / 60.0
+        tokens, ts = _buckets.get(device, (float(BURST), now))
+        tokens = min(float(BURST), tokens + (now - ts) * rate)
+        if tokens < 1.0:
+            t = max(t, now + (1.0 - tokens) / rate)
+    return t
+
+def _consume(device: str, now: float):
+    """Ghi nhận 1 lần đổi trạng thái (trừ token, mốc dwell)."""
+    lim = _device_limits.get(device, {})
+    per_min = float(lim.get("max_per_min", MAX_PER_MIN))
+    if per_min > 0:
+        tokens, ts = _buckets.get(device, (float(BURST), now))
+        tokens = min(float(BURST), tokens + (now - ts) * per_min / 60.0)
+        _buckets[device] = (tokens - 1.0, now)
+    _last_switch[device] = now
+
+def _gate(targets: dict, force: bool = False) -> dict:
+    """
+    (Đang giữ _lock) Tách các thiết bị cần ĐỔI trạng thái: được phép ngay thì trả về,
+    chưa được phép thì ghi đè vào _pending (ý định mới nhất) cho luồng hoãn xử lý.
+    Trả {device: giây phải chờ} của các thiết bị bị hoãn.
+    """
+    now = time.monotonic()
+    deferred = {}
+    for dev, want in targets.items():
+        _inflight.pop(dev, None)        # lệnh mới thay lần ghi đang chờ tới lượt
+        if want == _device_states[dev]:
+            _pending.pop(dev, None)     # lệnh sau huỷ lệnh đang hoãn
+            continue
+        due = 0.0 if force else _allowed_at(dev, now)
+        if due <= now:
+            _pending.pop(dev, None)
+            continue
+        if _pending.get(dev) != want:
+            GPIO_DEFERRED.labels(dev).inc()
+        _pending[dev] = want
+        deferred[dev] = due - now
+    if deferred:
+        _start_deferred()
+        _pending_cond.notify_all()
+    _publish()
+    return deferred
+
+def _plan(targets, stagger: Optional[float] = None) -> list:
+    """
+    (Đang giữ _lock) Xếp lịch ghi cho [(device, state)] đã qua _gate: lần BẬT được đặt chỗ
+    cách lần bật trước stagger giây, tắt thì ghi ngay. Trả [(device, state, due, token)]
+    cho _run_plan chạy NGOÀI khoá.
+    """
+    global _last_on_at, _plan_seq
+    stagger = SWITCH_STAGGER_S if stagger is None else stagger
+    now = time.monotonic()
+    plan = []
+    for dev, state in targets:
+        due = now
+        if state and _device_states[dev] != state:
+            if GPIO is not None and stagger and _last_on_at is not None:
+                due = max(now, _last_on_at + stagger)
+            _last_on_at = due
+        _plan_seq += 1
+        _inflight[dev] = (state, _plan_seq, due)
+        plan.append((dev, state, due, _plan_seq))
+    if plan:
+        _publish()
+    return plan
+
+def _run_plan(plan: list, setup: bool = False) -> list:
+    """
+    (Ngoài _lock) Chờ tới lượt rồi mới giữ khoá để ghi: trong lúc giãn cách, trạng thái /
+    lệnh khác không bị chặn. Mọi lần ghi đã tới hạn được ghi trong CÙNG 1 lần giữ khoá và
+    commit 1 revision (lần BẬT bị giãn cách là 1 bước riêng). Lần ghi đã bị lệnh sau thay thì bỏ.
+    Trả danh sách thiết bị đã ghi.
+    """
+    written = []
+    steps = sorted(plan, key=lambda p: p[2])
+    try:
+        i = 0
+        while i < len(steps):
+            wait = steps[i][2] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            now = time.monotonic()
+            group = [steps[i]]
+            i += 1
+            while i < len(steps) and steps[i][2] <= now:
+                group.append(steps[i])
+                i += 1
+            with _lock:
+                updates = {}
+                try:
+                    for dev, state, _, token in group:
+                        if _inflight.get(dev, (None, None))[1] != token:
+                            continue
+                        del _inflight[dev]
+                        if setup and GPIO is not None:
+                            # Đảm bảo cấu hình pin là OUTPUT (phòng khi bị tiến trình khác thay đổi)
+                            try:
+                                GPIO.setup(DEVICES[dev], GPIO.OUT)
+                            except Exception:
+                                pass
+                        _write(dev, state)
+                        updates[dev] = state
+                finally:
+                    # Pin đã ghi thì trạng thái phải theo, kể cả khi pin sau lỗi
+                    _commit_states(updates)
+                    written.extend(updates)
+    finally:
+        with _lock:
+            for dev, _, _, token in plan:
+                if _inflight.get(dev, (None, None))[1] == token:
+                    del _inflight[dev]
+            _publish()
+    return written
+
+def _write(device: str, state: bool):
+    """(Đang giữ _lock) Ghi mức pin + tính lượt chuyển; trạng thái do _run_plan commit theo bước."""
+    if GPIO is not None:
+        GPIO.output(DEVICES[device], _level_for(device, state))
+    if _device_states[device] != state:
+        _consume(device, time.monotonic())
+
+def _start_deferred():
+    global _deferred_thread
+    if _deferred_thread is None or not _deferred_thread.is_alive():
+        _deferred_thread = threading.Thread(target=_deferred_loop, name="gpio-deferred", daemon=True)
+        _deferred_thread.start()
+
+def _deferred_loop():
+    """Áp các lệnh bị hoãn khi hết min dwell / có token; mỗi thiết bị chỉ áp ý định cuối."""
+    while True:
+        with _pending_cond:
+            plan = None
+            while plan is None:
+                if not _pending:
+                    _pending_cond.wait()
+                    continue
+                now = time.monotonic()
+                due = {dev: _allowed_at(dev, now) for dev in _pending}
+                ready = [dev for dev, t in due.items() if t <= now]
+                if not ready:
+                    _pending_cond.wait(max(0.001, min(due.values()) - now))
+                    continue
+                plan = _plan([(dev, _pending.pop(dev)) for dev in ready])
+        try:
+            written = _run_plan(plan)
+            for dev, want, _, _ in plan:
+                if dev in written:
+                    print(f"[GPIO] {dev} -> {'ON' if want else 'OFF'} (lệnh hoãn)")
+        except Exception as e:
+            print(f"[GPIO] Lỗi áp lệnh hoãn {[p[0] for p in plan]}: {e}")
+        _journal_flush()
+
+def get_pending() -> dict:
+    """Lệnh đang bị hoãn: {device: (state, giây còn lại)}."""
+    if _proxy is not None:
+        now = time.monotonic()
+        return {dev: (d["pending"], max(0.0, d["pending_due"] - now))
+                for dev, d in _proxy.table.read()["devices"].items() if d["pending"] is not None}
+    with _lock:
+        now = time.monotonic()
+        out = {dev: (v[0], max(0.0, v[2] - now)) for dev, v in _inflight.items()}
+        out.update({dev: (want, max(0.0, _allowed_at(dev, now) - now)) for dev, want in _pending.items()})
+        return out
+
+def get_intent(device_name: str) -> bool:
+    """Trạng thái mong muốn mới nhất (lệnh đang hoãn nếu có, không thì trạng thái thật)."""
+    resolved = normalize_device_name(device_name)
+    if not resolved:
+        return False
+    if _proxy is not None:
+        d = _proxy.table.read()["devices"].get(resolved, {})
+        return d.get("state", False) if d.get("pending") is None else d["pending"]
+    with _lock:
+        return _intent()[resolved]
 
 def backend_info() -> str:
     """Trả về thông tin backend GPIO hiện dùng."""
+    if _proxy is not None:
+        return f"proxy -> pid {_proxy.table.read()['owner_pid']}"
     if GPIO is None:
         return "MOCK"
     try:
@@ -98,8 +619,19 @@ def backend_info() -> str:
     return f"RPi.GPIO v{ver}"
 
 def cleanup_gpio():
-    """Dọn dẹp GPIO khi thoát chương trình."""
-    if GPIO is None:
+    """Dọn dẹp GPIO khi thoát chương trình (chỉ tiến trình chủ mới được nhả pin)."""
+    global _proxy, _service
+    if _proxy is not None:
+        _proxy.close()
+        _proxy = None
+        return
+    if _service is not None:
+        _service.stop()
+        _service = None
+    if _journal is not None:
+        # Không ghi OFF lúc dọn dẹp: lần khởi động sau khôi phục trạng thái mong muốn cuối
+        _journal.close()
+    if GPIO is None or not is_owner():
         return
     try:
         # Đưa tất cả về OFF trước khi nhả GPIO để tránh relay kêu tạch
@@ -114,16 +646,18 @@ def cleanup_gpio():
     except Exception as e:
         print(f"[GPIO] Cleanup error: {e}")
 
-def set_device(device_name: str, state: bool):
+@GPIO_SWITCH_S.labels("set_device").time()
+def set_device(device_name: str, state: bool, force: bool = False):
     """
     Bật/tắt một thiết bị.
     
     Args:
         device_name: Tên thiết bị (fan1, fan2, pump, light)
         state: True = ON, False = OFF
+        force: bỏ qua min dwell / giới hạn tần suất (tắt khẩn cấp)
     
     Returns:
-        bool: True nếu thành công, False nếu lỗi
+        bool: True nếu thành công (kể cả khi lệnh bị hoãn), False nếu lỗi
     """
     resolved = normalize_device_name(device_name)
     if not resolved:
@@ -131,34 +665,42 @@ def set_device(device_name: str, state: bool):
         return False
     device_name = resolved
     pin = DEVICES[device_name]
-    
+
+    if _proxy is not None:
+        return bool(_proxy_call("set", device=device_name, state=bool(state), force=force).get("ok"))
+
+    if GPIO is not None and not is_owner():
+        print(f"[GPIO] Không phải tiến trình chủ GPIO (chủ: pid {owner_pid()}), bỏ qua {device_name}")
+        return False
+
+    state = bool(state)
+    with _lock:
+        prev = _pending.get(device_name)
+        deferred = _gate({device_name: state}, force)
+        plan = [] if deferred else _plan([(device_name, state)])
+    if deferred:
+        if prev != state:
+            print(f"[GPIO] {device_name} -> {'ON' if state else 'OFF'} bị hoãn {deferred[device_name]:.1f}s "
+                  f"(min dwell / giới hạn tần suất), giữ lệnh mới nhất")
+        _journal_flush()
+        return True
+
     if GPIO is None:
         print(f"[GPIO Mock] Set {device_name} (pin {pin}) to {'ON' if state else 'OFF'}")
-        _device_states[device_name] = state
+        _run_plan(plan)
+        _journal_flush()
         return True
     
     try:
-        # Đảm bảo cấu hình pin là OUTPUT (phòng khi bị tiến trình khác thay đổi)
-        try:
-            GPIO.setup(pin, GPIO.OUT)
-        except Exception:
-            pass
-
-        # Tính mức tín hiệu theo cực tính
-        if ACTIVE_LOW.get(device_name, False):
-            # Relay active-low: ON -> LOW, OFF -> HIGH
-            level = GPIO.LOW if state else GPIO.HIGH
-        else:
-            # Active-high
-            level = GPIO.HIGH if state else GPIO.LOW
-
-        GPIO.output(pin, level)
+        # Mức tín hiệu theo cực tính (active-low: ON -> LOW), chờ giãn cách nếu vừa bật relay khác
+        _run_plan(plan, setup=True)
+        _journal_flush()
         # nhỏ giọt thời gian ngắn để phần cứng kịp đáp ứng trước khi đọc lại
+        # (ngoài khoá để các request khác không phải chờ)
         try:
             time.sleep(0.02)
         except Exception:
             pass
-        _device_states[device_name] = state
         status = "ON" if state else "OFF"
         try:
             actual = GPIO.input(pin)
@@ -183,7 +725,10 @@ def get_device_state(device_name: str) -> bool:
     resolved = normalize_device_name(device_name)
     if not resolved:
         return False
-    return _device_states.get(resolved, False)
+    if _proxy is not None:
+        return _proxy.table.snapshot()[1].get(resolved, False)
+    with _lock:
+        return _device_states.get(resolved, False)
 
 def get_all_states() -> dict:
     """
@@ -192,13 +737,18 @@ def get_all_states() -> dict:
     Returns:
         dict: {device_name: bool}
     """
-    return _device_states.copy()
+    if _proxy is not None:
+        return _proxy.table.snapshot()[1]
+    with _lock:
+        return _device_states.copy()
 
 def is_on(device_name: str) -> bool:
     """Trả về True nếu thiết bị đang ON (dựa trên mức GPIO thực nếu có)."""
     resolved = normalize_device_name(device_name)
     if not resolved:
         return False
+    if _proxy is not None:
+        return get_device_state(resolved)
     if GPIO is None:
         return bool(_device_states.get(resolved, False))
     try:
@@ -255,8 +805,13 @@ def set_polarity(device_name: str, active_low: bool) -> bool:
     if not resolved:
         print(f"[GPIO] Device '{device_name}' không hợp lệ. Hợp lệ: {list(DEVICES.keys())}")
         return False
+    if _proxy is not None:
+        print(f"[GPIO] Chỉ tiến trình chủ GPIO (pid {owner_pid()}) được đổi cực tính")
+        return False
     ACTIVE_LOW[resolved] = bool(active_low)
-    _apply_output_for_state(resolved)
+    with _lock:
+        _apply_output_for_state(resolved)
+        _publish()
     mode = "active-low" if active_low else "active-high"
     print(f"[GPIO] Đã đặt cực tính {resolved}: {mode}")
     return True
@@ -279,9 +834,16 @@ def turn_off(device_name: str):
     return set_device(device_name, False)
 
 def toggle_device(device_name: str):
-    """Đảo trạng thái thiết bị (ON <-> OFF)."""
-    current = get_device_state(device_name)
-    return set_device(device_name, not current)
+    """Đảo trạng thái thiết bị (ON <-> OFF), tính theo lệnh đang hoãn nếu có."""
+    if _proxy is not None:
+        return bool(_proxy_call("toggle", device=device_name).get("ok"))
+    if not normalize_device_name(device_name):
+        print(f"[GPIO] Device '{device_name}' không hợp lệ. Hợp lệ: {list(DEVICES.keys())}")
+        return False
+    # apply_batch đọc ý định hiện tại + tính trạng thái đích trong cùng 1 lần giữ khoá
+    # (2 toggle đồng thời không đọc cùng 1 trạng thái cũ), còn chờ ổn định thì ngoài khoá
+    ok, _ = apply_batch([(device_name, "toggle")])
+    return ok
 
 def diagnose_device(device_name: str, cycles: int = 2, delay: float = 0.5):
     """Chẩn đoán nhanh 1 thiết bị: đọc/ghi mức pin nhiều lần và in thông tin.
@@ -294,6 +856,9 @@ def diagnose_device(device_name: str, cycles: int = 2, delay: float = 0.5):
     if not resolved:
         print(f"[GPIO] Device '{device_name}' không hợp lệ. Hợp lệ: {list(DEVICES.keys())}")
         return False
+    if _proxy is not None:
+        print(f"[GPIO DIAG] Chỉ chạy được ở tiến trình chủ GPIO (pid {owner_pid()})")
+        return False
 
     pin = DEVICES[resolved]
     al = ACTIVE_LOW.get(resolved, False)
@@ -341,16 +906,144 @@ def diagnose_device(device_name: str, cycles: int = 2, delay: float = 0.5):
         print(f"[GPIO DIAG] Error: {e}")
         return False
 
+def _level_for(device_name: str, state: bool):
+    if ACTIVE_LOW.get(device_name, False):
+        return GPIO.LOW if state else GPIO.HIGH
+    return GPIO.HIGH if state else GPIO.LOW
+
+def validate_batch(commands) -> list:
+    """Kiểm tra toàn bộ lệnh trước khi đụng phần cứng.
+
+    commands: list (device, action) với action "on"/"off"/"toggle" hoặc bool.
+    Trả list kết quả; phần tử có "error" nghĩa là lệnh không hợp lệ.
+    """
+    results = []
+    for device, action in commands:
+        item = {"device": device, "action": action}
+        if isinstance(action, bool):
+            item["action"] = "on" if action else "off"
+        elif isinstance(action, str):
+            item["action"] = action.strip().lower()
+        resolved = normalize_device_name(device) if device else None
+        if not device or not item["action"]:
+            item["error"] = "Missing device or action"
+        elif item["action"] not in ("on", "off", "toggle"):
+            item["error"] = f"Invalid action: {item['action']}"
+        elif not resolved:
+            item["error"] = f"Unknown device '{device}'. Valid: {list(DEVICES.keys())}"
+        else:
+            item["resolved"] = resolved
+        results.append(item)
+    return results
+
+@GPIO_SWITCH_S.labels("apply_batch").time()
+def apply_batch(commands, stagger_s: Optional[float] = None, force: bool = False):
+    """
+    Áp nhiều lệnh relay trong 1 lượt:
+      1) validate tất cả (sai 1 lệnh -> không ghi gì),
+      2) ghi mức pin cho mọi thiết bị (giãn cách stagger_s giữa các lần BẬT),
+      3) chờ SETTLE_S 1 lần rồi đọc lại tất cả pin trong 1 vòng để xác nhận.
+
+    Thiết bị chưa hết min dwell / hết lượt chuyển (gpio.protect) không bị ghi mà được
+    hoãn: result có "pending" (trạng thái sẽ áp) và "apply_in_s". force=True bỏ qua bảo vệ.
+
+    Trả (ok, results). results giữ thứ tự lệnh, mỗi phần tử có "status" OK/FAILED.
+    """
+    results = validate_batch(commands)
+    if any("error" in r for r in results):
+        for r in results:
+            r["status"] = "FAILED" if "error" in r else "SKIPPED"
+        return False, results
+
+    if _proxy is not None:
+        reply = _proxy_call("batch", commands=[[r["resolved"], r["action"]] for r in results],
+                            stagger_s=stagger_s, force=force)
+        if "results" not in reply:
+            for r in results:
+                r.update(status="FAILED", error=reply.get("error", "GPIO owner unavailable"))
+            return False, results
+        for r, remote in zip(results, reply["results"]):
+            remote.update(device=r["device"], action=r["action"])
+        return bool(reply["ok"]), reply["results"]
+
+    stagger = SWITCH_STAGGER_S if stagger_s is None else max(0.0, float(stagger_s))
+    if GPIO is not None and not is_owner():
+        for r in results:
+            r.update(status="FAILED", error=f"GPIO owned by pid {owner_pid()}")
+        return False, results
+
+    with _lock:
+        # Tính trạng thái đích theo thứ tự lệnh (toggle dựa trên ý định trước đó: lệnh hoãn
+        # hoặc lệnh trước trong batch)
+        target = _intent()
+        for r in results:
+            dev = r["resolved"]
+            target[dev] = (not target[dev]) if r["action"] == "toggle" else (r["action"] == "on")
+        touched = []
+        for r in results:
+            if r["resolved"] not in touched:
+                touched.append(r["resolved"])
+        deferred = _gate({d: target[d] for d in touched}, force)
+        touched = [d for d in touched if d not in deferred]
+        # Bật nối tiếp có giãn cách (kể cả với lần bật của lệnh khác vừa xong); tắt thì ghi ngay
+        plan = _plan([(d, target[d]) for d in touched], stagger)
+
+    try:
+        written = _run_plan(plan)
+    except Exception as e:
+        for r in results:
+            r.update(status="FAILED", error=str(e))
+        print(f"[GPIO] Batch error: {e}")
+        _journal_flush()
+        return False, results
+    _journal_flush()
+    # Lệnh khác cho cùng thiết bị tới trong lúc chờ giãn cách -> lệnh đó thắng
+    superseded = [d for d in touched if d not in written]
+    touched = written
+
+    verified = {}
+    if GPIO is not None:
+        time.sleep(SETTLE_S)
+        for dev in touched:
+            try:
+                verified[dev] = GPIO.input(DEVICES[dev]) == _level_for(dev, target[dev])
+            except Exception:
+                verified[dev] = None
+    for r in results:
+        dev = r["resolved"]
+        r["status"] = "OK"
+        if dev in deferred:
+            r["state"] = "off" if target[dev] else "on"
+            r["pending"] = "on" if target[dev] else "off"
+            r["apply_in_s"] = round(deferred[dev], 2)
+            continue
+        if dev in superseded:
+            r["superseded"] = True
+            r["state"] = "on" if get_device_state(dev) else "off"
+            continue
+        r["state"] = "on" if target[dev] else "off"
+        if verified:
+            r["verified"] = verified.get(dev)
+
+    tag = "[GPIO Mock]" if GPIO is None else "[GPIO]"
+    summary = ", ".join(f"{d}={'ON' if target[d] else 'OFF'}" for d in touched)
+    if deferred:
+        summary += (", " if summary else "") + "hoãn: " + \
+            ", ".join(f"{d}={'ON' if target[d] else 'OFF'} ({t:.1f}s)" for d, t in deferred.items())
+    if superseded:
+        summary += (", " if summary else "") + "bị lệnh sau thay: " + ", ".join(superseded)
+    bad = [d for d, ok in verified.items() if ok is False]
+    print(f"{tag} Batch: {summary}" + (f" (verify FAILED: {bad})" if bad else ""))
+    return True, results
+
 def turn_all_off():
-    """Tắt tất cả thiết bị."""
-    for device in DEVICES:
-        set_device(device, False)
+    """Tắt tất cả thiết bị ngay (bỏ qua min dwell / giới hạn tần suất)."""
+    apply_batch([(device, False) for device in DEVICES], force=True)
     print("[GPIO] All devices turned OFF")
 
 def turn_all_on():
     """Bật tất cả thiết bị."""
-    for device in DEVICES:
-        set_device(device, True)
+    apply_batch([(device, True) for device in DEVICES])
     print("[GPIO] All devices turned ON")
 
 # Demo/test function
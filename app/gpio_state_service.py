@@ -0,0 +1,363 @@
+# app/gpio_state_service.py
+"""
+Trạng thái GPIO dùng chung giữa các tiến trình (app.py, menu main.py, scheduler...).
+
+Chỉ tiến trình chủ (giữ flock trong gpio_controller) đụng vào pin. Nó:
+  - công bố bảng trạng thái qua file mmap ở /dev/shm (seqlock): tiến trình khác đọc
+    revision + trạng thái từng relay bằng 1 lần copy bộ nhớ, không syscall, không đọc pin;
+  - nhận lệnh đổi trạng thái qua Unix socket (JSON 1 dòng / lệnh, kết nối giữ lâu)
+    và chạy đúng các hàm set_device / toggle_device / apply_batch của chính nó
+    (=> min dwell, giới hạn tần suất, giãn cách vẫn áp dụng cho mọi client).
+
+Tiến trình không phải chủ: gpio_controller.init_gpio() tự chuyển sang chế độ proxy
+(StateClient), API của module giữ nguyên.
+
+Bố cục bảng (little-endian):
+    header: magic "GEGS", version u16, ndev u16, seq u32, revision u64, owner_pid u32, updated f64
+    slot x ndev: name 16s, pin u8, state u8, pending u8 (0 không / 1 OFF / 2 ON), active_low u8,
+                 pending_due f64 (time.monotonic() của tiến trình chủ, cùng đồng hồ hệ thống)
+seq lẻ = đang ghi; reader đọc seq -> copy -> đọc lại seq, khác thì đọc lại. seq lẻ quá
+COPY_TIMEOUT_S (chủ chết giữa lúc ghi) -> OwnerGone nếu pid chủ không còn, còn sống thì trả
+bản đọc tốt gần nhất. Chờ đổi trạng thái (op "wait") được chủ giữ trên 1 kết nối riêng tới khi
+revision tăng, client không phải poll bảng.
+
+    python -m app.gpio_state_service --status      # in bảng hiện tại
+    python -m app.gpio_state_service --bench 10000 # đo đọc bảng + 1 vòng IPC
+"""
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+
+SHM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else "/tmp"
+SHM_PATH = os.environ.get("GREENECO_GPIO_SHM", os.path.join(SHM_DIR, "greeneco-gpio-state"))
+SOCK_PATH = os.environ.get("GREENECO_GPIO_SOCK", "/tmp/greeneco-gpio.sock")
+
+MAGIC = b"GEGS"
+VERSION = 1
+HEADER = struct.Struct("<4sHHIQId")
+SLOT = struct.Struct("<16sBBBBd")
+SEQ_OFF = 8                          # vị trí seq trong header
+SEQ = struct.Struct("<I")
+COPY_SPINS = 1000                    # số lần đọc liền trước khi ngủ chờ người ghi
+COPY_TIMEOUT_S = 0.5                 # seq lẻ lâu hơn thế này = người ghi bị kẹt / đã chết
+WAIT_MAX_S = 120.0
+
+
+class OwnerGone(RuntimeError):
+    """Tiến trình chủ GPIO không còn chạy (bảng trạng thái không còn được cập nhật)."""
+
+
+def pid_alive(pid: int) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True        # tồn tại nhưng thuộc user khác
+    return True
+
+
+def table_size(ndev: int) -> int:
+    return HEADER.size + ndev * SLOT.size
+
+
+class StateTable:
+    """Bảng trạng thái trên mmap. Tiến trình chủ mở writable=True, client chỉ đọc."""
+
+    def __init__(self, path: str = SHM_PATH, ndev: int = 0, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        if writable:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                os.ftruncate(fd, table_size(ndev))
+                self._mm = mmap.mmap(fd, table_size(ndev))
+            finally:
+                os.close(fd)
+            self._seq = 0
+            self.ndev = ndev
+        else:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                self._mm = mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+            finally:
+                os.close(fd)
+            magic, version, ndev = HEADER.unpack_from(self._mm, 0)[:3]
+            if magic != MAGIC or version != VERSION:
+                self._mm.close()
+                raise ValueError(f"{path}: không phải bảng trạng thái GPIO v{VERSION}")
+            self.ndev = ndev
+        self.size = table_size(self.ndev)
+        self._last = None            # bản đọc nhất quán gần nhất (dùng khi người ghi kẹt)
+
+    # ---------- ghi (tiến trình chủ) ----------
+    def publish(self, revision: int, devices: dict, states: dict, pending: dict,
+                active_low: dict, pending_due: dict = None):
+        """devices: {name: pin} (thứ tự cố định), pending: {name: bool}, pending_due: {name: monotonic}."""
+        pending_due = pending_due or {}
+        mm = self._mm
+        self._seq += 1
+        SEQ.pack_into(mm, SEQ_OFF, self._seq)             # lẻ: đang ghi
+        HEADER.pack_into(mm, 0, MAGIC, VERSION, self.ndev, self._seq,
+                         int(revision), os.getpid(), time.time())
+        for i, (name, pin) in enumerate(devices.items()):
+            p = pending.get(name)
+            SLOT.pack_into(mm, HEADER.size + i * SLOT.size, name.encode()[:16], int(pin),
+                           1 if states.get(name) else 0, 0 if p is None else (2 if p else 1),
+                           1 if active_low.get(name) else 0, float(pending_due.get(name, 0.0)))
+        self._seq += 1
+        SEQ.pack_into(mm, SEQ_OFF, self._seq)             # chẵn: xong
+
+    # ---------- đọc ----------
+    def _copy(self) -> bytes:
+        mm = self._mm
+        deadline = None
+        pause = 0.0001
+        while True:
+            for _ in range(COPY_SPINS):
+                s1 = SEQ.unpack_from(mm, SEQ_OFF)[0]
+                if s1 & 1:
+                    continue
+                buf = mm[:self.size]
+                if SEQ.unpack_from(mm, SEQ_OFF)[0] == s1:
+                    self._last = buf
+                    return buf
+            now = time.monotonic()
+            if deadline is None:
+                deadline = now + COPY_TIMEOUT_S
+            elif now >= deadline:
+                break
+            time.sleep(pause)          # người ghi bị lịch hệ điều hành tạm dừng -> nhường CPU
+            pause = min(pause * 2, 0.01)
+        pid = self.owner_pid()
+        if not pid_alive(pid):
+            raise OwnerGone(f"Tiến trình chủ GPIO (pid {pid}) đã dừng giữa lúc ghi bảng {self.path}")
+        if self._last is not None:
+            print(f"[GPIO] Bảng {self.path} đang ghi dở quá {COPY_TIMEOUT_S}s, dùng bản đọc trước")
+            return self._last
+        raise TimeoutError(f"Bảng {self.path} đang ghi dở quá {COPY_TIMEOUT_S}s (chủ pid {pid})")
+
+    def owner_pid(self) -> int:
+        """pid chủ trong header (đọc thẳng, không qua seqlock: 1 số u32)."""
+        return HEADER.unpack_from(self._mm, 0)[5]
+
+    def owner_alive(self) -> bool:
+        return pid_alive(self.owner_pid())
+
+    def read(self) -> dict:
+        """{"revision", "owner_pid", "updated", "devices": {name: {...}}} nhất quán với nhau."""
+        buf = self._copy()
+        _, _, ndev, _, revision, pid, updated = HEADER.unpack_from(buf, 0)
+        devices = {}
+        for i in range(ndev):
+            name, pin, state, pending, active_low, due = SLOT.unpack_from(buf, HEADER.size + i * SLOT.size)
+            devices[name.rstrip(b"\0").decode()] = {
+                "pin": pin, "state": bool(state),
+                "pending": None if pending == 0 else pending == 2,
+                "active_low": bool(active_low), "pending_due": due}
+        return {"revision": revision, "owner_pid": pid, "updated": updated, "devices": devices}
+
+    def snapshot(self):
+        """(revision, {name: bool}) giống gpio_controller.get_state_snapshot()."""
+        buf = self._copy()
+        _, _, ndev, _, revision = HEADER.unpack_from(buf, 0)[:5]
+        states = {}
+        for i in range(ndev):
+            name, _, state = SLOT.unpack_from(buf, HEADER.size + i * SLOT.size)[:3]
+            states[name.rstrip(b"\0").decode()] = bool(state)
+        return revision, states
+
+    def revision(self) -> int:
+        return HEADER.unpack_from(self._copy(), 0)[4]
+
+    def close(self):
+        try:
+            self._mm.close()
+        except Exception:
+            pass
+
+
+class StateService:
+    """Chạy trong tiến trình chủ GPIO: công bố bảng + phục vụ lệnh qua Unix socket."""
+
+    def __init__(self, gpio, shm_path: str = SHM_PATH, sock_path: str = SOCK_PATH):
+        self.gpio = gpio
+        self.sock_path = sock_path
+        self.table = StateTable(shm_path, ndev=len(gpio.DEVICES), writable=True)
+        self._server = None
+        self._thread = None
+
+    def publish(self, revision, states, pending, pending_due=None):
+        self.table.publish(revision, self.gpio.DEVICES, states, pending, self.gpio.ACTIVE_LOW, pending_due)
+
+    def start(self):
+        # Đang giữ flock chủ GPIO -> socket cũ (nếu có) là của tiến trình đã chết
+        try:
+            os.unlink(self.sock_path)
+        except FileNotFoundError:
+            pass
+        srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        srv.bind(self.sock_path)
+        os.chmod(self.sock_path, 0o660)
+        srv.listen(16)
+        self._server = srv
+        self._thread = threading.Thread(target=self._accept_loop, name="gpio-state-service", daemon=True)
+        self._thread.start()
+        print(f"[GPIO] State service: bảng {self.table.path}, lệnh qua {self.sock_path}")
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._server.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), name="gpio-state-client", daemon=True).start()
+
+    def _serve(self, conn):
+        with conn, conn.makefile("rwb") as f:
+            for line in f:
+                try:
+                    reply = self.handle(json.loads(line))
+                except Exception as e:
+                    reply = {"ok": False, "error": str(e)}
+                f.write(json.dumps(reply).encode() + b"\n")
+                f.flush()
+
+    def handle(self, req: dict) -> dict:
+        op = req.get("op")
+        g = self.gpio
+        if op == "set":
+            ok = g.set_device(req["device"], bool(req["state"]), force=bool(req.get("force")))
+        elif op == "toggle":
+            ok = g.toggle_device(req["device"])
+        elif op == "batch":
+            ok, results = g.apply_batch([tuple(c) for c in req["commands"]],
+                                        stagger_s=req.get("stagger_s"), force=bool(req.get("force")))
+            return {"ok": ok, "results": results, "revision": g.get_state_snapshot()[0]}
+        elif op == "wait":
+            # Giữ kết nối tới khi revision khác since (Condition của gpio_controller), không poll
+            rev, _ = g.wait_for_change(int(req["since"]), min(float(req.get("timeout", 0)), WAIT_MAX_S))
+            return {"ok": True, "revision": rev}
+        elif op == "ping":
+            ok = True
+        else:
+            return {"ok": False, "error": f"op không hợp lệ: {op}"}
+        return {"ok": bool(ok), "revision": g.get_state_snapshot()[0]}
+
+    def stop(self):
+        if self._server is not None:
+            try:
+                self._server.close()
+                os.unlink(self.sock_path)
+            except OSError:
+                pass
+        self.table.close()
+
+
+class StateClient:
+    """Tiến trình không phải chủ: đọc bảng mmap, gửi lệnh qua socket (1 kết nối, có khoá)."""
+
+    def __init__(self, shm_path: str = SHM_PATH, sock_path: str = SOCK_PATH, timeout: float = 5.0):
+        self.table = StateTable(shm_path)
+        self.sock_path = sock_path
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+        self.call("ping")          # chủ phải đang phục vụ, không thì báo lỗi ngay
+
+    def _connect(self):
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(self.timeout)
+        s.connect(self.sock_path)
+        self._sock, self._file = s, s.makefile("rwb")
+
+    def _drop(self):
+        for c in (self._file, self._sock):
+            try:
+                if c is not None:
+                    c.close()
+            except OSError:
+                pass
+        self._sock = self._file = None
+
+    def call(self, op: str, **kwargs) -> dict:
+        msg = json.dumps(dict(kwargs, op=op)).encode() + b"\n"
+        with self._lock:
+            for attempt in (0, 1):
+                sent = False
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    self._file.write(msg)
+                    self._file.flush()
+                    sent = True
+                    line = self._file.readline()
+                    if not line:
+                        raise ConnectionError("tiến trình chủ GPIO đã đóng kết nối")
+                    return json.loads(line)
+                except OSError:
+                    self._drop()
+                    # Lệnh đã gửi đi có thể đã được áp -> không gửi lại (trừ ping)
+                    if attempt or (sent and op != "ping"):
+                        raise
+
+    def wait(self, since: int, timeout: float) -> int:
+        """
+        Chặn tới khi revision khác since hoặc hết timeout (chủ giữ request). Dùng kết nối riêng
+        để các lệnh khác của tiến trình này không phải chờ. Trả revision.
+        """
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.settimeout(max(0.0, timeout) + self.timeout)
+        try:
+            s.connect(self.sock_path)
+            with s.makefile("rwb") as f:
+                f.write(json.dumps({"op": "wait", "since": int(since), "timeout": timeout}).encode() + b"\n")
+                f.flush()
+                line = f.readline()
+            if not line:
+                raise ConnectionError("tiến trình chủ GPIO đã đóng kết nối")
+            return int(json.loads(line)["revision"])
+        finally:
+            s.close()
+
+    def close(self):
+        with self._lock:
+            self._drop()
+        self.table.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    ap = argparse.ArgumentParser(description="Xem / đo bảng trạng thái GPIO dùng chung")
+    ap.add_argument("--status", action="store_true")
+    ap.add_argument("--bench", type=int, default=0, help="số lần đọc bảng để đo")
+    args = ap.parse_args()
+
+    table = StateTable()
+    st = table.read()
+    if args.status or not args.bench:
+        print(f"revision {st['revision']}, chủ pid {st['owner_pid']}, "
+              f"cập nhật {time.time() - st['updated']:.1f}s trước")
+        for name, d in st["devices"].items():
+            pend = "" if d["pending"] is None else f"  (hoãn -> {'ON' if d['pending'] else 'OFF'})"
+            print(f"  {name:8} (pin {d['pin']:2}) -> {'ON' if d['state'] else 'OFF'}{pend}")
+    if args.bench:
+        t0 = time.perf_counter()
+        for _ in range(args.bench):
+            table.snapshot()
+        read_us = (time.perf_counter() - t0) * 1e6 / args.bench
+        client = StateClient()
+        n = max(1, args.bench // 10)
+        t0 = time.perf_counter()
+        for _ in range(n):
+            client.call("ping")
+        ipc_us = (time.perf_counter() - t0) * 1e6 / n
+        print(f"[GPIO] đọc bảng: {read_us:.2f} µs/lần, IPC ping: {ipc_us:.1f} µs/lần")
@@ -0,0 +1,45 @@
+# app/gunicorn_conf.py
+"""
+Cấu hình gunicorn cho GPIO control API:
+    gunicorn -c app/gunicorn_conf.py app.app:app
+
+- Mặc định 1 worker. Ràng buộc KHÔNG đến từ GPIO: nhiều worker vẫn đúng vì chỉ worker
+  giữ flock là chủ pin, các worker khác tự chạy proxy qua gpio_state_service (cùng trạng
+  thái, cùng revision, lệnh đi qua chủ). Ràng buộc đến từ tài nguyên 1 chủ khác nằm trong
+  tiến trình: camera CSI (MJPEG stream), cổng UART/RS485 của sensor_cache, hub WebSocket.
+  Chỉ tăng GREENECO_WORKERS khi không dùng các endpoint đó.
+- Đồng thời bằng thread (gthread): request điều khiển/status/stream chạy song song,
+  gpio_controller đã có khoá nên an toàn giữa các thread.
+- Không preload_app: GPIO init trong worker, không phải trong master rồi fork
+  (worker chết -> flock được nhả, worker mới lên làm chủ và khôi phục từ state journal).
+  Import app.app không khởi tạo gì; post_worker_init gọi app.app.init_services() ngay khi
+  worker lên để rules / lịch / kênh lệnh chạy mà không phải chờ request đầu tiên.
+"""
+import os
+
+bind = os.environ.get("GREENECO_BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("GREENECO_WORKERS", "1"))
+worker_class = "gthread"
+# Mỗi kết nối WebSocket /api/iot/ws (và stream MJPEG/SSE) giữ 1 thread suốt phiên
+# -> đủ chỗ cho vài chục client xem realtime + request REST thường
+threads = int(os.environ.get("GREENECO_THREADS", "64"))
+# Stream MJPEG / long-poll giữ kết nối lâu -> timeout rộng, keepalive cho app mobile
+timeout = 120
+graceful_timeout = 10
+keepalive = 5
+preload_app = False
+accesslog = "-"
+
+
+def post_worker_init(worker):
+    from app.app import init_services
+    init_services()
+
+
+def worker_exit(server, worker):
+    # Nhả pin về OFF khi worker dừng (chỉ tác dụng nếu worker này là chủ GPIO)
+    try:
+        from app import gpio_controller
+        gpio_controller.cleanup_gpio()
+    except Exception:
+        pass
@@ -0,0 +1,420 @@
+# app/history.py
+"""
+Truy vấn lịch sử từ file JSONL local (export.jsonl_path) có downsample phía server.
+
+Không parse cả file mỗi lần: bên cạnh file JSONL có 1 file index (<jsonl>.idx, JSONL
+append-only) chứa các block BLOCK_LINES dòng, mỗi block lưu
+  t0, t1 (epoch), offset byte đầu/cuối, số dòng và min/max/sum/count từng metric.
+Trong RAM các block được gộp thêm thành nhiều mức (mỗi mức gộp FANOUT block mức dưới:
+16 / 256 / 4096 dòng). Index cập nhật tăng dần (chỉ đọc phần mới ghi thêm của file,
+chỉ append block mới vào .idx). Trong web server index được nạp/dựng ở luồng nền
+(start()), request không tự dựng.
+
+Query đi từ mức thô nhất xuống: block nằm gọn trong 1 bucket đầu ra thì dùng tóm tắt
+(nếu không, min/max/count của block sẽ bị dồn hết vào bucket chứa điểm giữa), block
+vắt qua ranh giới bucket thì xuống mức mịn hơn; chỉ block 16 dòng ở ranh giới / 2 đầu
+khoảng thời gian và phần đuôi chưa index mới đọc raw. 1 tuần dữ liệu 1 Hz (~600k dòng)
+ở 300 điểm chỉ đọc raw vài nghìn dòng.
+  - mode "minmax": mỗi bucket thời gian trả min/max/mean/count
+  - mode "lttb":   Largest-Triangle-Three-Buckets trên chuỗi mean
+Kết quả dạng cột: {"t": [...], "min": [...], ...} (không phải 1 dict mỗi điểm).
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+from app.aggregator import flatten_reading
+
+BLOCK_LINES = 16      # dòng / block mức mịn nhất (lưu trong .idx)
+FANOUT = 16           # mỗi mức trên gộp FANOUT block mức dưới
+LEVELS = 3            # 16 / 256 / 4096 dòng
+INDEX_VERSION = 2
+# append_jsonl ghi "ts" là key đầu tiên -> lấy nhanh bằng regex, khỏi json.loads cả dòng
+_TS_RE = re.compile(rb'^\{"ts":\s*"([^"]+)"')
+
+
+class HistoryIndexing(RuntimeError):
+    """Index đang được dựng lần đầu ở luồng nền, thử lại sau."""
+
+
+def to_epoch(ts) -> float:
+    """Epoch (số hoặc chuỗi số) hoặc ISO 8601 ('Z' / offset / giờ local) -> epoch giây."""
+    if isinstance(ts, (int, float)):
+        return float(ts)
+    try:
+        return float(ts)
+    except ValueError:
+        pass
+    return datetime.fromisoformat(str(ts).replace("Z", "+00:00")).timestamp()
+
+
+def _line_ts(line: bytes):
+    m = _TS_RE.match(line)
+    try:
+        if m:
+            return to_epoch(m.group(1).decode())
+        return to_epoch(json.loads(line)["ts"])
+    except Exception:
+        return None
+
+
+class JsonlHistory:
+    def __init__(self, path: str, block_lines: int = BLOCK_LINES, fanout: int = FANOUT,
+                 levels: int = LEVELS):
+        self.path = path
+        self.idx_path = path + ".idx"
+        self.block_lines = int(block_lines)
+        self.fanout = int(fanout)
+        self._lock = threading.Lock()
+        # _levels[0]: block BLOCK_LINES dòng (dict t0, t1, off, end, n, m={metric: [min, max, sum, count]});
+        # _levels[k]: block k gộp FANOUT block liên tiếp của _levels[k - 1]
+        self._levels = [[] for _ in range(max(1, int(levels)))]
+        self._indexed = 0     # offset byte cuối cùng đã đưa vào block đầy
+        self._loaded = False  # .idx nạp lười (luồng nền / query đầu), không chặn lúc khởi động
+        self._thread = None
+        self._ready = threading.Event()
+
+    # ---------- index ----------
+    def _header(self) -> str:
+        return json.dumps({"version": INDEX_VERSION, "block_lines": self.block_lines}) + "\n"
+
+    def _push(self, block):
+        """(Đang giữ _lock) Thêm block mức 0, gộp lên các mức trên khi đủ FANOUT block."""
+        self._levels[0].append(block)
+        for k in range(len(self._levels) - 1):
+            if len(self._levels[k]) % self.fanout:
+                break
+            self._levels[k + 1].append(_merge(self._levels[k][-self.fanout:]))
+
+    def _reset(self):
+        self._levels = [[] for _ in self._levels]
+        self._indexed = 0
+
+    def _load_index(self):
+        self._loaded = True
+        torn = False
+        try:
+            with open(self.idx_path, "rb") as f:
+                if f.readline().decode("utf-8", "replace") != self._header():
+                    raise ValueError("khác phiên bản / block_lines")
+                for line in f:
+                    try:
+                        block = json.loads(line)
+                    except ValueError:
+                        torn = True     # dòng cắt dở (mất điện lúc append) -> ghi lại file
+                        break
+                    self._push(block)
+            if self._levels[0]:
+                self._indexed = self._levels[0][-1]["end"]
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"[History] Index lỗi, dựng lại: {e}")
+            self._reset()
+            torn = True
+        if torn:
+            self._save_index()
+
+    def _save_index(self):
+        """Ghi lại toàn bộ .idx (file tạm + os.replace)."""
+        tmp = self.idx_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(self._header())
+            for b in self._levels[0]:
+                f.write(json.dumps(b, separators=(",", ":")) + "\n")
+        os.replace(tmp, self.idx_path)
+
+    def _append_index(self, blocks):
+        if not os.path.exists(self.idx_path):
+            self._save_index()
+            return
+        with open(self.idx_path, "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(b, separators=(",", ":")) + "\n" for b in blocks))
+
+    def start(self, interval_s: float = 60.0):
+        """Nạp/dựng index ở luồng nền rồi cập nhật mỗi interval_s (phần đuôi chưa index đọc raw)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._index_loop, args=(float(interval_s),),
+                                            name="history-index", daemon=True)
+            self._thread.start()
+        return self
+
+    def _index_loop(self, interval_s):
+        while True:
+            t0 = time.monotonic()
+            try:
+                self.refresh_index()
+                if not self._ready.is_set():
+                    print(f"[History] Index {self.path}: {len(self._levels[0])} block, "
+                          f"{time.monotonic() - t0:.1f}s")
+            except Exception as e:
+                print(f"[History] Lỗi cập nhật index: {e}")
+            self._ready.set()
+            time.sleep(interval_s)
+
+    def refresh_index(self):
+        """Đưa các block đầy mới ghi thêm vào index. Trả offset bắt đầu phần đuôi chưa index."""
+        with self._lock:
+            if not self._loaded:
+                self._load_index()
+            try:
+                size = os.path.getsize(self.path)
+            except FileNotFoundError:
+                self._reset()
+                return 0
+            if size < self._indexed:
+                # File bị cắt/xoay vòng -> dựng lại từ đầu
+                self._reset()
+                self._save_index()
+            if size - self._indexed <= 0:
+                return self._indexed
+            added = []
+            with open(self.path, "rb") as f:
+                f.seek(self._indexed)
+                block, off = None, self._indexed
+                for line in f:
+                    end = off + len(line)
+                    if not line.endswith(b"\n"):
+                        break   # dòng đang ghi dở
+                    t = _line_ts(line)
+                    if t is not None:
+                        if block is None:
+                            block = {"t0": t, "t1": t, "off": off, "end": end, "n": 0, "m": {}}
+                        self._add_to_block(block, t, line)
+                        block["end"] = end
+                        if block["n"] >= self.block_lines:
+                            self._push(block)
+                            self._indexed = end
+                            added.append(block)
+                            block = None
+                    off = end
+            if added:
+                self._append_index(added)
+            return self._indexed
+
+    @staticmethod
+    def _add_to_block(block, t, line):
+        try:
+            values = flatten_reading(json.loads(line))
+        except Exception:
+            return
+        block["n"] += 1
+        block["t0"] = min(block["t0"], t)
+        block["t1"] = max(block["t1"], t)
+        for k, v in values.items():
+            s = block["m"].get(k)
+            if s is None:
+                block["m"][k] = [v, v, v, 1]
+            else:
+                s[0] = v if v < s[0] else s[0]
+                s[1] = v if v > s[1] else s[1]
+                s[2] += v
+                s[3] += 1
+
+    # ---------- đọc ----------
+    def _read_raw(self, start_off, end_off, t_from, t_to, metrics, f=None):
+        """Trả list (t, {metric: v}) trong [t_from, t_to] của vùng byte [start_off, end_off)."""
+        if f is None:
+            with open(self.path, "rb") as f:
+                return self._read_raw(start_off, end_off, t_from, t_to, metrics, f)
+        out = []
+        f.seek(start_off)
+        pos = start_off
+        for line in f:
+            if end_off is not None and pos >= end_off:
+                break
+            pos += len(line)
+            if not line.endswith(b"\n"):
+                break
+            t = _line_ts(line)
+            if t is None or t < t_from or t > t_to:
+                continue
+            try:
+                flat = flatten_reading(json.loads(line))
+            except Exception:
+                continue
+            vals = {m: flat[m] for m in metrics if m in flat}
+            if vals:
+                out.append((t, vals))
+        return out
+
+    def samples(self, metrics, t_from, t_to, raw_limit, points):
+        """
+        Trả {metric: [(t, min, max, sum, count), ...]} sắp theo t.
+        Duyệt từ mức block thô nhất: block nằm gọn trong 1 bucket đầu ra (points bucket
+        đều nhau trên [t_from, t_to]) -> dùng tóm tắt; vắt qua ranh giới bucket / 2 đầu
+        khoảng -> xuống FANOUT block con; block mức 0 như vậy và phần đuôi chưa index
+        -> đọc raw. Khoảng nhỏ (<= raw_limit dòng) -> đọc raw hết.
+        """
+        if self._thread is None:
+            tail_off = self.refresh_index()
+        elif not self._ready.is_set():
+            raise HistoryIndexing(f"Đang dựng index cho {self.path}, thử lại sau vài giây")
+        with self._lock:
+            if self._thread is not None:
+                tail_off = self._indexed
+            # Các mức chỉ được append (reset thì thay list mới) -> giữ tham chiếu + độ dài là đủ
+            levels = self._levels
+            counts = [len(lv) for lv in levels]
+        fan = self.fanout
+
+        def overlaps(b):
+            return b["t0"] <= t_to and b["t1"] >= t_from
+
+        # Gốc: block mức trên cùng + phần lẻ ở mỗi mức dưới chưa đủ gộp lên
+        roots = []
+        for k in reversed(range(len(levels))):
+            start = counts[k + 1] * fan if k + 1 < len(levels) else 0
+            roots.extend((k, j) for j in range(start, counts[k]) if overlaps(levels[k][j]))
+        series = {m: [] for m in metrics}
+        raw = []          # vùng byte [off, end) cần đọc raw
+
+        if sum(levels[k][j]["n"] for k, j in roots) <= raw_limit:
+            if roots:
+                raw.append((levels[roots[0][0]][roots[0][1]]["off"], levels[roots[-1][0]][roots[-1][1]]["end"]))
+        else:
+            span = max(t_to - t_from, 1e-9)
+            stack = list(reversed(roots))
+            while stack:
+                k, j = stack.pop()
+                b = levels[k][j]
+                if not overlaps(b):
+                    continue
+                if (b["t0"] >= t_from and b["t1"] <= t_to and
+                        _bucket(b["t0"], t_from, span, points) == _bucket(b["t1"], t_from, span, points)):
+                    tm = (b["t0"] + b["t1"]) / 2.0
+                    for m in metrics:
+                        s = b["m"].get(m)
+                        if s:
+                            series[m].append((tm, s[0], s[1], s[2], s[3]))
+                elif k == 0:
+                    raw.append((b["off"], b["end"]))
+                else:
+                    stack.extend((k - 1, c) for c in reversed(range(j * fan, (j + 1) * fan)))
+        # Gộp các vùng raw liền nhau, đọc hết bằng 1 file handle
+        merged = []
+        for off, end in sorted(raw):
+            if merged and off <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([off, end])
+        if merged and merged[-1][1] >= tail_off:
+            merged[-1][1] = None
+        else:
+            merged.append([tail_off, None])
+        with open(self.path, "rb") as f:
+            for off, end in merged:
+                for t, vals in self._read_raw(off, end, t_from, t_to, metrics, f):
+                    for m, v in vals.items():
+                        series[m].append((t, v, v, v, 1))
+        for m in metrics:
+            series[m].sort(key=lambda x: x[0])
+        return series
+
+    def query(self, metrics, t_from, t_to, points=300, mode="minmax"):
+        """
+        t_from/t_to: epoch hoặc ISO 8601 (xem to_epoch). Trả {metric: cột}: minmax ->
+        {"t", "min", "max", "mean", "count"}, lttb -> {"t", "mean"}.
+        """
+        t_from, t_to = to_epoch(t_from), to_epoch(t_to)
+        points = max(3, int(points))
+        # Dưới ~4 điểm raw cho mỗi điểm đầu ra thì đọc raw cho chính xác
+        series = self.samples(metrics, t_from, t_to, raw_limit=points * 4, points=points)
+        out = {}
+        for m, rows in series.items():
+            if mode == "lttb":
+                picked = lttb([(r[0], r[3] / r[4]) for r in rows], points)
+                out[m] = {"t": [p[0] for p in picked], "mean": [p[1] for p in picked]}
+            else:
+                out[m] = bucket_minmax(rows, t_from, t_to, points)
+        return out
+
+
+def _merge(blocks) -> dict:
+    """Tóm tắt của nhiều block liên tiếp."""
+    m = {}
+    for b in blocks:
+        for k, s in b["m"].items():
+            acc = m.get(k)
+            if acc is None:
+                m[k] = list(s)
+            else:
+                acc[0] = s[0] if s[0] < acc[0] else acc[0]
+                acc[1] = s[1] if s[1] > acc[1] else acc[1]
+                acc[2] += s[2]
+                acc[3] += s[3]
+    return {"t0": min(b["t0"] for b in blocks), "t1": max(b["t1"] for b in blocks),
+            "off": blocks[0]["off"], "end": blocks[-1]["end"], "n": sum(b["n"] for b in blocks), "m": m}
+
+
+def _bucket(t, t_from, span, points) -> int:
+    return min(points - 1, int((t - t_from) / span * points))
+
+
+def bucket_minmax(rows, t_from, t_to, points):
+    """Gom (t, min, max, sum, count) vào `points` bucket thời gian đều nhau, trả dạng cột."""
+    span = max(t_to - t_from, 1e-9)
+    buckets = {}
+    for t, mn, mx, sm, n in rows:
+        i = _bucket(t, t_from, span, points)
+        b = buckets.get(i)
+        if b is None:
+            buckets[i] = [mn, mx, sm, n]
+        else:
+            b[0] = mn if mn < b[0] else b[0]
+            b[1] = mx if mx > b[1] else b[1]
+            b[2] += sm
+            b[3] += n
+    res = {"t": [], "min": [], "max": [], "mean": [], "count": []}
+    for i in sorted(buckets):
+        mn, mx, sm, n = buckets[i]
+        res["t"].append(round(t_from + (i + 0.5) * span / points, 3))
+        res["min"].append(mn)
+        res["max"].append(mx)
+        res["mean"].append(round(sm / n, 4))
+        res["count"].append(n)
+    return res
+
+
+def lttb(data, threshold):
+    """Largest-Triangle-Three-Buckets: giữ hình dạng chuỗi với `threshold` điểm."""
+    n = len(data)
+    if threshold >= n or threshold < 3:
+        return [[t, v] for t, v in data]
+    out = [list(data[0])]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        # Trung bình bucket kế tiếp
+        s = int((i + 1) * every) + 1
+        e = min(int((i + 2) * every) + 1, n)
+        avg_t = sum(p[0] for p in data[s:e]) / (e - s)
+        avg_v = sum(p[1] for p in data[s:e]) / (e - s)
+        # Chọn điểm trong bucket hiện tại tạo tam giác lớn nhất
+        rs = int(i * every) + 1
+        re_ = int((i + 1) * every) + 1
+        at, av = data[a]
+        best, best_area = rs, -1.0
+        for j in range(rs, re_):
+            area = abs((at - avg_t) * (data[j][1] - av) - (at - data[j][0]) * (avg_v - av))
+            if area > best_area:
+                best, best_area = j, area
+        out.append(list(data[best]))
+        a = best
+    out.append(list(data[-1]))
+    return out
+
+
+_histories = {}
+_histories_lock = threading.Lock()
+
+
+def get_history(path: str) -> JsonlHistory:
+    with _histories_lock:
+        h = _histories.get(path)
+        if h is None:
+            h = _histories[path] = JsonlHistory(path)
+        return h
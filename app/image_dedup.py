@@ -0,0 +1,167 @@
+# app/image_dedup.py
+"""
+Lọc ảnh gần trùng trước khi upload bằng perceptual hash (dHash / pHash, NumPy).
+
+Ảnh ban đêm hoặc cảnh tĩnh gần như giống hệt nhau: hash 64-bit của chúng chỉ
+lệch vài bit. Nếu khoảng cách Hamming tới 1 ảnh đã gửi gần đây <= threshold
+thì bỏ qua upload và chỉ ghi 1 dòng tham chiếu (refs JSONL) trỏ tới ảnh đã gửi.
+"""
+import json
+import os
+import time
+from collections import deque
+from datetime import datetime
+
+import numpy as np
+
+HASH_SIZE = 8
+
+
+def _to_gray(img) -> np.ndarray:
+    """BGR/gray uint8 -> gray float32 (không cần cv2)."""
+    a = np.asarray(img)
+    if a.ndim == 3:
+        a = a[..., :3].astype(np.float32)
+        return 0.114 * a[..., 0] + 0.587 * a[..., 1] + 0.299 * a[..., 2]
+    return a.astype(np.float32)
+
+
+def _block_resize(gray: np.ndarray, rows: int, cols: int) -> np.ndarray:
+    """Thu nhỏ bằng trung bình khối (reshape + mean), đủ tốt cho hash."""
+    h, w = gray.shape
+    bh, bw = max(1, h // rows), max(1, w // cols)
+    g = gray[:bh * rows, :bw * cols]
+    return g.reshape(rows, bh, cols, bw).mean(axis=(1, 3))
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int.from_bytes(np.packbits(bits.astype(np.uint8).ravel()).tobytes(), "big")
+
+
+def dhash(img, size=HASH_SIZE) -> int:
+    """Difference hash: so sánh độ sáng các ô kề nhau theo chiều ngang."""
+    small = _block_resize(_to_gray(img), size, size + 1)
+    return _bits_to_int(small[:, 1:] > small[:, :-1])
+
+
+_DCT_CACHE = {}
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    m = _DCT_CACHE.get(n)
+    if m is None:
+        k = np.arange(n)[:, None]
+        i = np.arange(n)[None, :]
+        m = np.cos(np.pi * (2 * i + 1) * k / (2 * n)).astype(np.float32)
+        _DCT_CACHE[n] = m
+    return m
+
+
+def phash(img, size=HASH_SIZE, highfreq_factor=4) -> int:
+    """Perceptual hash: DCT 2D (nhân ma trận) rồi so hệ số tần số thấp với median."""
+    n = size * highfreq_factor
+    small = _block_resize(_to_gray(img), n, n)
+    c = _dct_matrix(n)
+    low = (c @ small @ c.T)[:size, :size]
+    return _bits_to_int(low > np.median(low.ravel()[1:]))
+
+
+HASHERS = {"dhash": dhash, "phash": phash}
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def load_image_for_hash(path: str):
+    """Decode JPEG ở 1/8 độ phân giải dạng gray (nhanh) để tính hash."""
+    import cv2
+    img = cv2.imread(path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        raise ValueError(f"Không đọc được ảnh: {path}")
+    return img
+
+
+class ImageDeduper:
+    """Giữ lịch sử hash của các ảnh đã upload gần đây (lưu ra file để qua restart)."""
+
+    def __init__(self, method="dhash", threshold=6, history=8, max_interval_s=3600,
+                 state_path=None, refs_path=None):
+        if method not in HASHERS:
+            raise ValueError(f"method phải là một trong {list(HASHERS)}")
+        self.method = method
+        self.threshold = int(threshold)
+        self.max_interval_s = float(max_interval_s)
+        self.state_path = state_path
+        self.refs_path = refs_path
+        self._history = deque(maxlen=max(1, int(history)))   # dict(hash, ref, ts)
+        self._load()
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        c = (cfg or {}).get("image_dedup", {}) or {}
+        return cls(method=c.get("method", "dhash"), threshold=c.get("threshold", 6),
+                   history=c.get("history", 8), max_interval_s=c.get("max_interval_s", 3600),
+                   state_path=c.get("state_path"), refs_path=c.get("refs_path"))
+
+    def _load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                st = json.load(f)
+            if st.get("method") == self.method:
+                for e in st.get("history", []):
+                    self._history.append({"hash": int(e["hash"], 16), "ref": e.get("ref"), "ts": e["ts"]})
+        except Exception as e:
+            print(f"[Dedup] Bỏ qua state lỗi: {e}")
+
+    def _save(self):
+        if not self.state_path:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"method": self.method,
+                       "history": [{"hash": f"{e['hash']:016x}", "ref": e["ref"], "ts": e["ts"]}
+                                   for e in self._history]}, f)
+        os.replace(tmp, self.state_path)
+
+    def hash_image(self, img) -> int:
+        return HASHERS[self.method](img)
+
+    def check(self, h: int, now: float = None):
+        """
+        Trả (is_duplicate, match, distance). Ảnh gần trùng với 1 ảnh trong lịch sử
+        nhưng lần upload gần nhất đã quá max_interval_s -> vẫn coi là cần gửi.
+        """
+        now = time.time() if now is None else now
+        if not self._history:
+            return False, None, None
+        best = min(self._history, key=lambda e: hamming(h, e["hash"]))
+        dist = hamming(h, best["hash"])
+        newest_ts = max(e["ts"] for e in self._history)
+        if dist <= self.threshold and now - newest_ts < self.max_interval_s:
+            return True, best, dist
+        return False, best, dist
+
+    def mark_uploaded(self, h: int, ref, now: float = None):
+        self._history.append({"hash": h, "ref": ref, "ts": time.time() if now is None else now})
+        self._save()
+
+    def record_skip(self, h: int, image_path: str, match: dict, distance: int, device_id=None):
+        """Ghi 1 dòng tham chiếu cho ảnh bị bỏ qua (trỏ về ảnh đã gửi giống nó)."""
+        if not self.refs_path:
+            return
+        os.makedirs(os.path.dirname(self.refs_path) or ".", exist_ok=True)
+        rec = {
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            "device_id": device_id,
+            "image": image_path,
+            "hash": f"{h:016x}",
+            "method": self.method,
+            "distance": distance,
+            "ref": match.get("ref") if match else None,
+        }
+        with open(self.refs_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(rec, ensure_ascii=False) + "\n")
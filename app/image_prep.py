@@ -0,0 +1,139 @@
+# app/image_prep.py
+"""
+Chuẩn bị ảnh trước khi upload: chọn độ phân giải + chất lượng JPEG theo băng
+thông đo được và ngân sách byte, decode/encode 1 lần trong RAM (không file tạm).
+
+Ngân sách = min(max_bytes, throughput_ước_lượng * target_upload_s).
+Đường truyền chậm -> ảnh nhỏ hơn nhưng tới nơi, thay vì 300 KB timeout rồi retry.
+"""
+import threading
+
+# Bậc độ phân giải (chiều rộng) thử lần lượt từ lớn xuống nhỏ
+WIDTH_LADDER = (1280, 960, 640, 480, 320)
+MIN_QUALITY = 40
+MAX_QUALITY = 85
+
+
+class ThroughputEstimator:
+    """EWMA tốc độ upload (bytes/s) từ các lần gửi thực tế. Thread-safe."""
+
+    def __init__(self, initial_bps=64 * 1024, alpha=0.3):
+        self.alpha = float(alpha)
+        self._bps = float(initial_bps)
+        self._lock = threading.Lock()
+        self.samples = 0
+
+    @property
+    def bps(self) -> float:
+        with self._lock:
+            return self._bps
+
+    def record(self, nbytes: int, seconds: float):
+        if nbytes <= 0 or seconds <= 0:
+            return
+        with self._lock:
+            self._bps += self.alpha * (nbytes / seconds - self._bps)
+            self.samples += 1
+
+    def record_failure(self):
+        """Timeout/lỗi mạng -> hạ ước lượng một nửa để lần sau gửi ảnh nhỏ hơn."""
+        with self._lock:
+            self._bps *= 0.5
+
+
+def byte_budget(estimator: ThroughputEstimator, target_upload_s=5.0, max_bytes=300 * 1024,
+                min_bytes=15 * 1024) -> int:
+    return int(max(min_bytes, min(max_bytes, estimator.bps * float(target_upload_s))))
+
+
+def _encode(img, quality: int) -> bytes:
+    import cv2
+    ok, buf = cv2.imencode(".jpg", img, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    if not ok:
+        raise RuntimeError("cv2.imencode JPEG thất bại")
+    return buf.tobytes()
+
+
+def _fit_quality(img, budget: int, lo=MIN_QUALITY, hi=MAX_QUALITY):
+    """Tìm nhị phân quality cao nhất mà JPEG <= budget. Trả (bytes, quality) hoặc (None, None)."""
+    best = (None, None)
+    while lo <= hi:
+        q = (lo + hi) // 2
+        data = _encode(img, q)
+        if len(data) <= budget:
+            best = (data, q)
+            lo = q + 1
+        else:
+            hi = q - 1
+    return best
+
+
+def prepare_jpeg(src, budget: int, widths=WIDTH_LADDER):
+    """
+    src: đường dẫn JPEG, bytes JPEG hoặc frame BGR (numpy).
+    Trả (jpeg_bytes, info) với info = {"width", "height", "quality", "bytes", "budget"}.
+    Ảnh gốc đã nhỏ hơn budget thì gửi nguyên (không re-encode).
+    """
+    import cv2
+    import numpy as np
+
+    original = None
+    if isinstance(src, (bytes, bytearray)):
+        original = bytes(src)
+        img = cv2.imdecode(np.frombuffer(original, dtype=np.uint8), cv2.IMREAD_COLOR)
+    elif isinstance(src, str):
+        with open(src, "rb") as f:
+            original = f.read()
+        img = cv2.imdecode(np.frombuffer(original, dtype=np.uint8), cv2.IMREAD_COLOR)
+    else:
+        img = src
+    if img is None:
+        raise ValueError("Không decode được ảnh")
+
+    h0, w0 = img.shape[:2]
+    if original is not None and len(original) <= budget:
+        return original, {"width": w0, "height": h0, "quality": None,
+                          "bytes": len(original), "budget": budget}
+
+    data, q, w, h = None, None, w0, h0
+    for target_w in [w0] + [x for x in widths if x < w0]:
+        if target_w == w0:
+            scaled = img
+        else:
+            th = int(round(h0 * target_w / float(w0)))
+            scaled = cv2.resize(img, (target_w, th), interpolation=cv2.INTER_AREA)
+        data, q = _fit_quality(scaled, budget)
+        if data is not None:
+            w, h = scaled.shape[1], scaled.shape[0]
+            break
+    if data is None:
+        # Không bậc nào vừa: gửi bậc nhỏ nhất ở chất lượng thấp nhất
+        q = MIN_QUALITY
+        data = _encode(scaled, q)
+        w, h = scaled.shape[1], scaled.shape[0]
+    return data, {"width": w, "height": h, "quality": q, "bytes": len(data), "budget": budget}
+
+
+class ImagePreparer:
+    """Gói estimator + cấu hình (settings.yml -> image_prep) cho các luồng upload ảnh."""
+
+    def __init__(self, target_upload_s=5.0, max_bytes=300 * 1024, min_bytes=15 * 1024,
+                 initial_bps=64 * 1024):
+        self.target_upload_s = float(target_upload_s)
+        self.max_bytes = int(max_bytes)
+        self.min_bytes = int(min_bytes)
+        self.estimator = ThroughputEstimator(initial_bps=initial_bps)
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        c = (cfg or {}).get("image_prep", {}) or {}
+        return cls(target_upload_s=c.get("target_upload_s", 5.0),
+                   max_bytes=int(c.get("max_kb", 300)) * 1024,
+                   min_bytes=int(c.get("min_kb", 15)) * 1024,
+                   initial_bps=int(c.get("initial_kbps", 64)) * 1024)
+
+    def budget(self) -> int:
+        return byte_budget(self.estimator, self.target_upload_s, self.max_bytes, self.min_bytes)
+
+    def prepare(self, src):
+        return prepare_jpeg(src, self.budget())
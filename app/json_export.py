@@ -1,31 +1,27 @@
 # app/json_export.py
 import os, json, time
 from datetime import datetime
-from app.sen0501_i2c import Sen0501
-from app.sen0220_uart import Sen0220
-from app.es_soil7 import ESSoil7
+from app.metrics import read_sensor
+from app.registry import load
 
 def _iso_now():
     return datetime.now().isoformat(timespec="seconds")
 
-def collect_all(cfg, include_gpio=False):
-    """Đọc cả ENV, CO2, SOIL và GPIO (nếu yêu cầu) rồi trả dict JSON-ready."""
+def open_sensors(cfg):
+    """Tạo 3 đối tượng sensor (ENV, CO2, SOIL) theo config (driver import lúc gọi)."""
+    Sen0501, Sen0220, ESSoil7 = load("sen0501_i2c"), load("sen0220"), load("es_soil7")
     s1 = Sen0501(bus=cfg["sen0501"]["i2c_bus"], addr=int(cfg["sen0501"]["address"]))
     s2 = Sen0220(port=cfg["sen0220"]["port"], baud=cfg["sen0220"]["baud"])
     soil = ESSoil7(port=cfg["soil7"]["port"], slave=cfg["soil7"]["slave"],
                    baud=cfg["soil7"]["baud"], timeout=cfg["soil7"]["timeout"],
                    inter_byte_timeout=cfg["soil7"]["inter_byte_timeout"])
+    return s1, s2, soil
 
-    a = s1.read()
-    b = s2.read()
-    try:
-        c = soil.read()
-    except Exception:
-        c = None
-
-    data = {
-        "ts": _iso_now(),
-        "device_id": cfg.get("device_id") or None,
+def build_record(ts, device_id, a, b, c):
+    """Ghép kết quả đọc ENV (a), CO2 (b), SOIL (c, có thể None) thành bản ghi chuẩn."""
+    return {
+        "ts": ts,
+        "device_id": device_id or None,
         "env": {
             "temp_c": a.get("temp_c"),
             "rh_pct": a.get("rh_pct"),
@@ -46,6 +42,22 @@ def collect_all(cfg, include_gpio=False):
             "salt_mgL": c.get("salt_mgL"),
         },
     }
+
+def collect_all(cfg, include_gpio=False, include_canopy=False, frame=None):
+    """Đọc cả ENV, CO2, SOIL, GPIO và chỉ số canopy (nếu yêu cầu) rồi trả dict JSON-ready.
+
+    frame: frame BGR đã chụp sẵn để tính canopy (None -> tự lấy từ camera service).
+    """
+    s1, s2, soil = open_sensors(cfg)
+
+    a = read_sensor("sen0501", s1)
+    b = read_sensor("sen0220", s2)
+    try:
+        c = read_sensor("es_soil7", soil)
+    except Exception:
+        c = None
+
+    data = build_record(_iso_now(), cfg.get("device_id"), a, b, c)
     
     # Thêm GPIO states nếu được yêu cầu
     if include_gpio:
@@ -56,6 +68,18 @@ def collect_all(cfg, include_gpio=False):
             print(f"[Warning] Could not read GPIO states: {e}")
             data["gpio"] = None
     
+    # Chỉ số canopy tính trên Pi (ExG, độ sáng, diện tích lá ước lượng)
+    if include_canopy:
+        try:
+            from app.canopy import metrics_from_config
+            if frame is None:
+                from app.camera_service import get_service
+                frame = get_service().capture_array()
+            data["canopy"] = metrics_from_config(frame, cfg)
+        except Exception as e:
+            print(f"[Warning] Could not compute canopy metrics: {e}")
+            data["canopy"] = None
+
     return data
 
 def write_json(path, data):
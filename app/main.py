@@ -2,15 +2,20 @@
 import time, csv, os, sys, json
 from datetime import datetime
 from app.config import load_config
-from app.sen0501_i2c import Sen0501 as Sen0501_I2C
-from app.sen0501_uart import Sen0501UART as Sen0501_UART
-from app.sen0220_uart import Sen0220
-from app.es_soil7 import ESSoil7
-from app.dashboard import run as run_dashboard
 from app.json_export import collect_all, write_json, append_jsonl
-from app.uploader import post_file
-from app.cam_capture_cli import capture_jpeg_cli
-from app.uploader_greenimage import upload_green_image
+from app.registry import lazy
+
+# Driver/subsystem import lazy (app/registry.py): menu nào dùng mới import thư viện
+# phần cứng, requests, dateutil, camera... -> khởi động nhanh khi systemd/cron gọi lại
+Sen0501_I2C = lazy("sen0501_i2c")
+Sen0501_UART = lazy("sen0501_uart")
+Sen0220 = lazy("sen0220")
+ESSoil7 = lazy("es_soil7")
+run_dashboard = lazy("dashboard")
+capture_jpeg = lazy("camera")
+post_file = lazy("app.uploader:post_file")
+upload_green_image = lazy("app.uploader_greenimage:upload_green_image")
+upload_green_image_bytes = lazy("app.uploader_greenimage:upload_green_image_bytes")
 
 # Cấu hình cho upload ảnh lên Render
 IMAGE_UPLOAD_CFG = {
@@ -19,6 +24,8 @@ IMAGE_UPLOAD_CFG = {
     "img_dir": os.path.expanduser("~/greeneco_out/images"),
     "auth_token": None,  # nếu server yêu cầu thì nhét vào
 }
+# Chế độ gửi (chunked / max_parallel) đọc từ settings.yml -> image_upload
+PREPARED_DIR = ".prepared"   # bản đã prepare_jpeg chờ gửi chunked, trong img_dir
 
 # GPIO control sẽ được import lazy để tránh lỗi trên máy không có RPi.GPIO
 _gpio_initialized = False
@@ -232,6 +239,81 @@ def stream_jsonl(cfg):
         except Exception:
             pass
 
+def stream_aggregate(cfg):
+    """
+    Chế độ upload aggregate: raw 1 Hz vẫn ghi local (JSONL), server chỉ nhận
+    min/max/mean/stddev/count/last theo cửa sổ của từng metric.
+    """
+    from app.aggregator import WindowAggregator, AggregateOutbox
+    from app.uploader import post_aggregates
+    from app import metrics
+
+    path = cfg["export"]["jsonl_path"]
+    hz = max(1, int(cfg["logging"].get("interval_hz", 1)))
+    dt = 1.0 / hz
+    agg = WindowAggregator.from_config(cfg)
+    # Upload chạy ở luồng riêng, thử lại có back-off; vòng lấy mẫu chỉ đẩy vào outbox
+    outbox = AggregateOutbox.from_config(cfg, lambda p: post_aggregates(p)[0]).start()
+    print(f"Aggregate upload @ {hz} Hz (raw ghi local: {path}). Nhấn q để dừng (hoặc Ctrl+C).")
+
+    fd = None; old_attr = None; kb_enabled = False
+    try:
+        # Thiết lập đọc phím không chặn trên Linux/TTY
+        import sys as _sys
+        import select as _select
+        try:
+            import termios as _termios, tty as _tty
+            fd = _sys.stdin.fileno()
+            old_attr = _termios.tcgetattr(fd)
+            _tty.setcbreak(fd)
+            kb_enabled = True
+        except Exception:
+            kb_enabled = False
+
+        jitter = metrics.LOOP_JITTER_S.labels("stream_aggregate")
+        next_due = time.monotonic()
+        while True:
+            # Kiểm tra phím 'q' để thoát
+            if kb_enabled:
+                try:
+                    if _select.select([_sys.stdin], [], [], 0)[0]:
+                        ch = _sys.stdin.read(1)
+                        if ch and ch.lower() == 'q':
+                            break
+                except Exception:
+                    pass
+
+            jitter.observe(max(0.0, time.monotonic() - next_due))
+            next_due = time.monotonic() + dt
+            try:
+                data = collect_all(cfg)
+                append_jsonl(path, data)
+                outbox.put(agg.add(data))
+            except Exception as e:
+                print("Aggregate read error:", e, file=sys.stderr)
+            time.sleep(dt)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # Cửa sổ dở dang: lưu lại để lần chạy sau gom tiếp (gửi bây giờ thì lần sau gửi trùng),
+        # không cấu hình state_path thì mới gửi nốt
+        if not agg.save():
+            outbox.put(agg.flush())
+        outbox.stop(timeout=10)
+        if len(outbox):
+            print(f"[Agg] Còn {len(outbox)} cửa sổ trong outbox, gửi tiếp ở lần chạy sau")
+        # Menu chạy ở tiến trình riêng (không có /metrics) -> ghi file textfile để xem sau
+        prom = (cfg.get("metrics", {}) or {}).get("textfile")
+        if prom:
+            metrics.write_textfile(prom)
+            print(f"[Metrics] Đã ghi {prom}")
+        # Khôi phục chế độ terminal
+        try:
+            if kb_enabled and old_attr is not None:
+                _termios.tcsetattr(fd, _termios.TCSADRAIN, old_attr)
+        except Exception:
+            pass
+
 def servo_menu(cfg=None):
     """Menu điều khiển servo cửa: mở/đóng/giữa/đặt góc.
     Import chậm để tránh side-effect trên máy không có GPIO.
@@ -300,6 +382,7 @@ def gpio_control_menu(cfg=None):
     
     # Khởi tạo GPIO lần đầu
     if not _gpio_initialized:
+        gpio.configure((cfg or {}).get("gpio"))
         gpio.init_gpio()
         _gpio_initialized = True
         # In thông tin backend để người dùng biết đang dùng RPi.GPIO hay mock
@@ -370,48 +453,242 @@ def gpio_control_menu(cfg=None):
         else:
             print("Lựa chọn không hợp lệ.")
 
-def menu_upload_image_once():
-    """Chụp ảnh từ camera và gửi lên server Render."""
+_image_deduper = None
+_image_preparer = None
+
+def _prepare_image(cfg, src):
+    """
+    src: đường dẫn JPEG hoặc frame BGR. Trả (jpeg_bytes, info): image_prep bật thì
+    budget theo băng thông đo được, tắt thì chỉ chặn trần max_kb.
+    """
+    global _image_preparer
+    from app.image_prep import ImagePreparer, prepare_jpeg
+    if _image_preparer is None:
+        _image_preparer = ImagePreparer.from_config(cfg)
+    adaptive = ((cfg or {}).get("image_prep", {}) or {}).get("enabled", False)
+    data, info = prepare_jpeg(src, _image_preparer.budget() if adaptive else _image_preparer.max_bytes)
+    print(f"[Upload] Ảnh {info['width']}x{info['height']} q={info['quality']} "
+          f"{info['bytes'] // 1024} KB (budget {info['budget'] // 1024} KB, "
+          f"~{_image_preparer.estimator.bps / 1024:.0f} KB/s)")
+    return data, info
+
+def _image_upload_opts(cfg):
+    up = (cfg or {}).get("image_upload", {}) or {}
+    return bool(up.get("chunked", False)), max(1, int(up.get("max_parallel", 2)))
+
+def _prepared_file(cfg, img_path):
+    """
+    Ghi bản prepare_jpeg của ảnh ra đĩa cho upload chunked. Giữ tới khi gửi xong để
+    lần sau resume đúng cùng bytes/sha256 thay vì prepare lại theo budget mới.
+    """
+    out_dir = os.path.join(IMAGE_UPLOAD_CFG["img_dir"], PREPARED_DIR)
+    out = os.path.join(out_dir, os.path.basename(img_path))
+    if not os.path.exists(out):
+        data, _ = _prepare_image(cfg, img_path)
+        os.makedirs(out_dir, exist_ok=True)
+        with open(out + ".tmp", "wb") as f:
+            f.write(data)
+        os.replace(out + ".tmp", out)
+    return out
+
+def _upload_images(cfg, img_paths):
+    """
+    Gửi nhiều ảnh, ảnh nào cũng qua prepare_jpeg trước. image_upload.chunked -> upload_many_chunked
+    (tối đa max_parallel luồng), không thì gửi lần lượt bytes trong RAM.
+    Trả {path: response_json | Exception}.
+    """
+    chunked, max_parallel = _image_upload_opts(cfg)
+    api, dev, token = IMAGE_UPLOAD_CFG["api_base"], IMAGE_UPLOAD_CFG["device_id"], IMAGE_UPLOAD_CFG["auth_token"]
+    results = {}
+    if not chunked:
+        for p in img_paths:
+            try:
+                data, _ = _prepare_image(cfg, p)
+                results[p] = upload_green_image_bytes(api, data, os.path.basename(p), dev, token=token,
+                                                      estimator=_image_preparer.estimator)
+            except Exception as e:
+                results[p] = e
+        return results
+    from app.uploader_greenimage import upload_many_chunked
+    prepared = {}
+    for p in img_paths:
+        try:
+            prepared[_prepared_file(cfg, p)] = p
+        except Exception as e:
+            results[p] = e
+    for out, res in upload_many_chunked(api, list(prepared), dev, max_parallel=max_parallel, token=token).items():
+        results[prepared[out]] = res
+        if not isinstance(res, Exception):
+            try:
+                os.remove(out)
+            except FileNotFoundError:
+                pass
+    return results
+
+def _send_image(cfg, img_path):
+    """Gửi 1 ảnh theo image_upload/image_prep trong settings.yml; lỗi thì raise."""
+    res = _upload_images(cfg, [img_path])[img_path]
+    if isinstance(res, Exception):
+        raise res
+    return res
+
+def menu_upload_image_once(cfg=None):
+    """Chụp ảnh từ camera và gửi lên server Render (bỏ qua nếu gần trùng ảnh vừa gửi)."""
+    global _image_deduper
     try:
         os.makedirs(IMAGE_UPLOAD_CFG["img_dir"], exist_ok=True)
         ts = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
         img_path = os.path.join(IMAGE_UPLOAD_CFG["img_dir"], f"{ts}.jpg")
         
         print(f"[Camera] Đang chụp ảnh lưu vào: {img_path}")
-        img_path, _ = capture_jpeg_cli(img_path, width=1280, height=720, quality=80)
+        img_path, _ = capture_jpeg(img_path, width=1280, height=720, quality=80)
         print(f"[Camera] Đã chụp thành công: {img_path}")
+
+        # Perceptual hash: ảnh gần trùng ảnh đã gửi -> chỉ ghi tham chiếu, không upload
+        h = None
+        dedup_cfg = (cfg or {}).get("image_dedup", {}) or {}
+        if dedup_cfg.get("enabled", False):
+            try:
+                from app.image_dedup import ImageDeduper, load_image_for_hash
+                if _image_deduper is None:
+                    _image_deduper = ImageDeduper.from_config(cfg)
+                h = _image_deduper.hash_image(load_image_for_hash(img_path))
+                dup, match, dist = _image_deduper.check(h)
+                if dup:
+                    _image_deduper.record_skip(h, img_path, match, dist,
+                                               device_id=IMAGE_UPLOAD_CFG["device_id"])
+                    print(f"[Dedup] Ảnh gần trùng (Hamming={dist}) với {match['ref']}, bỏ qua upload")
+                    return
+            except Exception as e:
+                print(f"[Dedup] Lỗi tính hash, vẫn upload: {e}")
+                h = None
         
         print(f"[Upload] Đang gửi ảnh lên {IMAGE_UPLOAD_CFG['api_base']}...")
-        resp = upload_green_image(
-            IMAGE_UPLOAD_CFG["api_base"], 
-            img_path, 
-            IMAGE_UPLOAD_CFG["device_id"], 
-            token=IMAGE_UPLOAD_CFG["auth_token"]
-        )
+        resp = _send_image(cfg, img_path)
         print("[Upload] Thành công! Response:", resp)
+        if h is not None:
+            _image_deduper.mark_uploaded(h, img_path)
     except Exception as e:
         print(f"[Lỗi] Không thể chụp/gửi ảnh: {e}", file=sys.stderr)
 
+def run_timelapse(cfg):
+    """Chụp timelapse theo lịch vào ring buffer, upload ở luồng riêng. Nhấn q để dừng."""
+    from app.timelapse import TimelapseRunner
+
+    chunked, max_parallel = _image_upload_opts(cfg)
+    runner = TimelapseRunner(cfg, upload_fn=lambda paths: _upload_images(cfg, paths),
+                             upload_batch=max_parallel if chunked else 1)
+    st = runner.buffer.stats()
+    print(f"Timelapse vào {runner.buffer.dir} ({st['files']} ảnh, {st['pending']} chờ upload). "
+          "Nhấn q để dừng (hoặc Ctrl+C).")
+    runner.start()
+    fd = None; old_attr = None; kb_enabled = False
+    try:
+        import sys as _sys
+        import select as _select
+        try:
+            import termios as _termios, tty as _tty
+            fd = _sys.stdin.fileno()
+            old_attr = _termios.tcgetattr(fd)
+            _tty.setcbreak(fd)
+            kb_enabled = True
+        except Exception:
+            kb_enabled = False
+
+        while True:
+            if kb_enabled:
+                try:
+                    if _select.select([_sys.stdin], [], [], 0.5)[0]:
+                        ch = _sys.stdin.read(1)
+                        if ch and ch.lower() == 'q':
+                            break
+                except Exception:
+                    pass
+            else:
+                time.sleep(0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        runner.stop()
+        # Khôi phục chế độ terminal
+        try:
+            if kb_enabled and old_attr is not None:
+                _termios.tcsetattr(fd, _termios.TCSADRAIN, old_attr)
+        except Exception:
+            pass
+
+def upload_bundle_once(cfg):
+    """Chụp sensor + ảnh cùng 1 timestamp và gửi lên server trong 1 request."""
+    try:
+        from app.bundle import BundleCapturer
+        from app.uploader import post_bundle
+
+        cap = BundleCapturer(cfg, IMAGE_UPLOAD_CFG["img_dir"])
+        try:
+            record, jpeg = cap.capture()
+        finally:
+            cap.close()
+        print(f"[Bundle] {record['ts']} ảnh={record['image']['file']} "
+              f"({record['image']['bytes'] // 1024} KB) canopy={record['canopy']}")
+        code, text = post_bundle(record, jpeg, token=IMAGE_UPLOAD_CFG["auth_token"])
+        print(f"[Bundle] POST OK: {code}")
+        print(text)
+    except Exception as e:
+        print(f"[Bundle] LỖI: {e}", file=sys.stderr)
+
+_canopy_gate = None
+
 def upload_snapshot(cfg=None):
     """
-    Đọc sensors + GPIO và gửi lên server (không qua file).
+    Đọc sensors + GPIO (+ chỉ số canopy nếu bật) và gửi lên server (không qua file).
+    Ảnh full chỉ gửi kèm khi canopy thay đổi đáng kể hoặc đã lâu chưa gửi.
     """
+    global _canopy_gate
     try:
         from app.json_export import collect_all
         from app.uploader import post_dict
+
+        canopy_on = bool(((cfg or {}).get("camera", {}) or {}).get("canopy", {}).get("enabled", False))
+        frame = None
+        if canopy_on:
+            try:
+                from app.camera_service import get_service
+                frame = get_service().capture_array()
+            except Exception as e:
+                print(f"[Camera] Không lấy được frame cho canopy: {e}")
+                canopy_on = False
         
         print("[Upload] Đang đọc sensors và GPIO...")
-        data = collect_all(cfg, include_gpio=True)
+        data = collect_all(cfg, include_gpio=True, include_canopy=canopy_on, frame=frame)
         
         print("[Upload] Đang gửi lên server...")
         code, text = post_dict(data)
         print(f"[Upload] POST OK: {code}")
         print(text)
+
+        if canopy_on and data.get("canopy"):
+            from app.canopy import CanopyChangeGate
+            if _canopy_gate is None:
+                _canopy_gate = CanopyChangeGate.from_config(cfg)
+            if _canopy_gate.should_upload(data["canopy"]):
+                _upload_frame(cfg, frame)
+                _canopy_gate.mark_uploaded(data["canopy"])
+            else:
+                print("[Upload] Canopy không đổi, bỏ qua gửi ảnh full")
     except Exception as e:
         print(f"[Upload] LỖI: {e}")
         import traceback
         traceback.print_exc()
 
+def _upload_frame(cfg, frame):
+    """Frame BGR đã có sẵn -> prepare_jpeg encode 1 lần trong RAM rồi gửi (không ghi file, không chụp lại)."""
+    data, _ = _prepare_image(cfg, frame)
+    name = datetime.utcnow().strftime("%Y%m%dT%H%M%SZ") + ".jpg"
+    resp = upload_green_image_bytes(IMAGE_UPLOAD_CFG["api_base"], data, name,
+                                    IMAGE_UPLOAD_CFG["device_id"], token=IMAGE_UPLOAD_CFG["auth_token"],
+                                    estimator=_image_preparer.estimator)
+    print("[Upload] Ảnh canopy đã gửi:", resp)
+
 def main_menu():
     cfg = load_config("config/settings.yml")
     while True:
@@ -430,15 +707,20 @@ def main_menu():
         print("12) Điều khiển Servo (mở/đóng/giữa/góc)")
         print("13) Chụp & gửi ảnh (Render)")
         print("14) Điều khiển GPIO (Fan/Pump/Light)")
+        print("15) Upload aggregate theo cửa sổ (raw giữ local)")
+        print("16) Timelapse (chụp theo lịch, ring buffer, upload nền)")
+        print("17) Chụp bundle (sensor + ảnh cùng timestamp) & gửi 1 request")
 
         choice = input("Chọn: ").strip()
         if   choice == "1":
             try:
                 # Import chậm để tránh vướng môi trường thiếu picamera2/cv2 khi không dùng camera
                 from app.camera_preview import run as run_cam
+                from app.camera_service import release_service
+                release_service()
                 cam_cfg = cfg.get("camera", {})
                 res = tuple(cam_cfg.get("resolution", (1280, 720)))
-                run_cam(res)
+                run_cam(res, zero_copy=cam_cfg.get("preview_zero_copy", True))
             except Exception as e:
                 print(f"Lỗi camera preview: {e}")
         elif choice == "2": read_once_0501(cfg)
@@ -452,8 +734,11 @@ def main_menu():
         elif choice == "10": stream_jsonl(cfg)
         elif choice == "11": upload_snapshot(cfg)
         elif choice == "12": servo_menu(cfg)
-        elif choice == "13": menu_upload_image_once()
+        elif choice == "13": menu_upload_image_once(cfg)
         elif choice == "14": gpio_control_menu(cfg)
+        elif choice == "15": stream_aggregate(cfg)
+        elif choice == "16": run_timelapse(cfg)
+        elif choice == "17": upload_bundle_once(cfg)
         else:
             print("Lựa chọn không hợp lệ.")
 
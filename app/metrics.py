@@ -0,0 +1,307 @@
+# app/metrics.py
+"""
+Registry metric kiểu Prometheus (Counter / Gauge / Histogram bucket cố định)
+cho các đường nóng: đọc sensor, bật/tắt relay, upload, hàng đợi, độ trễ vòng lặp.
+
+- Ghi nhận rẻ: mỗi series là 1 object giữ sẵn, observe() chỉ là bisect + cộng
+  dưới 1 Lock, không cấp phát. Lấy series 1 lần rồi dùng lại:
+      READ_S = histogram("greeneco_sensor_read_seconds", "...", ("sensor",))
+      READ_S.labels("sen0220").observe(dt)
+- render() xuất text exposition format 0.0.4 cho GET /metrics (app/app.py).
+- Không phụ thuộc prometheus_client; mỗi tiến trình có registry riêng
+  (menu main.py và web server là 2 tiến trình khác nhau).
+"""
+import bisect
+import functools
+import threading
+import time
+
+# Bucket mặc định (giây): đọc I2C vài ms .. Modbus timeout 2 s .. upload chậm
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _fmt(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if float(v).is_integer():
+        return str(int(v))
+    return repr(float(v))
+
+
+def _escape(v) -> str:
+    return str(v).replace("\\", r"\\").replace("\n", r"\n").replace('"', r'\"')
+
+
+class _CounterChild:
+    __slots__ = ("_v", "_lock")
+
+    def __init__(self):
+        self._v = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1.0):
+        with self._lock:
+            self._v += n
+
+    def value(self) -> float:
+        return self._v
+
+
+class _GaugeChild:
+    __slots__ = ("_v", "_lock", "_fn")
+
+    def __init__(self):
+        self._v = 0.0
+        self._lock = threading.Lock()
+        self._fn = None
+
+    def set(self, v: float):
+        self._v = float(v)
+
+    def inc(self, n: float = 1.0):
+        with self._lock:
+            self._v += n
+
+    def dec(self, n: float = 1.0):
+        self.inc(-n)
+
+    def set_function(self, fn):
+        """Giá trị lấy lúc render (vd queue.qsize) -> không tốn gì ở đường nóng."""
+        self._fn = fn
+
+    def value(self) -> float:
+        if self._fn is not None:
+            try:
+                return float(self._fn())
+            except Exception:
+                return float("nan")
+        return self._v
+
+
+class _Timer:
+    __slots__ = ("_h", "_t0")
+
+    def __init__(self, h):
+        self._h = h
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._h.observe(time.perf_counter() - self._t0)
+        return False
+
+    def __call__(self, fn):
+        """Dùng làm decorator: mỗi lần gọi có timer riêng (an toàn đa luồng)."""
+        h = self._h
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Timer(h):
+                return fn(*args, **kwargs)
+        return wrapper
+
+
+class _HistogramChild:
+    __slots__ = ("_bounds", "_counts", "_sum", "_lock")
+
+    def __init__(self, bounds):
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)   # ô cuối = +Inf
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float):
+        i = bisect.bisect_left(self._bounds, v)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += v
+
+    def time(self) -> _Timer:
+        """with H.labels(...).time(): ... hoặc @H.labels(...).time() -> observe thời gian chạy."""
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return list(self._counts), self._sum
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames=()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values, **kv):
+        if kv:
+            values = tuple(kv[n] for n in self.labelnames)
+        key = tuple(str(v) for v in values)
+        if len(key) != len(self.labelnames):
+            raise ValueError(f"{self.name}: cần labels {self.labelnames}")
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def __getattr__(self, item):
+        # Metric không label: gọi thẳng inc()/set()/observe() trên metric
+        if item.startswith("_") or "_default" not in self.__dict__:
+            raise AttributeError(item)
+        return getattr(self.__dict__["_default"], item)
+
+    def _label_str(self, key, extra=None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = sorted(self._children.items(), key=lambda kv: kv[0])
+        for key, child in children:
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> list:
+        return [f"{self.name}{self._label_str(key)} {_fmt(child.value())}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, doc, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, key, child) -> list:
+        counts, total = child.snapshot()
+        lines, acc = [], 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            acc += n
+            lines.append(f"{self.name}_bucket{self._label_str(key, ('le', _fmt(bound)))} {acc}")
+        lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+        lines.append(f"{self.name}_count{self._label_str(key)} {acc}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, doc, labelnames, **kw):
+        with self._lock:
+            m = self._metrics.get(name)
+            if m is None:
+                m = self._metrics[name] = cls(name, doc, labelnames, **kw)
+            elif not isinstance(m, cls) or m.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} đã đăng ký với kiểu/label khác")
+            return m
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = [self._metrics[k] for k in sorted(self._metrics)]
+        lines = []
+        for m in metrics:
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def counter(name: str, doc: str, labelnames=()) -> Counter:
+    return REGISTRY._get_or_create(Counter, name, doc, labelnames)
+
+
+def gauge(name: str, doc: str, labelnames=()) -> Gauge:
+    return REGISTRY._get_or_create(Gauge, name, doc, labelnames)
+
+
+def histogram(name: str, doc: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY._get_or_create(Histogram, name, doc, labelnames, buckets=buckets)
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def write_textfile(path: str):
+    """Ghi render() ra file (ghi tạm rồi rename) cho tiến trình không chạy web server."""
+    import os
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp, path)
+
+
+# ===== Metric dùng chung giữa các module =====
+SENSOR_READ_S = histogram("greeneco_sensor_read_seconds",
+                          "Thời gian 1 lần đọc sensor", ("sensor",))
+SENSOR_FAILURES = counter("greeneco_sensor_read_failures_total",
+                          "Số lần đọc sensor lỗi (exception hoặc không có giá trị)", ("sensor",))
+GPIO_SWITCH_S = histogram("greeneco_gpio_switch_seconds",
+                          "Thời gian set_device/apply_batch (gồm chờ khoá + settle)", ("op",))
+GPIO_DEFERRED = counter("greeneco_gpio_deferred_total",
+                        "Số lệnh relay bị hoãn (gộp về ý định cuối) do min dwell / giới hạn tần suất",
+                        ("device",))
+UPLOAD_S = histogram("greeneco_upload_seconds",
+                     "Thời gian 1 request upload", ("kind", "outcome"))
+UPLOAD_RETRIES = counter("greeneco_upload_retries_total",
+                         "Số lần thử lại upload", ("kind",))
+QUEUE_DEPTH = gauge("greeneco_queue_depth", "Số phần tử đang chờ trong hàng đợi", ("queue",))
+LOOP_JITTER_S = histogram("greeneco_loop_jitter_seconds",
+                          "Độ trễ thức dậy so với lịch của vòng lặp định kỳ", ("loop",),
+                          buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                                   0.1, 0.25, 0.5, 1.0, 2.5))
+
+
+def read_sensor(name: str, sensor):
+    """sensor.read() có đo thời gian + đếm lỗi (exception hoặc dict toàn None)."""
+    t0 = time.perf_counter()
+    try:
+        data = sensor.read()
+    except Exception:
+        SENSOR_FAILURES.labels(name).inc()
+        raise
+    finally:
+        SENSOR_READ_S.labels(name).observe(time.perf_counter() - t0)
+    if isinstance(data, dict) and all(v is None for k, v in data.items() if k != "raw"):
+        SENSOR_FAILURES.labels(name).inc()
+    return data
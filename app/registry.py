@@ -0,0 +1,77 @@
+# app/registry.py
+"""
+Registry lazy cho driver/subsystem: chỉ import (và khởi tạo) thứ mà lệnh
+thực sự dùng. main.py khởi động không kéo theo requests, dateutil, pyserial,
+minimalmodbus, smbus/modbus_tk, RPi.GPIO, cv2... cho tới khi menu cần.
+
+    Sen0220 = lazy("app.sen0220_uart:Sen0220")
+    s = Sen0220(port=...)          # import app.sen0220_uart ở lần gọi đầu
+
+Tên ngắn trong DRIVERS dùng được với load("sen0220").
+Đo thời gian khởi động: python -m app.bench_startup
+"""
+import importlib
+import threading
+
+# Tên ngắn -> "module:thuộc_tính"
+DRIVERS = {
+    "sen0501_i2c": "app.sen0501_i2c:Sen0501",
+    "sen0501_uart": "app.sen0501_uart:Sen0501UART",
+    "sen0220": "app.sen0220_uart:Sen0220",
+    "es_soil7": "app.es_soil7:ESSoil7",
+    "dashboard": "app.dashboard:run",
+    "camera": "app.camera_service:capture_jpeg",
+    "servo": "app.servo:get_servo",
+    "gpio": "app.gpio_controller",
+}
+
+_cache = {}
+_lock = threading.Lock()
+
+
+def resolve(spec: str):
+    """'pkg.mod:attr' -> object (import 1 lần, có cache). 'pkg.mod' -> module."""
+    obj = _cache.get(spec)
+    if obj is not None:
+        return obj
+    with _lock:
+        obj = _cache.get(spec)
+        if obj is None:
+            mod_name, _, attr = spec.partition(":")
+            obj = importlib.import_module(mod_name)
+            if attr:
+                obj = getattr(obj, attr)
+            _cache[spec] = obj
+    return obj
+
+
+def load(name: str):
+    """Lấy driver theo tên ngắn trong DRIVERS (hoặc spec đầy đủ 'module:attr')."""
+    return resolve(DRIVERS.get(name, name))
+
+
+class LazyRef:
+    """Đại diện cho 1 object chưa import: gọi / lấy thuộc tính thì mới import."""
+    __slots__ = ("_spec",)
+
+    def __init__(self, spec: str):
+        self._spec = spec
+
+    def __call__(self, *args, **kwargs):
+        return resolve(self._spec)(*args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(resolve(self._spec), item)
+
+    def __repr__(self):
+        loaded = "loaded" if self._spec in _cache else "not loaded"
+        return f"<lazy {self._spec} ({loaded})>"
+
+
+def lazy(spec: str) -> LazyRef:
+    return LazyRef(DRIVERS.get(spec, spec))
+
+
+def loaded() -> list:
+    """Các spec đã thực sự được import (để debug/benchmark)."""
+    return sorted(_cache)
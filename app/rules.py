@@ -0,0 +1,281 @@
+# app/rules.py
+"""
+Rules engine điều khiển khí hậu vòng kín, rule khai báo ở settings.yml -> rules.
+
+Ví dụ: "co2.ppm > 1200 trong 30 s -> bật fan1, < 1000 thì tắt":
+    - name: co2_fan
+      metric: co2.ppm          # tên metric dạng flatten (như /api/iot/history)
+      above: 1200              # hoặc below: ...
+      clear: 1000              # ngưỡng nhả (hysteresis), mặc định = ngưỡng kích
+      for_s: 30                # điều kiện phải giữ liên tục bấy nhiêu giây mới kích
+      clear_for_s: 0           # tương tự khi nhả
+      min_on_s: 60             # thiết bị đã bật thì giữ tối thiểu
+      min_off_s: 60            # đã tắt thì nghỉ tối thiểu
+      action: {device: fan1, state: on}     # nhả -> trạng thái ngược (hoặc release: ...)
+      # action: {servo: open, release: close}  # servo cửa thông gió: open/close/mid
+
+Đánh giá tăng dần: mỗi reading chỉ xét rule của các metric ĐỔI giá trị
+(index metric -> rules) + các timer đã tới hạn (heap). Rule của metric không đổi
+và không có timer thì không tốn gì -> theo kịp nhịp lấy mẫu 1 Hz.
+Thao tác relay/servo chạy ở 1 luồng actuator riêng (servo chặn ~0.6 s).
+
+Thử trên dữ liệu cũ (không đụng phần cứng):
+    python -m app.rules --replay outbox/greeneco_stream.jsonl
+"""
+import collections
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.aggregator import flatten_reading
+
+SERVO_ACTIONS = ("open", "close", "mid")
+LOG_MAX = 1000                # số lần chuyển gần nhất giữ trong RulesEngine.log
+
+
+def _as_on(v) -> bool:
+    # YAML 1.1 đọc on/off không ngoặc thành True/False
+    if isinstance(v, bool):
+        return v
+    return str(v).strip().lower() in ("on", "true", "1")
+
+
+class Rule:
+    __slots__ = ("name", "metric", "above", "trigger", "clear", "for_s", "clear_for_s",
+                 "min_on_s", "min_off_s", "target", "engage", "release",
+                 "engaged", "pending_since", "gen")
+
+    def __init__(self, spec: dict):
+        self.name = str(spec.get("name") or f"{spec.get('metric')}")
+        self.metric = spec["metric"]
+        if "above" in spec:
+            self.above, self.trigger = True, float(spec["above"])
+        elif "below" in spec:
+            self.above, self.trigger = False, float(spec["below"])
+        else:
+            raise ValueError(f"Rule {self.name}: cần 'above' hoặc 'below'")
+        self.clear = float(spec.get("clear", self.trigger))
+        if (self.above and self.clear > self.trigger) or (not self.above and self.clear < self.trigger):
+            raise ValueError(f"Rule {self.name}: 'clear' phải nằm phía nhả của ngưỡng")
+        self.for_s = float(spec.get("for_s", 0))
+        self.clear_for_s = float(spec.get("clear_for_s", 0))
+        self.min_on_s = float(spec.get("min_on_s", 0))
+        self.min_off_s = float(spec.get("min_off_s", 0))
+
+        act = spec.get("action") or {}
+        if "device" in act:
+            self.target = ("device", str(act["device"]))
+            on = _as_on(act.get("state", "on"))
+            self.engage = on
+            rel = act.get("release")
+            self.release = (not on) if rel is None else _as_on(rel)
+        elif "servo" in act:
+            self.target = ("servo", "vent")
+            self.engage = str(act["servo"]).lower()
+            self.release = str(act.get("release", "close" if self.engage != "close" else "open")).lower()
+            for a in (self.engage, self.release):
+                if a not in SERVO_ACTIONS:
+                    raise ValueError(f"Rule {self.name}: servo action '{a}' không hợp lệ {SERVO_ACTIONS}")
+        else:
+            raise ValueError(f"Rule {self.name}: action cần 'device' hoặc 'servo'")
+
+        self.engaged = False
+        self.pending_since = None     # thời điểm điều kiện (kích hoặc nhả) bắt đầu đúng
+        self.gen = 0                  # tăng khi huỷ timer -> entry cũ trong heap bị bỏ qua
+
+    def wants_change(self, v: float) -> bool:
+        """Điều kiện đổi trạng thái (có hysteresis) đang đúng với giá trị v?"""
+        if not self.engaged:
+            return v > self.trigger if self.above else v < self.trigger
+        return v < self.clear if self.above else v > self.clear
+
+
+class RulesEngine:
+    def __init__(self, rules, gpio=None, servo=None, dry_run=False):
+        self.rules = list(rules)
+        self.gpio = gpio
+        self.servo = servo
+        self.dry_run = dry_run
+        self._index = {}             # metric -> [rule]
+        for r in self.rules:
+            self._index.setdefault(r.metric, []).append(r)
+        self._last = {}              # metric -> giá trị lần trước
+        self._timers = []            # heap (due, seq, gen, rule)
+        self._seq = 0
+        self._holders = {}           # target -> {rule.name: action} rule đang giữ thiết bị
+        self._last_switch = {}       # target -> (time, action)
+        self._lock = threading.Lock()
+        self._actuator = None if dry_run else \
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="rules-actuator")
+        self.evaluations = 0
+        self.switches = 0
+        self.log = collections.deque(maxlen=LOG_MAX)   # (t, rule, target, action) để xem lại / replay
+
+    @classmethod
+    def from_config(cls, cfg: dict, gpio=None, servo=None, dry_run=False):
+        c = (cfg or {}).get("rules", {}) or {}
+        return cls([Rule(s) for s in c.get("items") or []], gpio=gpio, servo=servo, dry_run=dry_run)
+
+    # ---------- đầu vào ----------
+    def on_reading(self, reading: dict, now: float = None):
+        """Listener của SensorCache. now: mốc thời gian (mặc định monotonic)."""
+        now = time.monotonic() if now is None else now
+        flat = flatten_reading(reading)
+        with self._lock:
+            for metric in (self._index.keys() & flat.keys()):
+                v = flat[metric]
+                first = metric not in self._last
+                if not first and self._last[metric] == v:
+                    continue
+                self._last[metric] = v
+                for rule in self._index[metric]:
+                    if first:
+                        self._sync(rule)
+                    self._evaluate(rule, v, now)
+            self._run_timers(now)
+
+    def tick(self, now: float = None):
+        """Chạy các timer đã tới hạn (khi không có reading mới)."""
+        with self._lock:
+            self._run_timers(time.monotonic() if now is None else now)
+
+    # ---------- máy trạng thái ----------
+    def _sync(self, rule: Rule):
+        """
+        Reading đầu tiên của metric: lấy trạng thái thật của relay làm trạng thái rule.
+        Relay đã ở trạng thái kích (bật tay / khôi phục sau khởi động lại) -> rule coi như
+        đang kích, nên giá trị hiện tại ở phía nhả sẽ tắt nó như bình thường.
+        """
+        if rule.target[0] != "device" or self.gpio is None or rule.engage == rule.release:
+            return
+        try:
+            state = bool(self.gpio.get_intent(rule.target[1]))
+        except Exception as e:
+            print(f"[Rules] Không đọc được trạng thái {rule.target[1]}: {e}")
+            return
+        if state == rule.engage and not rule.engaged:
+            rule.engaged = True
+            self._holders.setdefault(rule.target, {})[rule.name] = rule.engage
+
+    def _evaluate(self, rule: Rule, v: float, now: float):
+        self.evaluations += 1
+        if rule.wants_change(v):
+            if rule.pending_since is None:
+                rule.pending_since = now
+                hold = rule.clear_for_s if rule.engaged else rule.for_s
+                self._schedule(rule, now + hold)
+        elif rule.pending_since is not None:
+            # Điều kiện không giữ đủ lâu -> huỷ timer
+            rule.pending_since = None
+            rule.gen += 1
+
+    def _schedule(self, rule: Rule, due: float):
+        self._seq += 1
+        heapq.heappush(self._timers, (due, self._seq, rule.gen, rule))
+
+    def _run_timers(self, now: float):
+        while self._timers and self._timers[0][0] <= now:
+            _, _, gen, rule = heapq.heappop(self._timers)
+            if gen != rule.gen or rule.pending_since is None:
+                continue
+            wait_until = self._blocked_until(rule)
+            if wait_until > now:
+                self._schedule(rule, wait_until)    # chờ hết min_on/min_off rồi thử lại
+                continue
+            rule.pending_since = None
+            rule.gen += 1
+            rule.engaged = not rule.engaged
+            self._apply(rule, now)
+
+    def _blocked_until(self, rule: Rule) -> float:
+        last = self._last_switch.get(rule.target)
+        if last is None:
+            return 0.0
+        t, action = last
+        desired = self._desired(rule, not rule.engaged)
+        if desired == action:
+            return 0.0
+        if rule.target[0] == "device":
+            return t + (rule.min_on_s if action else rule.min_off_s)
+        return t + (rule.min_on_s if action != "close" else rule.min_off_s)
+
+    def _desired(self, rule: Rule, engaged: bool):
+        """Trạng thái đích của thiết bị nếu rule chuyển sang engaged (tính cả rule khác đang giữ)."""
+        holders = dict(self._holders.get(rule.target, {}))
+        if engaged:
+            holders[rule.name] = rule.engage
+        else:
+            holders.pop(rule.name, None)
+        if holders:
+            return list(holders.values())[-1]
+        return rule.release
+
+    def _apply(self, rule: Rule, now: float):
+        action = self._desired(rule, rule.engaged)
+        holders = self._holders.setdefault(rule.target, {})
+        if rule.engaged:
+            holders[rule.name] = rule.engage
+        else:
+            holders.pop(rule.name, None)
+        last = self._last_switch.get(rule.target)
+        if last is not None and last[1] == action:
+            return
+        self._last_switch[rule.target] = (now, action)
+        self.switches += 1
+        self.log.append((now, rule.name, rule.target[1], action))
+        state = ("ON" if action else "OFF") if rule.target[0] == "device" else action
+        print(f"[Rules] {rule.name}: {rule.target[1]} -> {state}")
+        if self._actuator is not None:
+            self._actuator.submit(self._actuate, rule.target, action)
+
+    def _actuate(self, target, action):
+        kind, name = target
+        try:
+            if kind == "device" and self.gpio is not None:
+                self.gpio.apply_batch([(name, bool(action))])
+            elif kind == "servo" and self.servo is not None:
+                {"open": self.servo.open_door, "close": self.servo.close_door,
+                 "mid": self.servo.vent_mid}[action]()
+        except Exception as e:
+            print(f"[Rules] Lỗi điều khiển {name}: {e}")
+
+    def close(self):
+        if self._actuator is not None:
+            self._actuator.shutdown(wait=True)
+
+
+def start_rules(cfg: dict, gpio):
+    """Gắn rules engine vào SensorCache của tiến trình chủ GPIO (app.py)."""
+    from app.registry import lazy
+    from app.sensor_cache import get_sensor_cache
+    engine = RulesEngine.from_config(cfg, gpio=gpio, servo=lazy("app.servo"))
+    get_sensor_cache(cfg).add_listener(engine.on_reading)
+    print(f"[Rules] {len(engine.rules)} rule, {len(engine._index)} metric")
+    return engine
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from app.config import load_config
+    from app.history import to_epoch
+
+    ap = argparse.ArgumentParser(description="Chạy thử rules trên file JSONL (dry-run)")
+    ap.add_argument("--replay", required=True, help="file JSONL (export.jsonl_path)")
+    ap.add_argument("--config", default="config/settings.yml")
+    args = ap.parse_args()
+
+    engine = RulesEngine.from_config(load_config(args.config) or {}, dry_run=True)
+    n, t0 = 0, time.perf_counter()
+    with open(args.replay, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+                engine.on_reading(rec, now=to_epoch(rec["ts"]))
+                n += 1
+            except Exception:
+                continue
+    dt = time.perf_counter() - t0
+    print(f"[Rules] {n} reading, {engine.evaluations} lần xét rule, "
+          f"{engine.switches} lần chuyển, {dt * 1e6 / max(n, 1):.1f} µs/reading")
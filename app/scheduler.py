@@ -0,0 +1,488 @@
+# app/scheduler.py
+"""
+Lịch hẹn giờ cho thiết bị (thay cho các script cron: mỗi lần cron gọi là 1 tiến
+trình Python mới + init lại GPIO). Khai báo ở settings.yml -> schedules:
+
+    - name: light_day
+      device: light
+      window: "06:00-18:00"      # bật trong khung giờ, qua nửa đêm được ("20:00-02:00")
+      days: [mon, tue, wed, thu, fri]   # tuỳ chọn, mặc định mọi ngày (ngày của giờ BẮT ĐẦU)
+    - name: pump_2h
+      device: pump
+      every: 2h                  # xung: bật duration mỗi 2 h, mốc tính từ "at" mỗi ngày
+      duration: 30s
+      at: "00:00"
+      window: "06:00-20:00"      # tuỳ chọn: chỉ chạy xung rơi vào khung này
+    - name: vent_noon
+      servo: open                # servo cửa thông gió: open/close/mid
+      release: close             # trạng thái khi hết lịch (mặc định close/open)
+      window: "11:00-14:00"
+
+1 luồng + 1 heap (thời điểm đổi trạng thái kế tiếp, entry): luồng ngủ tới sự kiện
+gần nhất nên vài trăm entry cũng gần như không tốn CPU. Trạng thái tính theo mức
+(entry đang "active" ở thời điểm t hay không) -> khởi động lại giữa khung giờ vẫn
+bật đúng; xung bị lỡ (máy tắt, mất điện) được chạy bù 1 lần nếu chưa quá catch_up.
+Lần chạy gần nhất của mỗi xung lưu ở state_path. Giờ hệ thống nhảy (NTP lúc boot,
+Pi không có RTC) -> lập lại toàn bộ lịch.
+
+Lịch chỉ đổi thiết bị ở ranh giới khung/xung: bật tắt tay giữa chừng qua API
+không bị ghi đè cho tới mốc kế tiếp.
+
+    python -m app.scheduler --list --hours 24   # xem trước các lần chuyển (không đụng GPIO)
+    python -m app.scheduler                     # chạy riêng khi không chạy web server
+"""
+import bisect
+import heapq
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+SERVO_ACTIONS = ("open", "close", "mid")
+DAY_NAMES = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+# Trước mốc này coi như đồng hồ chưa đồng bộ (Pi boot về 1970 khi chưa có NTP)
+SANE_EPOCH = 1577836800       # 2020-01-01
+# Thức dậy tối thiểu mỗi bấy nhiêu giây để phát hiện giờ hệ thống bị chỉnh
+MAX_SLEEP_S = 60.0
+CLOCK_JUMP_S = 5.0
+
+
+def _as_on(v) -> bool:
+    # YAML 1.1 đọc on/off không ngoặc thành True/False
+    if isinstance(v, bool):
+        return v
+    return str(v).strip().lower() in ("on", "true", "1")
+
+
+def parse_duration(v) -> float:
+    """30 | "30s" | "15m" | "2h" | "1d" -> giây."""
+    if isinstance(v, (int, float)):
+        return float(v)
+    s = str(v).strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    if s and s[-1] in units:
+        return float(s[:-1]) * units[s[-1]]
+    return float(s)
+
+
+def parse_hhmm(v) -> int:
+    """"06:30" -> giây trong ngày. YAML 1.1 có thể đọc 06:30 không ngoặc thành số (390)."""
+    if isinstance(v, int):
+        return v * 60
+    parts = [int(p) for p in str(v).strip().split(":")]
+    h, m, s = (parts + [0, 0])[:3]
+    if not (0 <= h < 24 and 0 <= m < 60 and 0 <= s < 60):
+        raise ValueError(f"Giờ không hợp lệ: {v}")
+    return h * 3600 + m * 60 + s
+
+
+def _midnight(t: float, day_offset: int = 0) -> datetime:
+    d = datetime.fromtimestamp(t).replace(hour=0, minute=0, second=0, microsecond=0)
+    return d + timedelta(days=day_offset)
+
+
+def _at(day: datetime, sod: float) -> float:
+    """Epoch của day (00:00 giờ địa phương) + sod giây (tính lại qua datetime để đúng khi đổi giờ)."""
+    return (day + timedelta(seconds=sod)).timestamp()
+
+
+def _sod(t: float, day: datetime) -> float:
+    """Số giây theo giờ đồng hồ từ 00:00 của day tới t (không tính giờ bị nhảy khi đổi giờ)."""
+    return (datetime.fromtimestamp(t) - day).total_seconds()
+
+
+class Window:
+    """Khung giờ hằng ngày [start, end), có thể qua nửa đêm, lọc theo ngày bắt đầu."""
+
+    def __init__(self, spec: str, days=None):
+        a, _, b = str(spec).partition("-")
+        self.start, self.end = parse_hhmm(a), parse_hhmm(b)
+        if self.start == self.end:
+            raise ValueError(f"Khung giờ rỗng: {spec}")
+        self.length = (self.end - self.start) % 86400
+        self.days = None
+        if days:
+            self.days = {DAY_NAMES.index(str(d).strip().lower()[:3]) for d in days}
+
+    def _intervals(self, t: float):
+        """Các khoảng [on, off) của hôm qua..7 ngày tới quanh t (đủ cho lọc theo ngày)."""
+        for k in range(-1, 8):
+            day = _midnight(t, k)
+            if self.days is not None and day.weekday() not in self.days:
+                continue
+            on = _at(day, self.start)
+            yield on, _at(day, self.start + self.length)
+
+    def contains(self, t: float) -> bool:
+        # Khoảng chứa t chỉ có thể bắt đầu hôm nay hoặc hôm qua
+        for k in (0, -1):
+            day = _midnight(t, k)
+            if self.days is not None and day.weekday() not in self.days:
+                continue
+            if _at(day, self.start) <= t < _at(day, self.start + self.length):
+                return True
+        return False
+
+    def next_change(self, t: float):
+        for on, off in self._intervals(t):
+            if on > t:
+                return on
+            if off > t:
+                return off
+        return None
+
+
+class Entry:
+    __slots__ = ("name", "target", "engage", "release", "window", "every", "duration",
+                 "slots", "catch_up_s", "last_run", "active")
+
+    def __init__(self, spec: dict, catch_up_s: float = None):
+        self.name = str(spec.get("name") or spec.get("device") or spec.get("servo"))
+        if "device" in spec:
+            self.target = ("device", str(spec["device"]))
+            self.engage = _as_on(spec.get("state", "on"))
+            rel = spec.get("release")
+            self.release = (not self.engage) if rel is None else _as_on(rel)
+        elif "servo" in spec:
+            self.target = ("servo", "vent")
+            self.engage = str(spec["servo"]).lower()
+            self.release = str(spec.get("release", "close" if self.engage != "close" else "open")).lower()
+            for a in (self.engage, self.release):
+                if a not in SERVO_ACTIONS:
+                    raise ValueError(f"Lịch {self.name}: servo action '{a}' không hợp lệ {SERVO_ACTIONS}")
+        else:
+            raise ValueError(f"Lịch {self.name}: cần 'device' hoặc 'servo'")
+
+        self.window = Window(spec["window"], spec.get("days")) if spec.get("window") else None
+        self.every = parse_duration(spec["every"]) if spec.get("every") else None
+        self.duration = self.slots = None
+        if self.every is not None:
+            if not (0 < self.every <= 86400):
+                raise ValueError(f"Lịch {self.name}: 'every' phải trong (0, 24h]")
+            self.duration = parse_duration(spec.get("duration", 60))
+            if not (0 < self.duration < self.every):
+                raise ValueError(f"Lịch {self.name}: 'duration' phải > 0 và < 'every'")
+            # Mốc xung trong ngày (giây), neo theo 'at' như cron */N
+            at = parse_hhmm(spec.get("at", "00:00"))
+            n = int(86400 // self.every) + 1
+            self.slots = sorted({(at + i * self.every) % 86400 for i in range(n)})
+            self.catch_up_s = parse_duration(spec.get("catch_up", catch_up_s if catch_up_s is not None else self.every))
+        elif self.window is None:
+            raise ValueError(f"Lịch {self.name}: cần 'window' hoặc 'every'")
+        self.last_run = None     # epoch lần xung bắt đầu gần nhất
+        self.active = False
+
+    # ---------- xung ----------
+    def _ok(self, ts: float) -> bool:
+        return self.window is None or self.window.contains(ts)
+
+    # Mốc xung theo giờ đồng hồ (như cron): ngày đổi giờ mốc 04:00 vẫn là 04:00 địa phương
+    def prev_slot(self, t: float):
+        for k in (0, -1, -2):
+            day = _midnight(t, k)
+            i = bisect.bisect_right(self.slots, _sod(t, day)) if k == 0 else len(self.slots)
+            for s in reversed(self.slots[:i]):
+                ts = _at(day, s)
+                if ts <= t and self._ok(ts):
+                    return ts
+        return None
+
+    def next_slot(self, t: float):
+        for k in (0, 1, 2):
+            day = _midnight(t, k)
+            i = bisect.bisect_right(self.slots, _sod(t, day)) if k == 0 else 0
+            for s in self.slots[i:]:
+                ts = _at(day, s)
+                if ts > t and self._ok(ts):
+                    return ts
+        return None
+
+    def catch_up(self, now: float) -> bool:
+        """Khi khởi động: xung gần nhất bị lỡ (và đã từng chạy trước đó) -> chạy bù 1 lần."""
+        if self.every is None or self.last_run is None:
+            return False
+        slot = self.prev_slot(now)
+        if slot is None or self.last_run >= slot or now - slot > self.catch_up_s:
+            return False
+        # Khởi động lại ngay trong xung -> chạy nốt; lỡ hẳn -> chạy đủ duration từ bây giờ
+        self.last_run = slot if now - slot < self.duration else now
+        return True
+
+    # ---------- chung ----------
+    def is_active(self, now: float) -> bool:
+        if self.every is None:
+            return self.window.contains(now)
+        if self.last_run is not None and self.last_run <= now < self.last_run + self.duration:
+            return True
+        return False
+
+    def fire(self, now: float) -> bool:
+        """Gọi tại mỗi sự kiện: xung tới hạn thì ghi nhận lần chạy. Trả True nếu last_run đổi."""
+        if self.every is None:
+            return False
+        slot = self.prev_slot(now)
+        if slot is not None and (self.last_run is None or self.last_run < slot) \
+                and now - slot < self.duration:
+            self.last_run = slot
+            return True
+        return False
+
+    def next_event(self, now: float):
+        if self.every is None:
+            return self.window.next_change(now)
+        cands = [self.next_slot(now)]
+        if self.last_run is not None and self.last_run + self.duration > now:
+            cands.append(self.last_run + self.duration)
+        cands = [c for c in cands if c is not None]
+        return min(cands) if cands else None
+
+
+class Scheduler:
+    def __init__(self, entries, gpio=None, servo=None, state_path: str = None, dry_run=False):
+        self.entries = list(entries)
+        names = [e.name for e in self.entries]
+        dup = {n for n in names if names.count(n) > 1}
+        if dup:
+            raise ValueError(f"Tên lịch bị trùng: {sorted(dup)}")
+        self.gpio = gpio
+        self.servo = servo
+        self.state_path = state_path
+        self.dry_run = dry_run
+        self._by_target = {}
+        for e in self.entries:
+            self._by_target.setdefault(e.target, []).append(e)
+        self._heap = []              # (t, seq, entry) - mỗi entry đúng 1 phần tử
+        self._seq = 0
+        self._applied = {}           # target -> trạng thái lịch đã áp lần cuối
+        self._cond = threading.Condition()
+        self._stop = False
+        self._thread = None
+        self._clock_offset = None
+        self.events = 0
+        self.log = []                # (t, target, action)
+        self._load()
+
+    @classmethod
+    def from_config(cls, cfg: dict, gpio=None, servo=None, dry_run=False):
+        c = (cfg or {}).get("schedules", {}) or {}
+        catch_up = c.get("catch_up")
+        catch_up = parse_duration(catch_up) if catch_up is not None else None
+        return cls([Entry(s, catch_up) for s in c.get("items") or []], gpio=gpio, servo=servo,
+                   state_path=None if dry_run else c.get("state_path", "outbox/greeneco_schedule.json"),
+                   dry_run=dry_run)
+
+    # ---------- lưu trạng thái ----------
+    def _load(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                last = (json.load(f) or {}).get("last_run", {})
+            for e in self.entries:
+                if e.name in last:
+                    e.last_run = float(last[e.name])
+        except Exception as e:
+            print(f"[Schedule] Bỏ qua state lỗi: {e}")
+
+    def _save(self):
+        if not self.state_path:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"last_run": {e.name: e.last_run for e in self.entries if e.last_run is not None}}, f)
+        os.replace(tmp, self.state_path)
+
+    # ---------- lập lịch ----------
+    def _push(self, entry: Entry, now: float):
+        t = entry.next_event(now)
+        if t is not None:
+            self._seq += 1
+            heapq.heappush(self._heap, (t, self._seq, entry))
+
+    def plan(self, now: float = None, catch_up: bool = True):
+        """(Lập lại) toàn bộ heap từ thời điểm now; áp trạng thái theo mức cho mọi thiết bị."""
+        now = time.time() if now is None else now
+        ran = [e for e in self.entries if catch_up and e.catch_up(now)]
+        for e in ran:
+            print(f"[Schedule] {e.name}: chạy bù xung bị lỡ")
+        self._heap = []
+        fired = False
+        for e in self.entries:
+            fired |= e.fire(now)
+            e.active = e.is_active(now)
+            self._push(e, now)
+        if ran or fired:
+            self._save()
+        self._apply(list(self._by_target), now, force=True)
+
+    def run_due(self, now: float = None) -> int:
+        """Xử lý mọi sự kiện đã tới hạn. Trả số sự kiện."""
+        now = time.time() if now is None else now
+        touched, fired, n = set(), False, 0
+        while self._heap and self._heap[0][0] <= now:
+            _, _, e = heapq.heappop(self._heap)
+            fired |= e.fire(now)
+            e.active = e.is_active(now)
+            touched.add(e.target)
+            self._push(e, now)
+            n += 1
+        self.events += n
+        if fired:
+            self._save()
+        if touched:
+            self._apply(touched, now)
+        return n
+
+    def next_due(self):
+        return self._heap[0][0] if self._heap else None
+
+    # ---------- thiết bị ----------
+    def _desired(self, target):
+        entries = self._by_target[target]
+        active = [e for e in entries if e.active]
+        if target[0] == "device":
+            return any(e.engage for e in active) if active else entries[0].release
+        return active[-1].engage if active else entries[0].release
+
+    def _apply(self, targets, now: float, force=False):
+        batch = []
+        for target in targets:
+            want = self._desired(target)
+            if not force and self._applied.get(target) == want:
+                continue
+            self.log.append((now, target[1], want))
+            if target[0] == "device":
+                batch.append((target[1], bool(want)))
+                continue
+            self._applied[target] = want
+            if not self.dry_run:
+                self._move_servo(want)
+        if not batch:
+            return
+        if not self.dry_run:
+            print("[Schedule] " + ", ".join(f"{d} -> {'ON' if s else 'OFF'}" for d, s in batch))
+        if self.dry_run or self.gpio is None:
+            results = [{} for _ in batch]
+        else:
+            ok, results = self.gpio.apply_batch(batch)
+            if not ok:
+                print(f"[Schedule] Lỗi áp lịch: {results}")
+                return
+        # Chỉ ghi nhận thiết bị đã thật sự ghi; lệnh bị hoãn (min dwell / giới hạn tần suất)
+        # hoặc bị lệnh tay thay trong lúc giãn cách -> mốc sau vẫn phải gửi lại
+        for (dev, on), r in zip(batch, results):
+            if "pending" not in r and not r.get("superseded"):
+                self._applied[("device", dev)] = on
+
+    def _move_servo(self, action):
+        print(f"[Schedule] vent -> {action}")
+        if self.servo is None:
+            return
+        try:
+            {"open": self.servo.open_door, "close": self.servo.close_door,
+             "mid": self.servo.vent_mid}[action]()
+        except Exception as e:
+            print(f"[Schedule] Lỗi servo: {e}")
+
+    # ---------- luồng ----------
+    def _clock_jumped(self) -> bool:
+        off = time.time() - time.monotonic()
+        jumped = self._clock_offset is not None and abs(off - self._clock_offset) > CLOCK_JUMP_S
+        self._clock_offset = off
+        return jumped
+
+    def run(self):
+        waited = False
+        while time.time() < SANE_EPOCH:
+            if not waited:
+                print("[Schedule] Giờ hệ thống chưa đồng bộ, chờ NTP...")
+                waited = True
+            with self._cond:
+                if self._stop or self._cond.wait(10):
+                    return
+        self._clock_jumped()
+        self.plan()
+        print(f"[Schedule] {len(self.entries)} lịch, {len(self._by_target)} thiết bị")
+        while True:
+            with self._cond:
+                if self._stop:
+                    return
+                nxt = self.next_due()
+                delay = MAX_SLEEP_S if nxt is None else min(MAX_SLEEP_S, max(0.0, nxt - time.time()))
+                self._cond.wait(delay)
+                if self._stop:
+                    return
+            try:
+                if self._clock_jumped():
+                    print("[Schedule] Giờ hệ thống thay đổi, lập lại lịch")
+                    self.plan(catch_up=False)
+                else:
+                    self.run_due()
+            except Exception as e:
+                print(f"[Schedule] Lỗi: {e}")
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self.run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stop = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+
+def start_scheduler(cfg: dict, gpio):
+    """Chạy lịch trong tiến trình chủ GPIO (app.py)."""
+    from app.registry import lazy
+    sched = Scheduler.from_config(cfg, gpio=gpio, servo=lazy("app.servo"))
+    sched.start()
+    return sched
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.config import load_config
+
+    ap = argparse.ArgumentParser(description="Lịch hẹn giờ thiết bị")
+    ap.add_argument("--list", action="store_true", help="chỉ in các lần chuyển sắp tới (dry-run)")
+    ap.add_argument("--hours", type=float, default=24.0)
+    ap.add_argument("--config", default="config/settings.yml")
+    args = ap.parse_args()
+    cfg = load_config(args.config) or {}
+
+    if args.list:
+        sched = Scheduler.from_config(cfg, dry_run=True)
+        now = time.time()
+        sched.plan(now, catch_up=False)
+        t0 = time.perf_counter()
+        end = now + args.hours * 3600
+        while sched.next_due() is not None and sched.next_due() <= end:
+            sched.run_due(sched.next_due())
+        dt = time.perf_counter() - t0
+        for t, name, want in sched.log:
+            state = ("ON" if want else "OFF") if isinstance(want, bool) else want
+            print(f"{datetime.fromtimestamp(t):%a %Y-%m-%d %H:%M:%S}  {name:<6} {state}")
+        print(f"[Schedule] {len(sched.entries)} lịch, {sched.events} sự kiện trong {args.hours:g} h, "
+              f"{dt * 1e6 / max(sched.events, 1):.1f} µs/sự kiện")
+        raise SystemExit(0)
+
+    from app import gpio_controller as gpio
+    from app.registry import lazy
+    gpio.configure(cfg.get("gpio"))
+    if not gpio.init_gpio() or not gpio.is_owner():
+        raise SystemExit(f"GPIO đang thuộc tiến trình khác (pid {gpio.owner_pid()}). "
+                         "Bật schedules.enabled trong tiến trình đó thay vì chạy riêng.")
+    sched = Scheduler.from_config(cfg, gpio=gpio, servo=lazy("app.servo"))
+    try:
+        sched.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        gpio.cleanup_gpio()
@@ -3,9 +3,23 @@
 import time
 import math
 
-# Thử nhiều cách import driver DFRobot cho SEN0501, tuyệt đối KHÔNG import thẳng ở top-level như bản cũ
+# Thử nhiều cách import driver DFRobot cho SEN0501, tuyệt đối KHÔNG import thẳng ở top-level như bản cũ.
+# Việc dò chỉ chạy ở lần tạo Sen0501 đầu tiên (driver kéo theo RPi.GPIO, smbus, modbus_tk).
 EnvI2C = None
 _import_errors = []
+_resolved = False
+
+# (module, class) theo thứ tự ưu tiên
+_CANDIDATES = (
+    # 1) Ưu tiên bản driver đặt trong app/ nếu có
+    ("app.DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_I2C"),
+    ("app.DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_IIC"),
+    # 2) Thử package top-level đã cài qua pip
+    ("DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_I2C"),
+    ("DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_IIC"),
+    # 3) Một số fork dùng tên viết thường
+    ("dfrobot_environmental_sensor", "DFRobot_Environmental_Sensor_I2C"),
+)
 
 def _try_import(path, cls):
     try:
@@ -15,21 +29,16 @@ def _try_import(path, cls):
         _import_errors.append((f"{path}.{cls}", f"{type(e).__name__}: {e}"))
         return None
 
-# 1) Ưu tiên bản driver đặt trong app/ nếu có
-if EnvI2C is None:
-    EnvI2C = _try_import("app.DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_I2C")
-if EnvI2C is None:
-    EnvI2C = _try_import("app.DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_IIC")
-
-# 2) Thử package top-level đã cài qua pip
-if EnvI2C is None:
-    EnvI2C = _try_import("DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_I2C")
-if EnvI2C is None:
-    EnvI2C = _try_import("DFRobot_Environmental_Sensor", "DFRobot_Environmental_Sensor_IIC")
-
-# 3) Một số fork dùng tên viết thường
-if EnvI2C is None:
-    EnvI2C = _try_import("dfrobot_environmental_sensor", "DFRobot_Environmental_Sensor_I2C")
+def _resolve_driver():
+    """Dò driver 1 lần duy nhất, trả class (hoặc None)."""
+    global EnvI2C, _resolved
+    if not _resolved:
+        for path, cls in _CANDIDATES:
+            EnvI2C = _try_import(path, cls)
+            if EnvI2C is not None:
+                break
+        _resolved = True
+    return EnvI2C
 
 class _DummySEN0501:
     """Fallback để app không chết khi thiếu driver/sensor."""
@@ -63,6 +72,7 @@ class Sen0501:
     """
     def __init__(self, bus=1, addr=0x22, allow_dummy=True):
         self._dummy_mode = False
+        EnvI2C = _resolve_driver()
         if EnvI2C is None:
             if allow_dummy:
                 self.sensor = _DummySEN0501()
@@ -0,0 +1,158 @@
+# app/sensor_cache.py
+"""
+Cache reading mới nhất trong RAM cho API + vòng đọc nền.
+
+- Sensor được mở 1 lần và giữ lại (không mở/đóng cổng mỗi lần như collect_all).
+- Luồng nền đọc theo chu kỳ interval_s và cập nhật cache.
+- get(max_age): cache còn mới -> trả ngay, không đụng bus. Cache cũ -> đọc lại,
+  nhưng các request đến cùng lúc chỉ chia nhau ĐÚNG 1 lần đọc phần cứng (single-flight),
+  nên nhiều client poll không chồng nhiều lần timeout 2 s của soil.
+- add_listener(fn): fn(reading) được gọi sau mỗi lần đọc mới (rules, WebSocket...).
+"""
+import threading
+import time
+from datetime import datetime
+
+from app.json_export import open_sensors, build_record
+from app.metrics import read_sensor, LOOP_JITTER_S
+
+
+class SensorCache:
+    def __init__(self, cfg: dict, interval_s: float = 1.0, max_age_s: float = 2.0):
+        self.cfg = cfg
+        self.interval_s = float(interval_s)
+        self.max_age_s = float(max_age_s)
+        self._cond = threading.Condition()
+        self._reading = None
+        self._reading_t = 0.0          # time.monotonic() lúc đọc xong
+        self._inflight = False
+        self._error = None
+        self._sensors = None
+        self._listeners = []
+        self._thread = None
+        self._stop = threading.Event()
+        self.hw_reads = 0
+
+    @classmethod
+    def from_config(cls, cfg: dict):
+        c = (cfg or {}).get("sensor_cache", {}) or {}
+        return cls(cfg, interval_s=c.get("interval_s", 1.0), max_age_s=c.get("max_age_s", 2.0))
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn):
+        try:
+            self._listeners.remove(fn)
+        except ValueError:
+            pass
+
+    # ---------- đọc phần cứng ----------
+    def _read_hw(self) -> dict:
+        if self._sensors is None:
+            self._sensors = open_sensors(self.cfg)
+        s1, s2, soil = self._sensors
+        a = read_sensor("sen0501", s1)
+        b = read_sensor("sen0220", s2)
+        try:
+            c = read_sensor("es_soil7", soil)
+        except Exception:
+            c = None
+        self.hw_reads += 1
+        return build_record(datetime.now().isoformat(timespec="seconds"),
+                            self.cfg.get("device_id"), a, b, c)
+
+    def _refresh(self) -> dict:
+        """Single-flight: nếu đang có lần đọc khác thì chờ kết quả của nó."""
+        with self._cond:
+            if self._inflight:
+                started = self._reading_t
+                while self._inflight:
+                    self._cond.wait()
+                if self._reading_t != started:
+                    return self._reading
+                if self._error is not None:
+                    raise self._error
+            self._inflight = True
+        reading, error = None, None
+        try:
+            reading = self._read_hw()
+        except Exception as e:
+            error = e
+        with self._cond:
+            self._inflight = False
+            self._error = error
+            if error is None:
+                self._reading = reading
+                self._reading_t = time.monotonic()
+            self._cond.notify_all()
+        if error is not None:
+            raise error
+        for fn in list(self._listeners):
+            try:
+                fn(reading)
+            except Exception as e:
+                print(f"[SensorCache] Listener lỗi: {e}")
+        return reading
+
+    # ---------- API ----------
+    def get(self, max_age_s: float = None):
+        """Trả (reading, age_s). Chỉ đọc phần cứng khi cache cũ hơn max_age_s."""
+        max_age = self.max_age_s if max_age_s is None else float(max_age_s)
+        with self._cond:
+            if self._reading is not None and time.monotonic() - self._reading_t <= max_age:
+                return self._reading, time.monotonic() - self._reading_t
+        reading = self._refresh()
+        with self._cond:
+            return reading, time.monotonic() - self._reading_t
+
+    def latest(self):
+        """Reading gần nhất (không bao giờ đọc phần cứng), có thể None."""
+        with self._cond:
+            return self._reading
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name="sensor-acquisition", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        next_due = time.monotonic()
+        jitter = LOOP_JITTER_S.labels("sensor_cache")
+        while not self._stop.is_set():
+            jitter.observe(max(0.0, time.monotonic() - next_due))
+            try:
+                # Bỏ qua nếu vừa có request API tự đọc (cache đã đủ mới)
+                with self._cond:
+                    fresh = self._reading is not None and \
+                        time.monotonic() - self._reading_t < self.interval_s * 0.5
+                if not fresh:
+                    self._refresh()
+            except Exception as e:
+                print(f"[SensorCache] Đọc lỗi: {e}")
+            next_due += self.interval_s
+            now = time.monotonic()
+            if next_due < now:
+                next_due = now   # chậm quá 1 chu kỳ thì bắt nhịp lại, không đọc dồn
+            self._stop.wait(next_due - now)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_sensor_cache(cfg: dict) -> SensorCache:
+    """Singleton cho tiến trình, tự chạy vòng đọc nền ở lần gọi đầu."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SensorCache.from_config(cfg)
+            _cache.start()
+        return _cache
@@ -1,6 +1,5 @@
 # file: door_servo.py
-from gpiozero import AngularServo
-from gpiozero.pins.lgpio import LGPIOFactory
+import threading
 from time import sleep
 
 # Thông số hay dùng cho đa số servo SG90/MG9xx. Có thể phải tinh chỉnh 2 con số này.
@@ -10,20 +9,45 @@ MAX_PW = 2.5/1000   # 2.5 ms
 # Nếu servo quay ngược ý muốn, set INVERT=True
 INVERT = False
 
-factory = LGPIOFactory()
-
 # GPIO18 = pin 12 trên header
-servo = AngularServo(
-    pin=18,
-    min_angle=-90, max_angle=90,
-    min_pulse_width=MIN_PW, max_pulse_width=MAX_PW,
-    pin_factory=factory,
-    initial_angle=0,
-)
+SERVO_PIN = 18
+
+# Phần cứng (gpiozero + lgpio) chỉ tạo khi dùng lần đầu, không phải lúc import.
+# `servo.servo` / `servo.factory` vẫn dùng được như cũ nhờ __getattr__ của module.
+_servo = None
+_factory = None
+_servo_lock = threading.Lock()
+
+def get_servo():
+    global _servo, _factory
+    if _servo is None:
+        # Nhiều thread Flask gọi cùng lúc lần đầu -> chỉ 1 thread tạo (2 LGPIOFactory giành pin 18)
+        with _servo_lock:
+            if _servo is None:
+                from gpiozero import AngularServo
+                from gpiozero.pins.lgpio import LGPIOFactory
+                _factory = LGPIOFactory()
+                _servo = AngularServo(
+                    pin=SERVO_PIN,
+                    min_angle=-90, max_angle=90,
+                    min_pulse_width=MIN_PW, max_pulse_width=MAX_PW,
+                    pin_factory=_factory,
+                    initial_angle=0,
+                )
+    return _servo
+
+def __getattr__(name):
+    if name == "servo":
+        return get_servo()
+    if name == "factory":
+        get_servo()
+        return _factory
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def open_door(angle=80):
     """Mở cửa: quay tới +angle độ."""
     a = angle if not INVERT else -angle
+    servo = get_servo()
     servo.angle = a
     # giữ vài trăm ms để servo đến vị trí rồi thả lỏng để bớt rung/đốt pin
     sleep(0.6)
@@ -32,12 +56,14 @@ def open_door(angle=80):
 def close_door(angle=80):
     """Đóng cửa: quay về -angle độ."""
     a = -angle if not INVERT else angle
+    servo = get_servo()
     servo.angle = a
     sleep(0.6)
     servo.detach()
 
 def vent_mid():
     """Mở nửa chừng cho đỡ ngộp."""
+    servo = get_servo()
     servo.angle = 0 if not INVERT else 0
     sleep(0.6)
     servo.detach()
@@ -0,0 +1,96 @@
+# app/state_journal.py
+"""
+Nhật ký trạng thái relay (append-only) để khôi phục sau khi mất điện / crash.
+
+Mỗi lần trạng thái mong muốn đổi, gpio_controller ghi thêm 1 dòng JSON chứa TOÀN BỘ
+trạng thái (vài chục byte, 4 relay):
+    {"t": 1730000000.123, "rev": 42, "s": {"fan1": 1, "fan2": 0, "pump": 0, "light": 1}}
+Khôi phục chỉ cần đọc dòng hợp lệ cuối (đọc vài KB từ cuối file, không quét cả file);
+dòng cuối bị cắt dở do mất điện thì lùi về dòng trước. File vượt max_bytes thì được
+nén lại còn 1 dòng (ghi file tạm + os.replace).
+"""
+import json
+import os
+import time
+
+TAIL_BYTES = 4096
+
+
+class StateJournal:
+    def __init__(self, path: str, max_bytes: int = 64 * 1024, fsync: bool = True):
+        self.path = path
+        self.max_bytes = int(max_bytes)
+        self.fsync = bool(fsync)
+        self._fd = None
+        self._size = 0
+        self._last = None
+
+    def load(self):
+        """
+        Dòng hợp lệ cuối cùng: ({device: bool}, revision), hoặc (None, 0) nếu chưa có / hỏng hết.
+        revision cho phép tiến trình chủ đếm tiếp sau khi khởi động lại thay vì quay về 0.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                f.seek(max(0, size - TAIL_BYTES))
+                tail = f.read()
+        except FileNotFoundError:
+            return None, 0
+        for line in reversed(tail.splitlines()):
+            try:
+                rec = json.loads(line)
+                return {str(d): bool(v) for d, v in rec["s"].items()}, int(rec.get("rev", 0))
+            except Exception:
+                continue      # dòng cắt dở / dòng đầu bị cắt bởi TAIL_BYTES
+        return None, 0
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._size = os.fstat(self._fd).st_size
+
+    @staticmethod
+    def _line(states: dict, revision: int) -> bytes:
+        rec = {"t": round(time.time(), 3), "rev": int(revision),
+               "s": {d: 1 if v else 0 for d, v in states.items()}}
+        return json.dumps(rec, separators=(",", ":")).encode() + b"\n"
+
+    def append(self, states: dict, revision: int = 0) -> bool:
+        """Ghi trạng thái nếu khác lần ghi trước. Trả True nếu có ghi."""
+        if self._last == states:
+            return False
+        if self._fd is None:
+            self._open()
+        line = self._line(states, revision)
+        if self._size + len(line) > self.max_bytes:
+            self.compact(states, revision)
+        else:
+            os.write(self._fd, line)
+            if self.fsync:
+                os.fsync(self._fd)
+            self._size += len(line)
+        self._last = dict(states)
+        return True
+
+    def compact(self, states: dict, revision: int = 0):
+        """Viết lại file chỉ còn 1 dòng (trạng thái hiện tại)."""
+        tmp = self.path + ".tmp"
+        line = self._line(states, revision)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.replace(tmp, self.path)
+        if self._fd is not None:
+            os.close(self._fd)
+        self._open()
+        self._last = dict(states)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
@@ -0,0 +1,209 @@
+# app/telemetry_hub.py
+"""
+Hub đẩy telemetry realtime cho WebSocket /api/iot/ws (thay cho poll /sensors + /status).
+
+- Nguồn: listener của SensorCache (mỗi reading mới) + luồng theo dõi revision GPIO.
+- Mỗi client chọn tập metric (rỗng = tất cả) và tốc độ tối đa max_hz.
+- Client cùng tập metric dùng chung 1 frame: mỗi reading chỉ json.dumps 1 lần
+  cho mỗi tập metric khác nhau, rồi phát cùng chuỗi đó cho mọi client.
+- Mỗi client chỉ giữ frame MỚI NHẤT (conflate): client chậm/giới hạn tốc độ
+  không làm đầy hàng đợi, chỉ bỏ các reading trung gian.
+- Frame "state" (GPIO) không bị giới hạn tốc độ, luôn gửi trạng thái mới nhất.
+"""
+import itertools
+import json
+import threading
+import time
+
+from app.aggregator import flatten_reading
+from app.metrics import gauge
+
+DEFAULT_HZ = 1.0
+MAX_HZ = 5.0
+
+
+class TelemetryClient:
+    """1 kết nối WebSocket. Luồng của kết nối gọi take() để lấy frame cần gửi."""
+
+    def __init__(self, cid: int, metrics=None, max_hz: float = None):
+        self.id = cid
+        self.metrics = None
+        self.min_interval = 1.0 / DEFAULT_HZ
+        self._cond = threading.Condition()
+        self._reading_frame = None
+        self._state_frame = None
+        self._next_allowed = 0.0
+        self.sent = 0
+        self.conflated = 0
+        self.set_subscription(metrics, max_hz)
+
+    def set_subscription(self, metrics=None, max_hz: float = None):
+        ms = frozenset(m for m in (metrics or []) if m)
+        self.metrics = ms or None
+        hz = min(max(float(max_hz or DEFAULT_HZ), 0.01), MAX_HZ)
+        self.min_interval = 1.0 / hz
+
+    @property
+    def key(self):
+        """Khoá nhóm encode: client cùng key dùng chung frame."""
+        return self.metrics
+
+    def offer_reading(self, frame: str):
+        with self._cond:
+            if self._reading_frame is not None:
+                self.conflated += 1
+            self._reading_frame = frame
+            self._cond.notify()
+
+    def offer_state(self, frame: str):
+        with self._cond:
+            self._state_frame = frame
+            self._cond.notify()
+
+    def take(self, timeout: float) -> list:
+        """Chờ tối đa timeout giây. Trả list frame cần gửi (có thể rỗng)."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                out = []
+                if self._state_frame is not None:
+                    out.append(self._state_frame)
+                    self._state_frame = None
+                if self._reading_frame is not None and now >= self._next_allowed:
+                    out.append(self._reading_frame)
+                    self._reading_frame = None
+                    self._next_allowed = now + self.min_interval
+                if out:
+                    self.sent += len(out)
+                    return out
+                wait = deadline - now
+                if self._reading_frame is not None:
+                    wait = min(wait, self._next_allowed - now)
+                if deadline - now <= 0:
+                    return out
+                self._cond.wait(max(wait, 0.001))
+
+
+class TelemetryHub:
+    def __init__(self, state_body=None):
+        """state_body(revision, states) -> dict: định dạng frame state (giống /status)."""
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._ids = itertools.count(1)
+        self._state_body = state_body
+        self._last_reading = None
+        self._last_state = None     # frame state đã encode gần nhất
+        self._watcher = None
+        self._stop = threading.Event()
+        self.encodes = 0
+
+    # ---------- client ----------
+    def connect(self, metrics=None, max_hz: float = None) -> TelemetryClient:
+        c = TelemetryClient(next(self._ids), metrics, max_hz)
+        with self._lock:
+            self._clients[c.id] = c
+            last_reading, last_state = self._last_reading, self._last_state
+        # Gửi ngay snapshot hiện tại để client không phải đợi lần đổi kế tiếp
+        if last_state is not None:
+            c.offer_state(last_state)
+        if last_reading is not None:
+            c.offer_reading(self._encode_reading(last_reading, c.key))
+        return c
+
+    def disconnect(self, client: TelemetryClient):
+        with self._lock:
+            self._clients.pop(client.id, None)
+
+    def resubscribe(self, client: TelemetryClient, metrics=None, max_hz: float = None):
+        with self._lock:
+            client.set_subscription(metrics, max_hz)
+            last_reading = self._last_reading
+        if last_reading is not None:
+            client.offer_reading(self._encode_reading(last_reading, client.key))
+
+    def client_count(self) -> int:
+        with self._lock:
+            return len(self._clients)
+
+    # ---------- publish ----------
+    def _encode_reading(self, reading, key) -> str:
+        ts, flat = reading
+        values = flat if key is None else {m: flat[m] for m in key if m in flat}
+        self.encodes += 1
+        return json.dumps({"type": "reading", "ts": ts, "values": values}, separators=(",", ":"))
+
+    def publish_reading(self, reading: dict):
+        """Listener của SensorCache: encode 1 lần cho mỗi tập metric rồi phát."""
+        item = (reading.get("ts"), flatten_reading(reading))
+        with self._lock:
+            self._last_reading = item
+            groups = {}
+            for c in self._clients.values():
+                groups.setdefault(c.key, []).append(c)
+        for key, members in groups.items():
+            frame = self._encode_reading(item, key)
+            for c in members:
+                c.offer_reading(frame)
+
+    def publish_state(self, revision: int, states: dict):
+        body = self._state_body(revision, states) if self._state_body else \
+            {"revision": revision, "states": states}
+        frame = json.dumps(dict(body, type="state"), separators=(",", ":"))
+        self.encodes += 1
+        with self._lock:
+            self._last_state = frame
+            members = list(self._clients.values())
+        for c in members:
+            c.offer_state(frame)
+
+    # ---------- nguồn dữ liệu ----------
+    def attach_sensor_cache(self, cache):
+        cache.add_listener(self.publish_reading)
+        latest = cache.latest()
+        if latest is not None:
+            self.publish_reading(latest)
+
+    def watch_gpio(self, gpio_module):
+        """Luồng nền: mỗi khi revision GPIO tăng thì phát frame state."""
+        if self._watcher is not None:
+            return
+        revision, states = gpio_module.get_state_snapshot()
+        self.publish_state(revision, states)
+
+        def _loop(since):
+            while not self._stop.is_set():
+                rev, st = gpio_module.wait_for_change(since, 30)
+                if rev != since:
+                    since = rev
+                    self.publish_state(rev, st)
+
+        self._watcher = threading.Thread(target=_loop, args=(revision,),
+                                         name="telemetry-gpio", daemon=True)
+        self._watcher.start()
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub(cfg: dict, gpio_module=None, state_body=None) -> TelemetryHub:
+    """Singleton cho tiến trình; gắn vào SensorCache và GPIO ở lần gọi đầu."""
+    global _hub, DEFAULT_HZ, MAX_HZ
+    with _hub_lock:
+        if _hub is None:
+            t = (cfg or {}).get("telemetry", {}) or {}
+            DEFAULT_HZ = float(t.get("default_hz", DEFAULT_HZ))
+            MAX_HZ = float(t.get("max_hz", MAX_HZ))
+            hub = TelemetryHub(state_body=state_body)
+            gauge("greeneco_ws_clients", "Số client WebSocket /api/iot/ws đang kết nối") \
+                .set_function(hub.client_count)
+            if gpio_module is not None:
+                hub.watch_gpio(gpio_module)
+            try:
+                from app.sensor_cache import get_sensor_cache
+                hub.attach_sensor_cache(get_sensor_cache(cfg))
+            except Exception as e:
+                print(f"[Telemetry] Không gắn được SensorCache: {e}")
+            _hub = hub
+        return _hub
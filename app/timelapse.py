@@ -0,0 +1,228 @@
+# app/timelapse.py
+"""
+Timelapse: chụp ảnh định kỳ (chu kỳ thay đổi theo giờ trong ngày) vào 1 ring
+buffer trên đĩa có giới hạn dung lượng + file index; upload chạy ở luồng riêng
+với nhịp giới hạn để không chiếm hết băng thông.
+
+Cấu hình ở settings.yml -> timelapse.
+"""
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+from app.camera_service import capture_jpeg
+from app.metrics import QUEUE_DEPTH, LOOP_JITTER_S
+
+INDEX_NAME = "index.json"
+
+
+def _parse_hhmm(s: str) -> int:
+    hh, mm = str(s).split(":")
+    return int(hh) * 60 + int(mm)
+
+
+class TimelapseSchedule:
+    """Danh sách khung giờ -> interval. Khung có thể vắt qua nửa đêm (22:00-05:00)."""
+
+    def __init__(self, windows=None, default_interval_s=600):
+        self.default_interval_s = float(default_interval_s)
+        self.windows = []
+        for w in windows or []:
+            self.windows.append((_parse_hhmm(w["from"]), _parse_hhmm(w["to"]), float(w["interval_s"])))
+
+    def interval_for(self, dt: datetime) -> float:
+        minute = dt.hour * 60 + dt.minute
+        for start, end, interval in self.windows:
+            inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+            if inside:
+                return interval
+        return self.default_interval_s
+
+
+class ImageRingBuffer:
+    """
+    Thư mục ảnh có giới hạn (max_bytes / max_files). Vượt giới hạn -> xoá ảnh cũ nhất.
+    index.json giữ danh sách {name, ts, bytes, uploaded} theo thứ tự thời gian.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_files: int = 0):
+        self.dir = os.path.expanduser(directory)
+        self.max_bytes = int(max_bytes)
+        self.max_files = int(max_files or 0)
+        self._lock = threading.Lock()
+        os.makedirs(self.dir, exist_ok=True)
+        self._entries = self._load_index()
+        self._total = sum(e["bytes"] for e in self._entries)
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.dir, INDEX_NAME)
+
+    def _load_index(self) -> list:
+        entries = []
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"[Timelapse] Index lỗi, dựng lại từ thư mục: {e}")
+        # Đối soát với file thật trên đĩa (mất điện giữa chừng, xoá tay...)
+        known = {e["name"] for e in entries}
+        entries = [e for e in entries if os.path.exists(os.path.join(self.dir, e["name"]))]
+        for name in sorted(os.listdir(self.dir)):
+            if name.endswith(".jpg") and name not in known:
+                p = os.path.join(self.dir, name)
+                entries.append({"name": name, "ts": os.path.getmtime(p),
+                                "bytes": os.path.getsize(p), "uploaded": False})
+        entries.sort(key=lambda e: e["ts"])
+        return entries
+
+    def _save_index(self):
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp, self.index_path)
+
+    def new_path(self, now: datetime) -> str:
+        return os.path.join(self.dir, now.strftime("%Y%m%dT%H%M%S") + ".jpg")
+
+    def add(self, path: str, ts: float) -> dict:
+        entry = {"name": os.path.basename(path), "ts": ts,
+                 "bytes": os.path.getsize(path), "uploaded": False}
+        with self._lock:
+            self._entries.append(entry)
+            self._total += entry["bytes"]
+            self._evict()
+            self._save_index()
+        return entry
+
+    def _evict(self):
+        while self._entries and (self._total > self.max_bytes or
+                                 (self.max_files and len(self._entries) > self.max_files)):
+            old = self._entries.pop(0)
+            self._total -= old["bytes"]
+            try:
+                os.remove(os.path.join(self.dir, old["name"]))
+            except FileNotFoundError:
+                pass
+            if not old["uploaded"]:
+                print(f"[Timelapse] Xoá {old['name']} khi chưa upload (hết quota)")
+
+    def mark_uploaded(self, name: str):
+        with self._lock:
+            for e in self._entries:
+                if e["name"] == name:
+                    e["uploaded"] = True
+                    break
+            self._save_index()
+
+    def pending(self) -> list:
+        with self._lock:
+            return [dict(e) for e in self._entries if not e["uploaded"]]
+
+    def path_of(self, name: str) -> str:
+        return os.path.join(self.dir, name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"files": len(self._entries), "bytes": self._total,
+                    "pending": sum(1 for e in self._entries if not e["uploaded"])}
+
+
+class TimelapseRunner:
+    """2 luồng: capture theo lịch -> ring buffer; upload theo nhịp từ hàng đợi."""
+
+    def __init__(self, cfg: dict, upload_fn=None, upload_batch: int = 1):
+        """upload_fn(paths) -> {path: response | Exception}; mỗi lượt gửi tối đa upload_batch ảnh."""
+        tl = (cfg or {}).get("timelapse", {}) or {}
+        self.schedule = TimelapseSchedule(tl.get("schedule"), tl.get("default_interval_s", 600))
+        self.buffer = ImageRingBuffer(tl.get("dir", "~/greeneco_out/timelapse"),
+                                      max_bytes=int(tl.get("max_mb", 2048)) * 1024 * 1024,
+                                      max_files=tl.get("max_files", 0))
+        res = tl.get("resolution", [1280, 720])
+        self.size = (int(res[0]), int(res[1]))
+        self.quality = int(tl.get("quality", 80))
+        up = tl.get("upload", {}) or {}
+        self.upload_fn = upload_fn if up.get("enabled", True) else None
+        self.upload_min_interval_s = float(up.get("min_interval_s", 30))
+        self.upload_batch = max(1, int(upload_batch))
+        self._queue = queue.Queue()
+        QUEUE_DEPTH.labels("timelapse_upload").set_function(self._queue.qsize)
+        self._stop = threading.Event()
+        self._threads = []
+        # Ảnh chụp trước đó mà chưa upload (restart) -> đưa lại vào hàng đợi
+        for e in self.buffer.pending():
+            self._queue.put(e["name"])
+
+    def start(self):
+        self._threads = [threading.Thread(target=self._capture_loop, name="timelapse-capture", daemon=True)]
+        if self.upload_fn is not None:
+            self._threads.append(threading.Thread(target=self._upload_loop, name="timelapse-upload", daemon=True))
+        for t in self._threads:
+            t.start()
+
+    def stop(self):
+        self._stop.set()
+        for t in self._threads:
+            t.join(timeout=5)
+
+    def capture_once(self) -> dict:
+        now = datetime.now()
+        path, _ = capture_jpeg(self.buffer.new_path(now), width=self.size[0],
+                               height=self.size[1], quality=self.quality)
+        entry = self.buffer.add(path, now.timestamp())
+        if self.upload_fn is not None:
+            self._queue.put(entry["name"])
+        return entry
+
+    def _capture_loop(self):
+        next_due = time.monotonic()
+        while not self._stop.is_set():
+            if self._stop.wait(max(0.0, next_due - time.monotonic())):
+                break
+            LOOP_JITTER_S.labels("timelapse_capture").observe(max(0.0, time.monotonic() - next_due))
+            try:
+                e = self.capture_once()
+                st = self.buffer.stats()
+                print(f"[Timelapse] {e['name']} ({e['bytes'] // 1024} KB) "
+                      f"buffer={st['files']} files/{st['bytes'] // (1024 * 1024)} MB pending={st['pending']}")
+            except Exception as ex:
+                print(f"[Timelapse] Capture lỗi: {ex}")
+            # Lịch tính từ mốc trước (không trôi theo thời gian chụp), interval theo giờ hiện tại
+            next_due += self.schedule.interval_for(datetime.now())
+            next_due = max(next_due, time.monotonic())
+
+    def _upload_loop(self):
+        while not self._stop.is_set():
+            try:
+                names = [self._queue.get(timeout=1.0)]
+            except queue.Empty:
+                continue
+            # Hàng đợi còn ảnh (backlog sau restart/mất mạng) -> gom thành 1 lượt gửi song song
+            while len(names) < self.upload_batch:
+                try:
+                    names.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            # Ảnh đã bị ring buffer xoá thì bỏ
+            batch = {self.buffer.path_of(n): n for n in names if os.path.exists(self.buffer.path_of(n))}
+            if not batch:
+                continue
+            t0 = time.monotonic()
+            try:
+                results = self.upload_fn(list(batch))
+            except Exception as ex:
+                results = {p: ex for p in batch}
+            for path, name in batch.items():
+                res = results.get(path, RuntimeError("không có kết quả"))
+                if isinstance(res, Exception):
+                    print(f"[Timelapse] Upload {name} lỗi, thử lại sau: {res}")
+                    self._queue.put(name)
+                else:
+                    self.buffer.mark_uploaded(name)
+            # Giãn nhịp upload: tối thiểu upload_min_interval_s giữa 2 lượt gửi
+            self._stop.wait(max(0.0, self.upload_min_interval_s - (time.monotonic() - t0)))
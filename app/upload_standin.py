@@ -0,0 +1,134 @@
+# app/upload_standin.py
+"""
+Server giả lập (stand-in) cho giao thức upload chunk của uploader_greenimage,
+chạy local để thử resume/song song mà không cần server Render.
+
+Chạy thử:
+    python -m app.upload_standin ảnh1.jpg ảnh2.jpg --fail-rate 0.3
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_RE_CHUNK = re.compile(r"^/api/GreenImage/chunked/([\w-]+)/(\d+)$")
+_RE_DONE = re.compile(r"^/api/GreenImage/chunked/([\w-]+)/complete$")
+
+
+class StandInState:
+    def __init__(self, fail_rate=0.0):
+        self.fail_rate = float(fail_rate)
+        self.lock = threading.Lock()
+        self.sessions = {}     # uploadId -> dict(meta, chunks{index: bytes})
+        self.by_key = {}       # (deviceId, sha256) -> uploadId
+        self.completed = {}    # uploadId -> bytes
+
+    @staticmethod
+    def received(sess) -> int:
+        n = 0
+        while n in sess["chunks"]:
+            n += 1
+        return n
+
+
+def make_handler(state: StandInState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def _json(self, code, obj):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> bytes:
+            return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        def _flaky(self) -> bool:
+            # Giả lập đường truyền chập chờn: đọc xong body rồi trả 503
+            if state.fail_rate and random.random() < state.fail_rate:
+                self._json(503, {"error": "simulated failure"})
+                return True
+            return False
+
+        def do_POST(self):
+            if self.path == "/api/GreenImage/chunked/init":
+                meta = json.loads(self._body() or b"{}")
+                key = (meta.get("deviceId"), meta.get("sha256"))
+                with state.lock:
+                    uid = state.by_key.get(key)
+                    if uid is None or uid not in state.sessions:
+                        uid = uuid.uuid4().hex
+                        state.sessions[uid] = {"meta": meta, "chunks": {}}
+                        state.by_key[key] = uid
+                    n = state.received(state.sessions[uid])
+                return self._json(200, {"uploadId": uid, "received": n})
+            m = _RE_DONE.match(self.path)
+            if m:
+                self._body()
+                with state.lock:
+                    sess = state.sessions.get(m.group(1))
+                    if sess is None:
+                        return self._json(404, {"error": "unknown upload"})
+                    data = b"".join(sess["chunks"][i] for i in sorted(sess["chunks"]))
+                    if hashlib.sha256(data).hexdigest() != sess["meta"].get("sha256"):
+                        return self._json(409, {"error": "sha256 mismatch"})
+                    state.completed[m.group(1)] = data
+                    del state.sessions[m.group(1)]
+                return self._json(201, {"id": m.group(1), "size": len(data),
+                                        "fileName": sess["meta"].get("fileName")})
+            self._json(404, {"error": "not found"})
+
+        def do_PUT(self):
+            m = _RE_CHUNK.match(self.path)
+            if not m:
+                return self._json(404, {"error": "not found"})
+            chunk = self._body()
+            if self._flaky():
+                return
+            if hashlib.sha256(chunk).hexdigest() != self.headers.get("X-Chunk-Sha256"):
+                return self._json(422, {"error": "chunk checksum mismatch"})
+            with state.lock:
+                sess = state.sessions.get(m.group(1))
+                if sess is None:
+                    return self._json(404, {"error": "unknown upload"})
+                sess["chunks"][int(m.group(2))] = chunk
+                n = state.received(sess)
+            self._json(200, {"received": n})
+
+    return Handler
+
+
+def start_standin(host="127.0.0.1", port=0, fail_rate=0.0):
+    """Chạy server ở luồng nền. Trả (server, state, base_url)."""
+    state = StandInState(fail_rate=fail_rate)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    import argparse
+    from app.uploader_greenimage import upload_many_chunked
+
+    ap = argparse.ArgumentParser(description="Thử upload chunk với server giả lập")
+    ap.add_argument("images", nargs="+")
+    ap.add_argument("--fail-rate", type=float, default=0.2)
+    ap.add_argument("--chunk-kb", type=int, default=16)
+    ap.add_argument("--parallel", type=int, default=2)
+    args = ap.parse_args()
+
+    server, state, base = start_standin(fail_rate=args.fail_rate)
+    res = upload_many_chunked(base, args.images, "CAM-TEST", max_parallel=args.parallel,
+                              chunk_size=args.chunk_kb * 1024, max_retries=20)
+    for path, r in res.items():
+        print(path, "->", r)
+    server.shutdown()
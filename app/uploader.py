@@ -1,18 +1,27 @@
 # app/uploader.py
 import json
 import os
-import requests
+import time
 from datetime import datetime
-from dateutil import tz
+from app.metrics import UPLOAD_S
+# requests + dateutil import lazy trong hàm (mỗi cái vài chục ms lúc khởi động)
 
 API_URL = "https://h2-api-z7sq.onrender.com/api/GreenSensorData"
-LOCAL_TZ = tz.gettz("Asia/Ho_Chi_Minh")
+AGG_API_URL = "https://h2-api-z7sq.onrender.com/api/GreenSensorData/aggregate"
+BUNDLE_API_URL = "https://h2-api-z7sq.onrender.com/api/GreenBundle/upload"
+LOCAL_TZ_NAME = "Asia/Ho_Chi_Minh"
+
+def local_now() -> datetime:
+    """Giờ hiện tại theo LOCAL_TZ_NAME (có tzinfo), không phụ thuộc TZ của hệ thống."""
+    from dateutil import tz
+    return datetime.now(tz.gettz(LOCAL_TZ_NAME))
 
 def _to_utc_z(ts_str: str) -> str:
     """
     Nhận chuỗi ISO (có hoặc không timezone). Nếu không có TZ thì coi là giờ VN.
     Trả về ISO UTC với 'Z'.
     """
+    from dateutil import tz
     # đã có 'Z' hoặc offset?
     try:
         if ts_str.endswith("Z") or "+" in ts_str or "-" in ts_str[10:]:
@@ -22,7 +31,7 @@ def _to_utc_z(ts_str: str) -> str:
         pass
     # không có tz: coi là local VN
     dt_naive = datetime.fromisoformat(ts_str)
-    dt_local = dt_naive.replace(tzinfo=LOCAL_TZ)
+    dt_local = dt_naive.replace(tzinfo=tz.gettz(LOCAL_TZ_NAME))
     dt_utc = dt_local.astimezone(tz.UTC)
     return dt_utc.replace(tzinfo=None).isoformat(timespec="seconds") + "Z"
 
@@ -31,6 +40,7 @@ def _map_payload(internal: dict) -> dict:
     soil = internal.get("soil")  # có thể là None hoặc dict
     co2  = internal.get("co2", {}) or {}
     gpio = internal.get("gpio")  # trạng thái GPIO devices (optional)
+    canopy = internal.get("canopy")  # chỉ số canopy từ camera (optional)
 
     # Hàm helper để đảm bảo giá trị số hợp lệ
     def safe_float(val, default=0.0):
@@ -104,9 +114,31 @@ def _map_payload(internal: dict) -> dict:
                 "state": "ON" if is_on else "OFF"
             })
         outward["devices"] = devices
+
+    # Thêm chỉ số canopy nếu có
+    if canopy and isinstance(canopy, dict):
+        outward["canopy"] = {
+            "greenRatio": safe_float(canopy.get("green_ratio")),
+            "exgMean": safe_float(canopy.get("exg_mean")),
+            "brightness": safe_float(canopy.get("brightness")),
+            "growthAreaM2": safe_float(canopy.get("growth_area_m2")),
+        }
     
     return outward
 
+def _post(kind: str, url: str, **kwargs):
+    """requests.post + raise_for_status, ghi thời gian vào greeneco_upload_seconds{kind}."""
+    import requests
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        resp = requests.post(url, **kwargs)
+        resp.raise_for_status()
+        outcome = "ok"
+        return resp
+    finally:
+        UPLOAD_S.labels(kind, outcome).observe(time.perf_counter() - t0)
+
 def post_dict(internal_payload: dict, timeout=15):
     body = _map_payload(internal_payload)
     
@@ -114,8 +146,7 @@ def post_dict(internal_payload: dict, timeout=15):
     print("[DEBUG] Sending payload:")
     print(json.dumps(body, indent=2, ensure_ascii=False))
     
-    resp = requests.post(API_URL, json=body, timeout=timeout)
-    resp.raise_for_status()
+    resp = _post("sensor", API_URL, json=body, timeout=timeout)
     return resp.status_code, resp.text
 
 def post_file(json_path: str, timeout=15):
@@ -123,3 +154,43 @@ def post_file(json_path: str, timeout=15):
     with open(json_path, "r", encoding="utf-8") as f:
         raw = json.load(f)
     return post_dict(raw, timeout=timeout)
+
+def _map_aggregate_payload(internal: dict) -> dict:
+    """Map payload của WindowAggregator sang schema server (timestamp UTC 'Z')."""
+    return {
+        "deviceId": internal.get("device_id") or "UNKNOWN",
+        "timestamp": _to_utc_z(internal.get("ts")),
+        "windowStart": _to_utc_z(internal.get("window_start")),
+        "windowSeconds": internal.get("window_s"),
+        "metrics": internal.get("metrics") or {},
+    }
+
+def post_aggregates(internal_payload: dict, timeout=15, url: str = None):
+    """POST 1 payload aggregate (min/max/mean/stddev/count/last theo cửa sổ)."""
+    body = _map_aggregate_payload(internal_payload)
+    resp = _post("aggregate", url or AGG_API_URL, json=body, timeout=timeout)
+    return resp.status_code, resp.text
+
+def post_bundle(internal_payload: dict, jpeg: bytes, timeout=30, url: str = None, token: str = None):
+    """
+    Gửi 1 bundle (reading + chỉ số ảnh + ảnh) trong 1 request multipart:
+      - field "payload": JSON theo schema server (như post_dict) + "image" metadata
+      - field "formFile": ảnh JPEG
+    """
+    body = _map_payload(internal_payload)
+    img = internal_payload.get("image") or {}
+    body["image"] = {
+        "fileName": img.get("file"),
+        "width": img.get("width"),
+        "height": img.get("height"),
+        "bytes": img.get("bytes"),
+        "sha256": img.get("sha256"),
+        "dhash": img.get("dhash"),
+    }
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    files = {
+        "payload": (None, json.dumps(body, ensure_ascii=False), "application/json"),
+        "formFile": (img.get("file") or "bundle.jpg", jpeg, "image/jpeg"),
+    }
+    resp = _post("bundle", url or BUNDLE_API_URL, files=files, headers=headers, timeout=timeout)
+    return resp.status_code, resp.text
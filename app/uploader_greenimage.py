@@ -1,6 +1,7 @@
 # app/uploader_greenimage.py
-import requests, os, time
+import requests, os, time, hashlib
 from typing import Optional
+from app.metrics import UPLOAD_S, UPLOAD_RETRIES
 
 class HttpError(RuntimeError): pass
 
@@ -15,12 +16,141 @@ def upload_green_image(base_url: str, image_path: str, device_id: str,
         with open(image_path, "rb") as f:
             files = {"formFile": (os.path.basename(image_path), f, "image/jpeg")}
             data = {"deviceId": device_id}
+            t0 = time.perf_counter()
             try:
                 r = requests.post(url, headers=headers, files=files, data=data, timeout=timeout_sec)
                 if r.status_code in (200, 201):
+                    UPLOAD_S.labels("image", "ok").observe(time.perf_counter() - t0)
                     return r.json()
                 raise HttpError(f"HTTP {r.status_code}: {r.text[:300]}")
             except Exception:
+                UPLOAD_S.labels("image", "error").observe(time.perf_counter() - t0)
                 if attempt == max_retries:
                     raise
+                UPLOAD_RETRIES.labels("image").inc()
                 time.sleep(2 ** attempt)
+
+def upload_green_image_bytes(base_url: str, data: bytes, filename: str, device_id: str,
+                             token: Optional[str] = None, timeout_sec: int = 20, max_retries: int = 3,
+                             estimator=None):
+    """
+    Như upload_green_image nhưng gửi JPEG đã nằm sẵn trong RAM (vd từ image_prep).
+    estimator: ThroughputEstimator (tuỳ chọn) để ghi lại tốc độ upload thực tế.
+    """
+    url = base_url.rstrip("/") + "/api/GreenImage/upload"
+    headers = {}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+
+    for attempt in range(1, max_retries + 1):
+        files = {"formFile": (filename, data, "image/jpeg")}
+        form = {"deviceId": device_id}
+        t0 = time.monotonic()
+        try:
+            r = requests.post(url, headers=headers, files=files, data=form, timeout=timeout_sec)
+            if r.status_code in (200, 201):
+                dt = time.monotonic() - t0
+                UPLOAD_S.labels("image", "ok").observe(dt)
+                if estimator is not None:
+                    estimator.record(len(data), dt)
+                return r.json()
+            raise HttpError(f"HTTP {r.status_code}: {r.text[:300]}")
+        except Exception as e:
+            UPLOAD_S.labels("image", "error").observe(time.monotonic() - t0)
+            if estimator is not None and not isinstance(e, HttpError):
+                estimator.record_failure()
+            if attempt == max_retries:
+                raise
+            UPLOAD_RETRIES.labels("image").inc()
+            time.sleep(2 ** attempt)
+
+# ===== Upload chia chunk, resume được =====
+# Giao thức (server phải hỗ trợ, xem app/upload_standin.py để chạy thử local):
+#   POST {base}/api/GreenImage/chunked/init         {deviceId, fileName, size, sha256, chunkSize}
+#        -> {"uploadId": "...", "received": n}      n = số chunk liên tiếp server đã nhận
+#   PUT  {base}/api/GreenImage/chunked/{id}/{index}  body = bytes chunk, header X-Chunk-Sha256
+#        -> {"received": n}
+#   POST {base}/api/GreenImage/chunked/{id}/complete -> JSON giống /api/GreenImage/upload
+# Server nhận diện lại phiên cũ theo (deviceId, sha256) nên restart vẫn resume được.
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def upload_green_image_chunked(base_url: str, image_path: str, device_id: str,
+                               token: Optional[str] = None, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                               timeout_sec: int = 20, max_retries: int = 5, session=None):
+    """
+    Gửi ảnh theo từng chunk cố định (mỗi chunk có sha256 riêng). Lỗi giữa chừng thì
+    hỏi lại server đã nhận tới đâu và gửi tiếp từ chunk đó, không gửi lại từ đầu.
+    """
+    base = base_url.rstrip("/") + "/api/GreenImage/chunked"
+    s = session or requests.Session()
+    # Header gắn theo từng request, không sửa session của caller (có thể dùng chung)
+    auth = {"Authorization": f"Bearer {token}"} if token else {}
+    size = os.path.getsize(image_path)
+    total = max(1, (size + chunk_size - 1) // chunk_size)
+    meta = {"deviceId": device_id, "fileName": os.path.basename(image_path),
+            "size": size, "sha256": _file_sha256(image_path), "chunkSize": chunk_size}
+
+    def _init():
+        r = s.post(base + "/init", json=meta, headers=auth, timeout=timeout_sec)
+        if r.status_code not in (200, 201):
+            raise HttpError(f"HTTP {r.status_code}: {r.text[:300]}")
+        j = r.json()
+        return j["uploadId"], int(j.get("received", 0))
+
+    failures = 0
+    upload_id, index = None, 0
+    with open(image_path, "rb") as f:
+        while True:
+            t0 = time.perf_counter()
+            try:
+                if upload_id is None:
+                    upload_id, index = _init()
+                if index >= total:
+                    r = s.post(f"{base}/{upload_id}/complete", headers=auth, timeout=timeout_sec)
+                    if r.status_code in (200, 201):
+                        return r.json()
+                    raise HttpError(f"HTTP {r.status_code}: {r.text[:300]}")
+                f.seek(index * chunk_size)
+                chunk = f.read(chunk_size)
+                r = s.put(f"{base}/{upload_id}/{index}", data=chunk, timeout=timeout_sec,
+                          headers=dict(auth, **{"Content-Type": "application/octet-stream",
+                                                "X-Chunk-Sha256": hashlib.sha256(chunk).hexdigest()}))
+                if r.status_code not in (200, 201):
+                    raise HttpError(f"HTTP {r.status_code}: {r.text[:300]}")
+                # Server trả số chunk liên tiếp đã nhận -> nhảy đúng tới chỗ cần gửi tiếp
+                index = int(r.json().get("received", index + 1))
+                UPLOAD_S.labels("image_chunk", "ok").observe(time.perf_counter() - t0)
+                failures = 0
+            except Exception:
+                UPLOAD_S.labels("image_chunk", "error").observe(time.perf_counter() - t0)
+                failures += 1
+                if failures > max_retries:
+                    raise
+                UPLOAD_RETRIES.labels("image_chunk").inc()
+                time.sleep(min(30, 2 ** failures))
+                upload_id = None   # init lại để biết server đã nhận tới chunk nào
+
+def upload_many_chunked(base_url: str, image_paths, device_id: str, max_parallel: int = 2, **kwargs):
+    """
+    Upload nhiều ảnh song song nhưng giới hạn max_parallel luồng.
+    Trả dict {path: response_json | Exception}.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, int(max_parallel))) as pool:
+        futures = {pool.submit(upload_green_image_chunked, base_url, p, device_id, **kwargs): p
+                   for p in image_paths}
+        for fut, path in futures.items():
+            try:
+                results[path] = fut.result()
+            except Exception as e:
+                results[path] = e
+    return results
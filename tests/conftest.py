@@ -0,0 +1,65 @@
+# tests/conftest.py
+import sys
+import types
+
+import numpy as np
+import pytest
+
+
+class FakePicamera2:
+    """Giả picamera2.Picamera2: frame đen BGR đúng cỡ đã cấu hình."""
+    opened = []
+
+    def __init__(self):
+        self.size = None
+        self.running = False
+        self.captures = 0
+        FakePicamera2.opened.append(self)
+
+    def create_video_configuration(self, main, buffer_count, **kw):
+        return main
+
+    def configure(self, config):
+        self.size = tuple(config["size"])
+
+    def start(self):
+        self.running = True
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        pass
+
+    def capture_array(self, name):
+        self.captures += 1
+        return np.zeros((self.size[1], self.size[0], 3), np.uint8)
+
+
+@pytest.fixture
+def fake_picamera2(monkeypatch):
+    FakePicamera2.opened = []
+    monkeypatch.setitem(sys.modules, "picamera2", types.SimpleNamespace(Picamera2=FakePicamera2))
+    return FakePicamera2
+
+
+@pytest.fixture
+def gpio(monkeypatch):
+    """gpio_controller ở chế độ mock với trạng thái sạch, không bảo vệ relay."""
+    from app import gpio_controller as g
+    monkeypatch.setattr(g, "GPIO", None)
+    monkeypatch.setattr(g, "_proxy", None)
+    monkeypatch.setattr(g, "_service", None)
+    monkeypatch.setattr(g, "_journal", None)
+    monkeypatch.setattr(g, "_device_states", {d: False for d in g.DEVICES})
+    monkeypatch.setattr(g, "_pending", {})
+    monkeypatch.setattr(g, "_inflight", {})
+    monkeypatch.setattr(g, "_last_switch", {})
+    monkeypatch.setattr(g, "_buckets", {})
+    monkeypatch.setattr(g, "_device_limits", {})
+    monkeypatch.setattr(g, "_last_on_at", None)
+    monkeypatch.setattr(g, "SWITCH_STAGGER_S", 0.0)
+    monkeypatch.setattr(g, "MIN_DWELL_S", 0.0)
+    monkeypatch.setattr(g, "MAX_PER_MIN", 0.0)
+    monkeypatch.setattr(g, "BURST", 3)
+    return g
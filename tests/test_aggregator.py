@@ -0,0 +1,135 @@
+# tests/test_aggregator.py
+import json
+import statistics
+import threading
+
+import pytest
+
+from app.aggregator import AggregateOutbox, WindowAggregator, flatten_reading
+
+
+def test_flatten_reading_keeps_numbers_only():
+    data = {"env": {"temp_c": 25.0, "ok": True, "name": "x", "nan": float("nan")},
+            "co2": {"ppm": 410}, "soil": None}
+    assert flatten_reading(data) == {"env.temp_c": 25.0, "co2.ppm": 410.0}
+
+
+def test_window_stats_match_brute_force():
+    agg = WindowAggregator(windows={"env.temp_c": 60}, device_id="D1")
+    vals = [20.0 + (i % 7) * 0.5 for i in range(60)]
+    closed = []
+    for i, v in enumerate(vals):
+        closed += agg.add({"env": {"temp_c": v}}, now=600 + i)
+    assert closed == []
+    out = agg.add({"env": {"temp_c": 99.0}}, now=660)
+    assert len(out) == 1
+    m = out[0]["metrics"]["env.temp_c"]
+    assert out[0]["window_s"] == 60 and out[0]["device_id"] == "D1"
+    assert m["count"] == 60 and m["min"] == min(vals) and m["max"] == max(vals)
+    assert m["last"] == vals[-1]
+    assert m["mean"] == pytest.approx(statistics.mean(vals), abs=1e-4)
+    assert m["stddev"] == pytest.approx(statistics.stdev(vals), abs=1e-4)
+
+
+def test_open_window_resumes_after_restart_without_duplicate(tmp_path):
+    path = str(tmp_path / "open.json")
+    vals = [float(i) for i in range(60)]
+    agg = WindowAggregator(default_window_s=60, state_path=path)
+    for i in range(30):
+        assert agg.add({"env": {"temp_c": vals[i]}}, now=600 + i) == []
+    assert agg.save() and agg.flush() == []          # dừng giữa cửa sổ: không gửi gì
+
+    agg = WindowAggregator(default_window_s=60, state_path=path)
+    with pytest.raises(FileNotFoundError):
+        open(path)                                   # đã nạp -> crash sau đó không nạp lại
+    for i in range(30, 60):
+        assert agg.add({"env": {"temp_c": vals[i]}}, now=600 + i) == []
+    out = agg.add({"env": {"temp_c": 0.0}}, now=660)
+    m = out[0]["metrics"]["env.temp_c"]
+    assert len(out) == 1 and m["count"] == 60 and m["min"] == 0.0 and m["max"] == 59.0
+    assert m["mean"] == pytest.approx(statistics.mean(vals), abs=1e-4)
+    assert m["stddev"] == pytest.approx(statistics.stdev(vals), abs=1e-4)
+
+
+def test_saved_window_that_expired_is_sent_once(tmp_path):
+    path = str(tmp_path / "open.json")
+    agg = WindowAggregator(default_window_s=60, state_path=path)
+    agg.add({"co2": {"ppm": 500}}, now=600)
+    agg.save()
+    agg = WindowAggregator(default_window_s=60, state_path=path)
+    out = agg.add({"co2": {"ppm": 700}}, now=1000)   # khởi động lại sau khi cửa sổ đã hết
+    assert len(out) == 1 and out[0]["metrics"]["co2.ppm"]["last"] == 500.0
+    assert out[0]["metrics"]["co2.ppm"]["count"] == 1
+
+
+def test_metrics_with_same_window_share_one_payload():
+    agg = WindowAggregator(default_window_s=60)
+    for t in range(0, 60):
+        agg.add({"env": {"temp_c": 1.0, "rh_pct": 2.0}}, now=t)
+    out = agg.add({"env": {"temp_c": 1.0, "rh_pct": 2.0}}, now=60)
+    assert len(out) == 1 and set(out[0]["metrics"]) == {"env.temp_c", "env.rh_pct"}
+
+
+def test_missing_metric_window_closes_when_expired():
+    agg = WindowAggregator(default_window_s=60)
+    agg.add({"co2": {"ppm": 400}, "env": {"temp_c": 1.0}}, now=0)
+    out = agg.add({"env": {"temp_c": 1.0}}, now=61)
+    assert any("co2.ppm" in p["metrics"] for p in out)
+    assert agg.flush()[0]["metrics"]["env.temp_c"]["count"] == 1
+
+
+def _payload(i):
+    return {"ts": f"t{i}", "window_s": 60.0, "metrics": {"m": {"count": 1}}}
+
+
+def test_outbox_retries_until_sent_in_order(tmp_path):
+    calls, sent = [], []
+    done = threading.Event()
+
+    def send(p):
+        calls.append(p["ts"])
+        if len(calls) <= 2:
+            raise ConnectionError("offline")
+        sent.append(p["ts"])
+        if len(sent) == 3:
+            done.set()
+        return 200
+
+    box = AggregateOutbox(send, path=str(tmp_path / "ob.jsonl"), backoff_s=0.01, backoff_max_s=0.02)
+    box.put([_payload(i) for i in range(3)])
+    box.start()
+    assert done.wait(5)
+    box.stop(timeout=1)
+    assert sent == ["t0", "t1", "t2"]
+    assert calls[:3] == ["t0", "t0", "t0"]
+    assert len(box) == 0 and (tmp_path / "ob.jsonl").read_text() == ""
+
+
+def test_outbox_persists_and_is_bounded(tmp_path):
+    path = tmp_path / "ob.jsonl"
+    box = AggregateOutbox(lambda p: 200, path=str(path), max_items=3)
+    box.put([_payload(i) for i in range(5)])       # chưa start: không gửi
+    assert box.dropped == 2
+    assert [json.loads(l)["ts"] for l in path.read_text().splitlines()] == ["t2", "t3", "t4"]
+    with open(path, "a") as f:
+        f.write('{"ts": "cut')                     # dòng cắt dở do mất điện
+    again = AggregateOutbox(lambda p: 200, path=str(path), max_items=3)
+    assert len(again) == 3
+
+
+def test_outbox_drops_payload_rejected_by_server():
+    class Rejected(Exception):
+        response = type("R", (), {"status_code": 400})()
+
+    seen = []
+
+    def send(p):
+        seen.append(p["ts"])
+        if p["ts"] == "t0":
+            raise Rejected("bad request")
+        return 200
+
+    box = AggregateOutbox(send, backoff_s=5).start()
+    box.put([_payload(0), _payload(1)])
+    box.stop(timeout=2)
+    assert seen == ["t0", "t1"] and len(box) == 0 and box.sent == 1
@@ -0,0 +1,55 @@
+# tests/test_bundle.py
+import json
+import time
+
+from app import bundle, uploader
+from app.json_export import build_record
+
+
+def _record():
+    rec = build_record("2026-01-01T07:00:00", "H2-RASPI-01",
+                       {"temp_c": 25.0, "rh_pct": 60.0, "hpa": 1000.0, "lux": 10, "uv_mw_cm2": -1},
+                       {"co2_ppm": 420}, None)
+    rec["image"] = {"file": "20260101T000000Z.jpg", "width": 1280, "height": 720,
+                    "bytes": 3, "sha256": "ab", "dhash": "00ff"}
+    return rec
+
+
+def test_build_record_maps_driver_keys():
+    rec = _record()
+    assert rec["env"]["pressure_hpa"] == 1000.0 and rec["co2"]["ppm"] == 420
+    assert rec["soil"] is None and rec["device_id"] == "H2-RASPI-01"
+
+
+def test_post_bundle_sends_one_multipart_with_same_timestamp(monkeypatch):
+    sent = {}
+
+    class Resp:
+        status_code, text = 201, "ok"
+
+    def fake_post(kind, url, **kw):
+        sent.update(kw, kind=kind)
+        return Resp()
+
+    monkeypatch.setattr(uploader, "_post", fake_post)
+    code, _ = uploader.post_bundle(_record(), b"jpg", token="t")
+    assert code == 201 and sent["kind"] == "bundle"
+    body = json.loads(sent["files"]["payload"][1])
+    # 07:00 giờ VN = 00:00 UTC, khớp tên file ảnh
+    assert body["timestamp"] == "2026-01-01T00:00:00Z"
+    assert body["image"]["fileName"] == sent["files"]["formFile"][0] == "20260101T000000Z.jpg"
+    assert body["environment"]["uvMwCm2"] == 0.0
+    assert sent["headers"] == {"Authorization": "Bearer t"}
+
+
+def test_stamp_ignores_system_timezone(monkeypatch):
+    monkeypatch.setenv("TZ", "America/New_York")      # Pi cấu hình sai múi giờ
+    time.tzset()
+    try:
+        ts, name = bundle._stamp()
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+    # ts coi là giờ VN khi gửi -> phải ra đúng giây UTC trong tên file ảnh
+    utc = uploader._to_utc_z(ts)
+    assert name == utc.replace("-", "").replace(":", "").replace("Z", "") + "Z.jpg"
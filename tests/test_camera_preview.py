@@ -0,0 +1,86 @@
+# tests/test_camera_preview.py
+import importlib
+import sys
+import types
+
+import numpy as np
+import pytest
+
+
+class FakeRequest:
+    def __init__(self, buf, metadata):
+        self.buf = buf
+        self.metadata = metadata
+        self.released = False
+
+    def get_metadata(self):
+        return self.metadata
+
+    def release(self):
+        self.released = True
+
+
+class FakeMappedArray:
+    """Như picamera2.MappedArray: map buffer của request, không copy."""
+
+    def __init__(self, req, stream):
+        assert stream == "main"
+        self.array = req.buf
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+@pytest.fixture
+def preview(monkeypatch):
+    shown, drawn = [], []
+    keys = iter([-1, -1, ord("q")])
+    cv2 = types.SimpleNamespace(
+        FONT_HERSHEY_SIMPLEX=0, LINE_AA=16,
+        putText=lambda img, text, *a: drawn.append((id(img), text)),
+        imshow=lambda title, img: shown.append(img),
+        waitKey=lambda ms: next(keys))
+    monkeypatch.setitem(sys.modules, "cv2", cv2)
+    monkeypatch.setitem(sys.modules, "picamera2", types.SimpleNamespace(
+        Picamera2=object, Preview=object, MappedArray=FakeMappedArray))
+    monkeypatch.delitem(sys.modules, "app.camera_preview", raising=False)
+    mod = importlib.import_module("app.camera_preview")
+    yield mod, shown, drawn
+    sys.modules.pop("app.camera_preview", None)
+
+
+def test_stats_fps_latency_and_drops(preview, monkeypatch):
+    cp, _, _ = preview
+    wall = iter([10.0, 10.02, 10.07])
+    monkeypatch.setattr(cp.time, "perf_counter", lambda: next(wall))
+    monkeypatch.setattr(cp.time, "clock_gettime_ns", lambda clk: 5_000_000_000)
+    st = cp.PreviewStats(alpha=0.5)
+    frame_us = 10_000
+    st.update({"SensorTimestamp": 4_990_000_000, "FrameDuration": frame_us}, 0.001)
+    assert st.latency_ms == pytest.approx(10.0) and st.fps == 0.0
+    st.update({"SensorTimestamp": 5_000_000_000, "FrameDuration": frame_us}, 0.002)
+    assert st.fps == pytest.approx(50.0) and st.dropped == 0
+    st.update({"SensorTimestamp": 5_040_000_000, "FrameDuration": frame_us}, 0.003)   # cách 4 frame
+    assert st.dropped == 3 and st.frames == 3
+    assert st.fps == pytest.approx(50.0 + 0.5 * (20.0 - 50.0))
+    assert st.latency_ms is None                 # timestamp "trong tương lai" -> bỏ
+    assert st.lines()[2] == "Dropped: 3/6" and st.wait_ms == pytest.approx(3.0)
+
+
+def test_zero_copy_loop_draws_on_request_buffer(preview):
+    cp, shown, drawn = preview
+    reqs = []
+
+    class Cam:
+        def capture_request(self):
+            r = FakeRequest(np.zeros((4, 6, 3), np.uint8), {"SensorTimestamp": 0})
+            reqs.append(r)
+            return r
+
+    cp._loop_zero_copy(Cam())
+    assert len(reqs) == 3 and all(r.released for r in reqs)
+    assert [id(a) for a in shown] == [id(r.buf) for r in reqs]     # imshow thẳng trên buffer DMA
+    assert {i for i, _ in drawn} == {id(r.buf) for r in reqs}        # overlay vẽ lên chính buffer đó
@@ -0,0 +1,45 @@
+# tests/test_camera_service.py
+import pytest
+
+from app.camera_service import CameraService
+
+
+@pytest.fixture
+def svc(fake_picamera2):
+    return CameraService(size=(1280, 720), warmup_s=0)
+
+
+def test_acquire_starts_at_requested_size_and_release_stops(svc):
+    svc.acquire(size=(960, 540))
+    assert svc.running and svc.capture_array(keep_warm=False).shape == (540, 960, 3)
+    svc.release()
+    assert not svc.running and svc.users == 0
+
+
+def test_reconfigure_is_ignored_while_leased(svc, fake_picamera2):
+    svc.acquire(size=(960, 540))
+    svc.reconfigure(size=(1280, 720))
+    assert svc.size == (960, 540) and len(fake_picamera2.opened) == 1
+    svc.release()
+    svc.reconfigure(size=(1280, 720))
+    assert svc.size == (1280, 720)
+
+
+def test_release_keeps_camera_warm_for_one_shot_users(svc):
+    svc.acquire(size=(960, 540))
+    svc.capture_array()              # timelapse / canopy chụp lẻ trong lúc stream
+    svc.release()
+    assert svc.running
+    svc.stop()
+    svc.acquire()
+    svc.release()
+    assert not svc.running
+
+
+def test_nested_leases(svc):
+    svc.acquire()
+    svc.acquire()
+    svc.release()
+    assert svc.running and svc.users == 1
+    svc.release()
+    assert not svc.running
@@ -0,0 +1,87 @@
+# tests/test_camera_stream.py
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+import pytest
+
+from app import camera_stream
+from app.camera_service import CameraService
+from app.camera_stream import MjpegBroadcaster
+
+
+@pytest.fixture
+def stream(fake_picamera2, monkeypatch):
+    encoded = []
+
+    def imencode(ext, frame, params):
+        encoded.append(b"jpg%d" % len(encoded))
+        return True, np.frombuffer(encoded[-1], np.uint8)
+
+    monkeypatch.setitem(sys.modules, "cv2", types.SimpleNamespace(
+        IMWRITE_JPEG_QUALITY=1, INTER_AREA=3, imencode=imencode,
+        resize=lambda frame, size, interpolation=None: np.zeros((size[1], size[0], 3), np.uint8)))
+    svc = CameraService(size=(960, 540), warmup_s=0)
+    monkeypatch.setattr(camera_stream, "get_service", lambda: svc)
+    b = MjpegBroadcaster(size=(960, 540), idle_release_s=0.05)
+    yield b, svc, encoded
+    _wait_stopped(b)
+    svc.stop()
+
+
+def _wait_stopped(b, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while b._thread is not None and time.monotonic() < deadline:
+        time.sleep(0.02)
+    return b._thread is None
+
+
+def _payload(part):
+    return part.rsplit(b"\r\n\r\n", 1)[1][:-2]
+
+
+def _pull(b, fps, seconds, out):
+    gen = b.frames(fps)
+    deadline = time.monotonic() + seconds
+    for part in gen:
+        out.append(_payload(part))
+        if time.monotonic() >= deadline:
+            break
+    gen.close()
+
+
+def _clients(b, *specs):
+    outs = [[] for _ in specs]
+    threads = [threading.Thread(target=_pull, args=(b, fps, secs, out))
+               for (fps, secs), out in zip(specs, outs)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return outs
+
+
+def test_frames_are_encoded_once_for_all_viewers(stream):
+    b, _, encoded = stream
+    a, c = _clients(b, (20, 0.4), (20, 0.4))
+    assert a and c
+    assert set(a) | set(c) <= set(encoded)          # mọi client nhận đúng bản JPEG producer đã encode
+    assert len(set(a) & set(c)) >= len(a) // 2      # cùng frame được chia cho cả hai
+    assert len(encoded) < len(a) + len(c)
+
+
+def test_each_client_keeps_its_own_fps(stream):
+    b, _, encoded = stream
+    fast, slow = _clients(b, (30, 0.6), (4, 0.6))
+    assert len(slow) <= 4
+    assert len(fast) >= 2 * len(slow)
+    assert len(encoded) <= len(fast) + 3             # producer chạy theo client nhanh nhất, không cộng dồn
+
+
+def test_camera_released_when_last_viewer_leaves(stream):
+    b, svc, _ = stream
+    _clients(b, (10, 0.1))
+    assert _wait_stopped(b)
+    assert svc.users == 0 and not svc.running and b.viewers == 0
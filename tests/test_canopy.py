@@ -0,0 +1,37 @@
+# tests/test_canopy.py
+import numpy as np
+
+from app.canopy import CanopyChangeGate, compute_metrics
+
+
+def _frame(bgr, h=40, w=60):
+    return np.tile(np.array(bgr, dtype=np.uint8), (h, w, 1))
+
+
+def test_all_green_frame():
+    m = compute_metrics(_frame((20, 200, 20)), downsample=1, fov_area_m2=2.0)
+    assert m["green_ratio"] == 1.0 and m["growth_area_m2"] == 2.0
+    assert m["exg_mean"] > 0.5
+
+
+def test_half_green_and_dark_pixels_ignored():
+    f = _frame((120, 120, 120))
+    f[:, :30] = (20, 200, 20)
+    assert compute_metrics(f, downsample=1)["green_ratio"] == 0.5
+    dark = _frame((5, 30, 5))          # xanh nhưng quá tối (< min_intensity)
+    assert compute_metrics(dark, downsample=1)["green_ratio"] == 0.0
+
+
+def test_brightness_is_luma():
+    assert compute_metrics(_frame((255, 255, 255)))["brightness"] == 255.0
+
+
+def test_change_gate():
+    gate = CanopyChangeGate(green_ratio_delta=0.02, brightness_delta=20, max_interval_s=100)
+    m = {"green_ratio": 0.3, "brightness": 120.0}
+    assert gate.should_upload(m, now=0)
+    gate.mark_uploaded(m, now=0)
+    assert not gate.should_upload({"green_ratio": 0.31, "brightness": 130.0}, now=10)
+    assert gate.should_upload({"green_ratio": 0.33, "brightness": 120.0}, now=10)
+    assert gate.should_upload({"green_ratio": 0.3, "brightness": 141.0}, now=10)
+    assert gate.should_upload(m, now=100)
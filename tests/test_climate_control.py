@@ -0,0 +1,83 @@
+# tests/test_climate_control.py
+import pytest
+
+from app.climate_control import PID, ClimateController, ControlLoop, TimeProportionalRelay
+
+SOIL = {"name": "soil", "metric": "soil.hum_pct", "setpoint": 40, "action": "raise",
+        "mode": "pid", "sample_s": 1, "window_s": 10, "outputs": ["pump"],
+        "pid": {"kp": 1.0, "ki": 0.0}}
+
+
+def test_pid_clamps_and_does_not_wind_up():
+    pid = PID(kp=0.1, ki=0.5)
+    for _ in range(100):
+        assert pid.update(10.0, 1.0) == 1.0          # bão hoà suốt 100 s
+    assert pid._i <= 1.0
+    # Sai số đổi dấu: output rời bão hoà ngay, không phải "xả" tích phân 100 s
+    assert pid.update(-5.0, 1.0) < 0.5
+
+
+def test_time_proportional_duty_and_min_on_carry():
+    r = TimeProportionalRelay(window_s=10, min_on_s=3)
+    r.set_duty(0.5)
+    states = [r.update(float(t)) for t in range(20)]
+    assert states == [True] * 5 + [False] * 5 + [True] * 5 + [False] * 5
+    assert r.cycles == 2
+
+    r = TimeProportionalRelay(window_s=10, min_on_s=3)
+    r.set_duty(0.2)                                  # 2 s < min_on -> dồn sang cửa sổ sau
+    on = [r.update(float(t)) for t in range(20)]
+    assert on[:10] == [False] * 10 and sum(on[10:]) == 4 and r.cycles == 1
+
+
+def test_time_proportional_immediate_respects_min_off():
+    r = TimeProportionalRelay(window_s=10, min_off_s=5, immediate=True)
+    r.set_duty(1.0)
+    assert r.update(0.0) is True
+    r.set_duty(0.0)
+    assert r.update(1.0) is False
+    r.set_duty(1.0)
+    assert r.update(3.0) is False and r.update(6.0) is True
+
+
+def test_stale_reading_forces_off():
+    lp = ControlLoop(SOIL)
+    lp.on_value(10.0, 0.0)
+    assert lp.step(0.0, stale_s=60) == {"pump": True}
+    assert lp.step(61.0, stale_s=60) == {"pump": False}
+
+
+class DeferringGpio:
+    """apply_batch hoãn mọi lệnh BẬT (như đang trong min dwell)."""
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_batch(self, changes):
+        self.calls.append(list(changes))
+        return True, [{"device": d, "status": "OK", **({"pending": "on", "apply_in_s": 5.0} if on else {})}
+                      for d, on in changes]
+
+
+def test_deferred_command_is_not_recorded_as_applied():
+    gpio = DeferringGpio()
+    ctl = ClimateController([ControlLoop(SOIL)], gpio=gpio, stale_s=60)
+    ctl.on_reading({"soil": {"hum_pct": 10}}, now=0.0)
+    ctl.step(0.0)
+    assert gpio.calls == [[("pump", True)]] and "pump" not in ctl._applied
+    ctl.step(1.0)
+    assert gpio.calls[-1] == [("pump", True)]        # gửi lại vì chưa áp được
+    ctl.on_reading({"soil": {"hum_pct": 90}}, now=2.0)
+    ctl.step(12.0)                                   # cửa sổ mới, duty 0 -> gửi OFF huỷ lệnh hoãn
+    assert gpio.calls[-1] == [("pump", False)] and ctl._applied["pump"] is False
+
+
+@pytest.mark.parametrize("mode", ["pid", "hysteresis"])
+def test_simulation_holds_soil_near_setpoint(mode):
+    from app.climate_control import simulate
+    cfg = {"climate_control": {"loops": [{"name": "soil", "metric": "soil.hum_pct", "setpoint": 40,
+                                          "action": "raise", "mode": mode, "window_s": 120,
+                                          "outputs": ["pump"], "hysteresis": {"band": 2},
+                                          "pid": {"kp": 0.3, "ki": 0.002}}]}}
+    out = simulate(cfg, hours=3)["soil"]
+    assert out["mean_abs_err"] < 2.0
@@ -0,0 +1,101 @@
+# tests/test_command_client.py
+import threading
+
+from app.command_client import CommandClient
+from app.control import handle_control
+
+
+class FakeServer:
+    """Thay cho poll_once/_send_ack: hàng lệnh + ack, ack có thể lỗi N lần đầu."""
+
+    def __init__(self, batches, ack_failures=0):
+        self.batches = list(batches)
+        self.acks = []
+        self.ack_failures = ack_failures
+
+    def poll(self):
+        return self.batches.pop(0) if self.batches else []
+
+    def ack(self, ack):
+        if self.ack_failures:
+            self.ack_failures -= 1
+            raise ConnectionError("mất mạng")
+        self.acks.append(ack)
+
+
+def _client(gpio, server):
+    c = CommandClient(gpio, "http://example", "PI-1")
+    c.poll_once = server.poll
+    c._send_ack = server.ack
+    return c
+
+
+def test_same_result_as_rest_route(gpio):
+    body = {"deviceId": "PI-1", "component": "pump", "state": "on"}
+    server = FakeServer([[{"id": "a", "body": body}]])
+    c = _client(gpio, server)
+    c.step()
+    ack = server.acks[0]
+    assert ack["status"] == 200 and ack["result"]["state"] == "on"
+    assert ack["revision"] == gpio.get_state_snapshot()[0]
+    assert ack["result"] == handle_control(gpio, body)[0]     # lệnh lặp lại: cùng định dạng
+
+
+def test_redelivered_toggle_is_not_applied_twice(gpio):
+    cmd = {"id": "t1", "body": {"component": "fan1", "state": "toggle"}}
+    server = FakeServer([[cmd], [cmd]])
+    c = _client(gpio, server)
+    c.step()
+    c.step()
+    assert gpio.get_device_state("fan1") is True
+    assert c.applied == 1 and len(server.acks) == 2 and server.acks[0] == server.acks[1]
+
+
+def test_lost_ack_is_retried_without_reapplying(gpio):
+    cmd = {"id": "t2", "body": {"component": "fan2", "state": "toggle"}}
+    server = FakeServer([[cmd]], ack_failures=1)
+    c = _client(gpio, server)
+    try:
+        c.step()
+    except ConnectionError:
+        pass
+    assert server.acks == [] and len(c._pending_acks) == 1
+    c.step()                                     # lần sau: gửi ack nợ trước khi poll
+    assert [a["id"] for a in server.acks] == ["t2"]
+    assert gpio.get_device_state("fan2") is True and c.applied == 1
+
+
+def test_bad_command_acked_with_error(gpio):
+    server = FakeServer([[{"id": "x", "body": {"component": "pump", "state": "blink"}}]])
+    c = _client(gpio, server)
+    c.step()
+    assert server.acks[0]["status"] == 400
+
+
+def test_command_without_id_is_rejected_not_deduped(gpio):
+    body = {"component": "light", "state": "toggle"}
+    server = FakeServer([[{"body": body}, {"id": None, "body": body}, {"id": "", "body": body}]])
+    c = _client(gpio, server)
+    c.step()
+    assert gpio.get_device_state("light") is False          # không áp dụng lệnh nào
+    assert c.rejected == 3 and c.applied == 0 and server.acks == [] and not c._pending_acks
+    ack = c.apply({"body": body})
+    assert ack["status"] == 400 and ack["id"] is None and "None" not in c._done
+
+
+def test_ack_revision_is_the_one_this_command_produced(gpio, monkeypatch):
+    orig = gpio.get_device_state
+
+    def racing(name):
+        # Lệnh khác (luồng khác) đổi trạng thái ngay sau khi lệnh này commit
+        t = threading.Thread(target=gpio.set_device, args=("fan2", True))
+        t.start()
+        t.join()
+        return orig(name)
+
+    rev0 = gpio.get_state_snapshot()[0]
+    monkeypatch.setattr(gpio, "get_device_state", racing)
+    server = FakeServer([[{"id": "r1", "body": {"component": "pump", "state": "on"}}]])
+    _client(gpio, server).step()
+    assert server.acks[0]["revision"] == rev0 + 1
+    assert gpio.get_state_snapshot()[0] == rev0 + 2
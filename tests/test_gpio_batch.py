@@ -0,0 +1,59 @@
+# tests/test_gpio_batch.py
+import threading
+
+
+def test_validate_batch(gpio):
+    res = gpio.validate_batch([("quạt1", "ON"), ("pump", True), ("x", "on"), ("light", "blink"), ("", "on")])
+    assert res[0]["resolved"] == "fan1" and res[0]["action"] == "on"
+    assert res[1]["action"] == "on"
+    assert "Unknown device" in res[2]["error"]
+    assert "Invalid action" in res[3]["error"]
+    assert res[4]["error"] == "Missing device or action"
+
+
+def test_invalid_command_applies_nothing(gpio):
+    ok, res = gpio.apply_batch([("fan1", "on"), ("nope", "on")])
+    assert not ok and [r["status"] for r in res] == ["SKIPPED", "FAILED"]
+    assert gpio.get_all_states()["fan1"] is False
+
+
+def test_batch_applies_in_order_with_one_revision_per_change(gpio):
+    rev0 = gpio.get_state_snapshot()[0]
+    ok, res = gpio.apply_batch([("fan1", "on"), ("pump", "on"), ("fan1", "toggle")])
+    assert ok and [r["state"] for r in res] == ["off", "on", "off"]
+    rev, states = gpio.get_state_snapshot()
+    assert states == {"fan1": False, "fan2": False, "pump": True, "light": False}
+    assert rev == rev0 + 1
+
+
+def test_multi_device_batch_commits_one_revision(gpio):
+    rev0 = gpio.get_state_snapshot()[0]
+    seen = []
+    waiter = threading.Thread(target=lambda: seen.append(gpio.wait_for_change(rev0, 5)))
+    waiter.start()
+    ok, _ = gpio.apply_batch([("fan1", "on"), ("fan2", "on"), ("pump", "on"), ("light", "on")])
+    waiter.join(5)
+    rev, states = gpio.get_state_snapshot()
+    assert ok and all(states.values())
+    assert rev == rev0 + 1
+    assert seen == [(rev0 + 1, states)]                 # client long-poll thấy cả batch, không thấy nửa chừng
+
+
+def test_concurrent_toggles_do_not_lose_updates(gpio):
+    start = threading.Barrier(8)
+
+    def worker():
+        start.wait()
+        for _ in range(25):
+            assert gpio.toggle_device("light")
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert gpio.get_device_state("light") is False      # 200 lần đảo -> về trạng thái đầu
+
+
+def test_toggle_unknown_device(gpio):
+    assert gpio.toggle_device("nope") is False
@@ -0,0 +1,110 @@
+# tests/test_gpio_protect.py
+import threading
+import time
+import types
+
+import pytest
+
+
+def test_token_bucket_and_dwell(gpio, monkeypatch):
+    monkeypatch.setattr(gpio, "MAX_PER_MIN", 6.0)      # 1 token / 10 s
+    monkeypatch.setattr(gpio, "BURST", 2)
+    assert gpio._allowed_at("fan1", 100.0) == 0.0
+    gpio._consume("fan1", 100.0)
+    gpio._consume("fan1", 100.0)
+    assert gpio._allowed_at("fan1", 100.0) == pytest.approx(110.0)
+    assert gpio._allowed_at("fan1", 105.0) == pytest.approx(110.0)
+    assert gpio._allowed_at("fan1", 110.0) <= 110.0
+    monkeypatch.setattr(gpio, "_device_limits", {"pump": {"min_dwell_s": 30}})
+    gpio._consume("pump", 100.0)
+    assert gpio._allowed_at("pump", 101.0) == 130.0
+    assert gpio._allowed_at("fan2", 101.0) == 0.0    # giới hạn theo thiết bị không lan sang khác
+
+
+def test_deferred_keeps_latest_intent(gpio, monkeypatch):
+    monkeypatch.setattr(gpio, "MIN_DWELL_S", 0.2)
+    assert gpio.set_device("fan1", True) and gpio.get_device_state("fan1")
+    gpio.set_device("fan1", False)                   # hoãn (chưa đủ 0.2 s)
+    assert gpio.get_pending()["fan1"][0] is False and gpio.get_intent("fan1") is False
+    gpio.set_device("fan1", True)                    # trùng trạng thái thật -> huỷ lệnh hoãn
+    assert gpio.get_pending() == {}
+    ok, res = gpio.apply_batch([("fan1", "toggle")])   # toggle theo ý định -> OFF, lại hoãn
+    assert ok and res[0]["pending"] == "off"
+    time.sleep(0.4)
+    assert gpio.get_device_state("fan1") is False and gpio.get_pending() == {}
+
+
+class FakeGPIO(types.SimpleNamespace):
+    """Giả RPi.GPIO: ghi lại mức pin."""
+
+    def __init__(self):
+        super().__init__(BCM=11, OUT=0, HIGH=1, LOW=0, levels={}, writes=[])
+
+    def setup(self, pin, mode, initial=None):
+        pass
+
+    def output(self, pin, level):
+        self.levels[pin] = level
+        self.writes.append((pin, level, time.monotonic()))
+
+    def input(self, pin):
+        return self.levels.get(pin, 1)
+
+
+@pytest.fixture
+def hw(gpio, monkeypatch):
+    fake = FakeGPIO()
+    monkeypatch.setattr(gpio, "GPIO", fake)
+    monkeypatch.setattr(gpio, "_owner_fd", -1)       # tiến trình này làm chủ pin
+    monkeypatch.setattr(gpio, "SWITCH_STAGGER_S", 0.3)
+    return fake
+
+
+def test_stagger_does_not_block_readers(gpio, hw):
+    out = {}
+    t = threading.Thread(target=lambda: out.update(r=gpio.apply_batch([("fan1", True), ("pump", True)])))
+    t.start()
+    time.sleep(0.1)                                  # pump đang chờ giãn cách
+    t0 = time.monotonic()
+    assert gpio.get_all_states()["fan1"] is True
+    assert gpio.get_intent("pump") is True and "pump" in gpio.get_pending()
+    assert time.monotonic() - t0 < 0.05
+    t.join()
+    ok, res = out["r"]
+    assert ok and [r["state"] for r in res] == ["on", "on"]
+    (p1, _, t1), (p2, _, t2) = hw.writes
+    assert (p1, p2) == (gpio.DEVICES["fan1"], gpio.DEVICES["pump"]) and t2 - t1 >= 0.29
+
+
+def test_later_command_supersedes_staggered_write(gpio, hw):
+    out = {}
+    t = threading.Thread(target=lambda: out.update(r=gpio.apply_batch([("fan1", True), ("pump", True)])))
+    t.start()
+    time.sleep(0.1)
+    assert gpio.set_device("pump", False)            # không phải chờ lượt bật của batch
+    t.join()
+    ok, res = out["r"]
+    assert ok and res[1].get("superseded") and res[1]["state"] == "off"
+    assert gpio.get_device_state("pump") is False
+    assert gpio.DEVICES["pump"] not in [p for p, level, _ in hw.writes if level == hw.LOW]
+
+
+def test_journal_fsync_outside_lock(gpio, monkeypatch):
+    class SlowJournal:
+        def __init__(self):
+            self.lines = []
+
+        def append(self, states, revision=0):
+            time.sleep(0.3)                          # fsync chậm trên thẻ SD
+            self.lines.append((revision, dict(states)))
+
+    j = SlowJournal()
+    monkeypatch.setattr(gpio, "_journal", j)
+    t = threading.Thread(target=gpio.set_device, args=("light", True))
+    t.start()
+    time.sleep(0.1)
+    t0 = time.monotonic()
+    assert gpio.get_all_states()["light"] is True
+    assert time.monotonic() - t0 < 0.05
+    t.join()
+    assert j.lines[-1][1]["light"] is True
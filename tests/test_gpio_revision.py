@@ -0,0 +1,50 @@
+# tests/test_gpio_revision.py
+import threading
+import time
+
+
+def test_wait_for_change_wakes_on_new_revision(gpio):
+    rev0, _ = gpio.get_state_snapshot()
+    threading.Timer(0.05, gpio.set_device, args=("pump", True)).start()
+    t0 = time.monotonic()
+    rev, states = gpio.wait_for_change(rev0, timeout=5)
+    assert rev == rev0 + 1 and states["pump"] is True
+    assert time.monotonic() - t0 < 2
+
+
+def test_wait_for_change_times_out_without_change(gpio):
+    rev0, _ = gpio.get_state_snapshot()
+    t0 = time.monotonic()
+    rev, _ = gpio.wait_for_change(rev0, timeout=0.1)
+    assert rev == rev0 and 0.09 <= time.monotonic() - t0 < 1
+
+
+def test_same_state_does_not_bump_revision(gpio):
+    gpio.set_device("fan2", True)
+    rev, _ = gpio.get_state_snapshot()
+    gpio.set_device("fan2", True)
+    gpio.apply_batch([("fan2", "on")])
+    assert gpio.get_state_snapshot()[0] == rev
+    assert gpio.wait_for_change(rev - 1, timeout=0)[0] == rev
+
+
+def test_restart_continues_journal_revision_and_wakes_higher_since(gpio, tmp_path, monkeypatch):
+    from app.state_journal import StateJournal
+    path = str(tmp_path / "j.jsonl")
+    j = StateJournal(path, fsync=False)
+    j.append({"fan1": True, "fan2": False, "pump": False, "light": False}, 100)
+    j.close()
+    monkeypatch.setattr(gpio, "_revision", 0)           # tiến trình chủ mới
+    monkeypatch.setattr(gpio, "JOURNAL_PATH", path)
+    monkeypatch.setattr(gpio, "JOURNAL_FSYNC", False)
+    monkeypatch.setattr(gpio, "RESTORE_DEFAULT", "last")
+    monkeypatch.setattr(gpio, "RESTORE_POLICY", {})
+    gpio._restore(gpio._restore_targets(), 0.0)
+    gpio._journal.close()
+    rev, states = gpio.get_state_snapshot()
+    assert rev > 100 and states["fan1"] is True
+    # client giữ since của lần chạy trước (cao hơn cả mốc trong nhật ký) không bị treo
+    t0 = time.monotonic()
+    assert gpio.wait_for_change(150, timeout=5) == (rev, states)
+    assert gpio.wait_for_change(100, timeout=5)[0] == rev
+    assert time.monotonic() - t0 < 1
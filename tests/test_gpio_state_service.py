@@ -0,0 +1,86 @@
+# tests/test_gpio_state_service.py
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from app import gpio_state_service as gss
+from app.gpio_state_service import HEADER, SEQ, SEQ_OFF, OwnerGone, StateClient, StateService, StateTable
+
+DEVICES = {"fan1": 5, "pump": 13}
+
+
+@pytest.fixture
+def tables(tmp_path, monkeypatch):
+    monkeypatch.setattr(gss, "COPY_TIMEOUT_S", 0.05)
+    path = str(tmp_path / "state")
+    owner = StateTable(path, ndev=len(DEVICES), writable=True)
+    owner.publish(7, DEVICES, {"fan1": True}, {"pump": True}, {"fan1": True}, {"pump": 123.5})
+    reader = StateTable(path)
+    yield owner, reader
+    reader.close()
+    owner.close()
+
+
+def _stick(owner, pid):
+    """Giả người ghi chết giữa chừng: seq lẻ + pid chủ tuỳ ý."""
+    HEADER.pack_into(owner._mm, 0, gss.MAGIC, gss.VERSION, owner.ndev, owner._seq + 1, 7, pid, 0.0)
+    SEQ.pack_into(owner._mm, SEQ_OFF, owner._seq + 1)
+
+
+def test_publish_and_read(tables):
+    _, reader = tables
+    st = reader.read()
+    assert st["revision"] == 7 and st["owner_pid"] == os.getpid()
+    assert st["devices"]["fan1"] == {"pin": 5, "state": True, "pending": None,
+                                     "active_low": True, "pending_due": 0.0}
+    assert st["devices"]["pump"]["pending"] is True and st["devices"]["pump"]["pending_due"] == 123.5
+    assert reader.snapshot() == (7, {"fan1": True, "pump": False}) and reader.revision() == 7
+
+
+def test_stuck_writer_with_dead_owner(tables):
+    owner, reader = tables
+    p = subprocess.Popen([sys.executable, "-c", "pass"])
+    p.wait()
+    _stick(owner, p.pid)
+    t0 = time.monotonic()
+    with pytest.raises(OwnerGone, match=str(p.pid)):
+        reader.snapshot()
+    assert time.monotonic() - t0 < 1.0
+    assert not reader.owner_alive()
+
+
+def test_stuck_writer_with_live_owner(tables):
+    owner, reader = tables
+    good = reader.snapshot()
+    _stick(owner, os.getpid())
+    assert reader.snapshot() == good                 # bản đọc tốt gần nhất
+    fresh = StateTable(reader.path)
+    with pytest.raises(TimeoutError):
+        fresh.snapshot()
+    fresh.close()
+
+
+def test_wait_blocks_in_owner(gpio, tmp_path, monkeypatch):
+    svc = StateService(gpio, shm_path=str(tmp_path / "state"), sock_path=str(tmp_path / "s.sock"))
+    monkeypatch.setattr(gpio, "_service", svc)
+    gpio._publish()
+    svc.start()
+    client = StateClient(svc.table.path, svc.sock_path)
+    try:
+        rev0 = gpio.get_state_snapshot()[0]
+        t0 = time.monotonic()
+        assert client.wait(rev0, 0.2) == rev0 and time.monotonic() - t0 >= 0.19
+        t0 = time.monotonic()
+        assert client.wait(rev0 + 50, 5) == rev0 and time.monotonic() - t0 < 1.0   # since của chủ cũ
+        threading.Timer(0.1, gpio.set_device, args=("pump", True)).start()
+        t0 = time.monotonic()
+        assert client.wait(rev0, 5) > rev0
+        assert time.monotonic() - t0 < 1.0
+        assert client.call("set", device="pump", state=False)["ok"]
+    finally:
+        client.close()
+        svc.stop()
@@ -0,0 +1,132 @@
+# tests/test_history.py
+import json
+import random
+import time
+
+import pytest
+
+from app.history import HistoryIndexing, JsonlHistory, bucket_minmax, lttb, to_epoch
+
+T0 = 1_700_000_000.0
+
+
+def _write_rows(path, n, start=T0, step=0.785, seed=3):
+    rng = random.Random(seed)
+    rows = []
+    with open(path, "w", encoding="utf-8") as f:
+        t = start
+        for i in range(n):
+            v = round(20 + 5 * rng.random(), 3)
+            f.write(json.dumps({"ts": t, "env": {"temp_c": v}}) + "\n")
+            rows.append((t, v))
+            t += step
+    return rows
+
+
+def _brute(rows, t_from, t_to, points):
+    span = t_to - t_from
+    out = {}
+    for t, v in rows:
+        if t_from <= t <= t_to:
+            i = min(points - 1, int((t - t_from) / span * points))
+            out.setdefault(i, []).append(v)
+    items = sorted(out.items())
+    return {"t": [round(t_from + (i + 0.5) * span / points, 3) for i, _ in items],
+            "min": [min(vs) for _, vs in items], "max": [max(vs) for _, vs in items],
+            "mean": [round(sum(vs) / len(vs), 4) for _, vs in items], "count": [len(vs) for _, vs in items]}
+
+
+@pytest.mark.parametrize("points", [100, 37, 1000])
+def test_minmax_matches_brute_force(tmp_path, points):
+    path = str(tmp_path / "h.jsonl")
+    rows = _write_rows(path, 20_000)                # ~15.7k s
+    h = JsonlHistory(path)
+    t_from, t_to = rows[123][0] + 0.1, rows[-77][0]
+    got = h.query(["env.temp_c"], t_from, t_to, points=points)["env.temp_c"]
+    want = _brute(rows, t_from, t_to, points)
+    for col in ("t", "min", "max", "count"):
+        assert got[col] == want[col]
+    assert got["mean"] == pytest.approx(want["mean"], abs=1e-3)
+
+
+def test_block_summaries_used_when_buckets_are_wide(tmp_path, monkeypatch):
+    path = str(tmp_path / "h.jsonl")
+    rows = _write_rows(path, 20_000)
+    h = JsonlHistory(path, block_lines=64)
+    raw_lines = []
+    orig = h._read_raw
+    monkeypatch.setattr(h, "_read_raw", lambda *a: raw_lines.append(1) or orig(*a))
+    got = h.query(["env.temp_c"], rows[0][0], rows[-1][0], points=5)["env.temp_c"]
+    want = _brute(rows, rows[0][0], rows[-1][0], 5)
+    assert {c: got[c] for c in ("min", "max", "count")} == {c: want[c] for c in ("min", "max", "count")}
+    assert len(raw_lines) <= 2 * 5 + 1               # chỉ block mức 0 ở ranh giới bucket + phần đuôi
+
+
+def test_boundary_blocks_filled_from_finer_levels(tmp_path, monkeypatch):
+    path = str(tmp_path / "h.jsonl")
+    rows = _write_rows(path, 20_000)
+    h = JsonlHistory(path, block_lines=16, fanout=4, levels=3)   # 16 / 64 / 256 dòng
+    h.refresh_index()
+    assert [len(lv) for lv in h._levels] == [1250, 312, 78]
+    read = []
+    orig = h._read_raw
+
+    def counting(*a):
+        out = orig(*a)
+        read.extend(out)
+        return out
+
+    monkeypatch.setattr(h, "_read_raw", counting)
+    t_from, t_to = rows[500][0] + 0.1, rows[-500][0]
+    got = h.query(["env.temp_c"], t_from, t_to, points=40)["env.temp_c"]
+    want = _brute(rows, t_from, t_to, 40)
+    assert {c: got[c] for c in ("min", "max", "count")} == {c: want[c] for c in ("min", "max", "count")}
+    assert len(read) <= (40 + 1) * 16               # chỉ block 16 dòng ở ranh giới mới đọc raw
+
+
+def test_torn_index_line_is_rewritten(tmp_path):
+    path = str(tmp_path / "h.jsonl")
+    _write_rows(path, 320)
+    JsonlHistory(path).refresh_index()
+    with open(path + ".idx", "ab") as f:
+        f.write(b'{"t0": 17')                       # mất điện lúc append index
+    h = JsonlHistory(path)
+    h.refresh_index()
+    assert len(h._levels[0]) == 20 and len(h._levels[1]) == 1
+    with open(path + ".idx", "rb") as f:
+        assert f.read().endswith(b"}\n")
+
+
+def test_index_is_incremental_and_persisted(tmp_path):
+    path = str(tmp_path / "h.jsonl")
+    _write_rows(path, 1000)
+    h = JsonlHistory(path, block_lines=100)
+    assert h.refresh_index() > 0 and len(h._levels[0]) == 10
+    with open(path, "a") as f:
+        f.write(json.dumps({"ts": T0 + 10_000, "env": {"temp_c": 1.0}}) + "\n")
+        f.write('{"ts": 17')                        # dòng đang ghi dở
+    again = JsonlHistory(path, block_lines=100)
+    again.refresh_index()
+    assert len(again._levels[0]) == 10
+    out = again.query(["env.temp_c"], T0 + 9_000, T0 + 10_001, points=3)["env.temp_c"]
+    assert sum(out["count"]) == 1
+
+
+def test_background_index_and_not_ready(tmp_path, monkeypatch):
+    path = str(tmp_path / "h.jsonl")
+    _write_rows(path, 3000)
+    h = JsonlHistory(path)
+    monkeypatch.setattr(h, "refresh_index", lambda: time.sleep(0.3))
+    h.start(interval_s=60)
+    with pytest.raises(HistoryIndexing):
+        h.query(["env.temp_c"], T0, T0 + 100)
+    assert h._ready.wait(2)
+
+
+def test_to_epoch_and_lttb():
+    assert to_epoch("1700000000") == 1_700_000_000.0
+    assert to_epoch("2023-11-14T22:13:20Z") == 1_700_000_000.0
+    data = [(i, (i % 10) * 1.0) for i in range(100)]
+    out = lttb(data, 10)
+    assert len(out) == 10 and out[0] == [0, 0.0] and out[-1] == [99, 9.0]
+    assert bucket_minmax([(0, 1, 1, 1, 1), (10, 3, 3, 3, 1)], 0, 10, 2)["max"] == [1, 3]
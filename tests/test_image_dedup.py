@@ -0,0 +1,49 @@
+# tests/test_image_dedup.py
+import numpy as np
+import pytest
+
+from app.image_dedup import ImageDeduper, dhash, hamming, phash
+
+
+def _scene(seed=0, h=120, w=160):
+    rng = np.random.default_rng(seed)
+    base = rng.integers(0, 256, size=(h // 20, w // 20), dtype=np.uint8)
+    img = np.kron(base, np.ones((20, 20), dtype=np.uint8))
+    return np.dstack([img, img, img])
+
+
+@pytest.mark.parametrize("fn", [dhash, phash])
+def test_hash_is_64_bit_and_stable(fn):
+    img = _scene()
+    h = fn(img)
+    assert 0 <= h < 1 << 64 and fn(img.copy()) == h
+
+
+@pytest.mark.parametrize("fn", [dhash, phash])
+def test_small_noise_near_large_change_far(fn):
+    img = _scene()
+    noisy = np.clip(img.astype(int) + np.random.default_rng(1).integers(-4, 5, img.shape), 0, 255)
+    assert hamming(fn(img), fn(noisy.astype(np.uint8))) <= 6
+    assert hamming(fn(img), fn(_scene(seed=7))) > 12
+
+
+def test_dhash_gray_and_bgr_agree_on_gray_image():
+    img = _scene()
+    assert dhash(img) == dhash(img[..., 0])
+
+
+def test_hamming():
+    assert hamming(0b1011, 0b0001) == 2 and hamming(5, 5) == 0
+
+
+def test_deduper_skips_duplicates_until_max_interval(tmp_path):
+    d = ImageDeduper(threshold=4, max_interval_s=100, state_path=str(tmp_path / "s.json"))
+    h = dhash(_scene())
+    assert d.check(h, now=0)[0] is False
+    d.mark_uploaded(h, "img-1", now=0)
+    dup, match, dist = d.check(h ^ 0b11, now=50)
+    assert dup and match["ref"] == "img-1" and dist == 2
+    assert d.check(h, now=150)[0] is False
+    # lịch sử qua restart
+    again = ImageDeduper(threshold=4, max_interval_s=100, state_path=str(tmp_path / "s.json"))
+    assert again.check(h, now=50)[0] is True
@@ -0,0 +1,30 @@
+# tests/test_image_prep.py
+import numpy as np
+import pytest
+
+from app.image_prep import ThroughputEstimator, byte_budget
+
+
+def test_estimator_ewma_and_failure_halves():
+    est = ThroughputEstimator(initial_bps=1000, alpha=0.5)
+    est.record(3000, 1.0)
+    assert est.bps == 2000
+    est.record(0, 1.0)                  # mẫu vô nghĩa bị bỏ
+    assert est.samples == 1
+    est.record_failure()
+    assert est.bps == 1000
+
+
+def test_budget_clamped():
+    est = ThroughputEstimator(initial_bps=10 * 1024)
+    assert byte_budget(est, target_upload_s=5, max_bytes=300 * 1024) == 50 * 1024
+    assert byte_budget(est, target_upload_s=0.1, min_bytes=15 * 1024) == 15 * 1024
+    assert byte_budget(est, target_upload_s=1000, max_bytes=300 * 1024) == 300 * 1024
+
+
+def test_prepare_fits_budget():
+    pytest.importorskip("cv2")
+    from app.image_prep import prepare_jpeg
+    img = np.random.default_rng(0).integers(0, 256, size=(720, 1280, 3), dtype=np.uint8)
+    data, info = prepare_jpeg(img, 40 * 1024)
+    assert len(data) == info["bytes"] and info["width"] < 1280
@@ -0,0 +1,49 @@
+# tests/test_metrics.py
+import pytest
+
+from app.metrics import Counter, Gauge, Histogram, Registry, read_sensor, SENSOR_FAILURES
+
+
+def test_histogram_buckets_are_cumulative():
+    h = Histogram("t_seconds", "doc", ("op",), buckets=(0.1, 1.0))
+    for v in (0.05, 0.1, 0.5, 5.0):
+        h.labels("x").observe(v)
+    lines = h.render()
+    assert 't_seconds_bucket{op="x",le="0.1"} 2' in lines
+    assert 't_seconds_bucket{op="x",le="1"} 3' in lines
+    assert 't_seconds_bucket{op="x",le="+Inf"} 4' in lines
+    assert 't_seconds_count{op="x"} 4' in lines
+
+
+def test_counter_gauge_and_label_escaping():
+    c = Counter("c_total", "doc", ("name",))
+    c.labels('a"b').inc()
+    c.labels(name='a"b').inc(2)
+    assert 'c_total{name="a\\"b"} 3' in c.render()
+    g = Gauge("g", "doc")
+    g.set(4)
+    g.dec()
+    assert g.render()[-1] == "g 3"
+    g.set_function(lambda: 7)
+    assert g.render()[-1] == "g 7"
+    with pytest.raises(ValueError):
+        c.labels("a", "b")
+
+
+def test_registry_rejects_conflicting_types():
+    r = Registry()
+    r._get_or_create(Counter, "x", "doc", ())
+    assert r._get_or_create(Counter, "x", "doc", ()) is r._get_or_create(Counter, "x", "doc", ())
+    with pytest.raises(ValueError):
+        r._get_or_create(Gauge, "x", "doc", ())
+    assert r.render().startswith("# HELP x doc\n# TYPE x counter\n")
+
+
+def test_read_sensor_counts_failures():
+    class Broken:
+        def read(self):
+            return {"temp_c": None, "raw": b"\x00"}
+
+    before = SENSOR_FAILURES.labels("test_broken").value()
+    read_sensor("test_broken", Broken())
+    assert SENSOR_FAILURES.labels("test_broken").value() == before + 1
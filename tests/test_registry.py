@@ -0,0 +1,22 @@
+# tests/test_registry.py
+import json
+import subprocess
+import sys
+
+from app import registry
+
+
+def test_lazy_ref_imports_on_first_use():
+    ref = registry.lazy("colorsys:rgb_to_hsv")
+    assert "not loaded" in repr(ref) or "colorsys:rgb_to_hsv" in registry.loaded()
+    assert ref(1.0, 0.0, 0.0) == (0.0, 1.0, 1.0)
+    assert "colorsys:rgb_to_hsv" in registry.loaded()
+    assert registry.load("json:dumps") is json.dumps
+
+
+def test_main_import_does_not_pull_heavy_modules():
+    code = ("import sys, app.main; "
+            "print(','.join(m for m in ('requests', 'dateutil', 'serial', 'cv2', 'RPi', 'numpy') "
+            "if m in sys.modules))")
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == ""
@@ -0,0 +1,112 @@
+# tests/test_rules.py
+import pytest
+
+from app.rules import Rule, RulesEngine
+
+CO2_FAN = {"name": "co2_fan", "metric": "co2.ppm", "above": 1200, "clear": 1000, "for_s": 30,
+           "action": {"device": "fan1", "state": "on"}}
+
+
+def _engine(*specs):
+    return RulesEngine([Rule(s) for s in specs], dry_run=True)
+
+
+def _feed(engine, t, ppm):
+    engine.on_reading({"co2": {"ppm": ppm}}, now=t)
+
+
+def test_trigger_needs_condition_held_for_s():
+    e = _engine(CO2_FAN)
+    _feed(e, 0, 1300)
+    _feed(e, 20, 1100)                 # rơi xuống dưới ngưỡng trước 30 s -> huỷ
+    _feed(e, 25, 1250)
+    e.tick(50)
+    assert list(e.log) == []
+    e.tick(55)
+    assert list(e.log) == [(55, "co2_fan", "fan1", True)]
+
+
+def test_hysteresis_band_does_not_release():
+    e = _engine(CO2_FAN)
+    _feed(e, 0, 1300)
+    e.tick(30)
+    for t, v in ((40, 1150), (50, 1050), (60, 1001)):
+        _feed(e, t, v)                 # trong dải [clear, trigger]: vẫn bật
+    e.tick(200)
+    assert len(e.log) == 1
+    _feed(e, 210, 990)
+    assert e.log[-1] == (210, "co2_fan", "fan1", False)      # clear_for_s = 0
+
+
+def test_min_on_delays_release():
+    e = _engine(dict(CO2_FAN, for_s=0, min_on_s=60))
+    _feed(e, 0, 1300)
+    _feed(e, 10, 900)
+    assert [x[3] for x in e.log] == [True]
+    e.tick(59)
+    assert len(e.log) == 1
+    e.tick(60)
+    assert e.log[-1] == (60, "co2_fan", "fan1", False)
+
+
+def test_two_rules_share_device_until_both_release():
+    heat = {"name": "heat_fan", "metric": "env.temp_c", "above": 32, "clear": 30,
+            "action": {"device": "fan1", "state": "on"}}
+    e = _engine(dict(CO2_FAN, for_s=0), heat)
+    _feed(e, 0, 1300)
+    e.on_reading({"env": {"temp_c": 33}}, now=1)
+    _feed(e, 2, 900)                   # co2 nhả nhưng nhiệt còn giữ quạt
+    assert [x[3] for x in e.log] == [True]
+    e.on_reading({"env": {"temp_c": 29}}, now=3)
+    assert [x[3] for x in e.log] == [True, False]
+
+
+def test_unchanged_metric_is_not_reevaluated():
+    e = _engine(CO2_FAN)
+    for t in range(10):
+        _feed(e, t, 1100)
+    assert e.evaluations == 1
+
+
+def test_invalid_clear_side():
+    with pytest.raises(ValueError):
+        Rule(dict(CO2_FAN, clear=1300))
+
+
+class IntentGpio:
+    def __init__(self, states):
+        self.states = dict(states)
+        self.batches = []
+
+    def get_intent(self, name):
+        return self.states[name]
+
+    def apply_batch(self, batch):
+        self.batches.append(list(batch))
+        self.states.update(batch)
+        return True, []
+
+
+def test_device_on_at_startup_is_released_on_first_reading():
+    gpio = IntentGpio({"fan1": True})
+    e = RulesEngine([Rule(CO2_FAN)], gpio=gpio)
+    _feed(e, 0, 900)
+    e.close()
+    assert gpio.batches == [[("fan1", False)]]
+    assert list(e.log) == [(0, "co2_fan", "fan1", False)]
+
+
+def test_device_off_at_startup_waits_for_trigger():
+    gpio = IntentGpio({"fan1": False})
+    e = RulesEngine([Rule(CO2_FAN)], gpio=gpio)
+    _feed(e, 0, 900)
+    _feed(e, 1, 1100)                  # trong dải hysteresis, rule chưa kích
+    e.close()
+    assert gpio.batches == [] and e.evaluations == 2
+
+
+def test_log_is_bounded():
+    e = _engine(dict(CO2_FAN, for_s=0))
+    for i in range(1500):
+        _feed(e, i, 1300 if i % 2 == 0 else 900)
+    assert e.switches == 1500 and len(e.log) == 1000 and e.log[-1][0] == 1499
@@ -0,0 +1,120 @@
+# tests/test_scheduler.py
+import time
+from datetime import datetime
+
+import pytest
+
+from app.control import check_device_owners
+from app.scheduler import Entry, Scheduler, Window
+
+
+@pytest.fixture
+def tz(monkeypatch):
+    """Đặt múi giờ địa phương cho test (datetime.fromtimestamp / timestamp dùng TZ)."""
+    def use(name):
+        monkeypatch.setenv("TZ", name)
+        time.tzset()
+    yield use
+    monkeypatch.undo()
+    time.tzset()
+
+
+def _ts(s):
+    return datetime.strptime(s, "%Y-%m-%d %H:%M").timestamp()
+
+
+def test_window_across_midnight(tz):
+    tz("UTC")
+    w = Window("20:00-02:00")
+    assert w.contains(_ts("2024-05-01 23:00")) and w.contains(_ts("2024-05-02 01:59"))
+    assert not w.contains(_ts("2024-05-02 02:00")) and not w.contains(_ts("2024-05-02 19:59"))
+    assert w.next_change(_ts("2024-05-01 23:00")) == _ts("2024-05-02 02:00")
+    assert w.next_change(_ts("2024-05-02 03:00")) == _ts("2024-05-02 20:00")
+
+
+def test_window_days_follow_start_day(tz):
+    tz("UTC")
+    w = Window("22:00-06:00", days=["fri"])          # 2024-05-03 là thứ sáu
+    assert w.contains(_ts("2024-05-04 05:00"))       # sáng thứ bảy vẫn thuộc khung của thứ sáu
+    assert not w.contains(_ts("2024-05-04 23:00"))
+    assert w.next_change(_ts("2024-05-04 07:00")) == _ts("2024-05-10 22:00")
+
+
+def test_pulse_slots_and_catch_up(tz):
+    tz("UTC")
+    e = Entry({"name": "p", "device": "pump", "every": "2h", "duration": "30s", "at": "01:00"})
+    assert e.prev_slot(_ts("2024-05-01 00:30")) == _ts("2024-04-30 23:00")
+    assert e.next_slot(_ts("2024-05-01 23:30")) == _ts("2024-05-02 01:00")
+    e.last_run = _ts("2024-05-01 01:00")
+    assert e.catch_up(_ts("2024-05-01 03:10"))       # lỡ xung 03:00 -> chạy bù từ bây giờ
+    assert e.last_run == _ts("2024-05-01 03:10") and e.is_active(_ts("2024-05-01 03:10"))
+    assert not e.catch_up(_ts("2024-05-01 03:11"))
+
+
+class DeferringGpio:
+    def __init__(self):
+        self.calls = []
+        self.defer = True
+
+    def apply_batch(self, batch):
+        self.calls.append(list(batch))
+        return True, [{"device": d, "status": "OK", **({"pending": "on"} if self.defer else {})}
+                      for d, _ in batch]
+
+
+def test_deferred_write_is_not_recorded_as_applied(tz):
+    tz("UTC")
+    gpio = DeferringGpio()
+    s = Scheduler([Entry({"name": "l", "device": "light", "window": "06:00-18:00"}),
+                   Entry({"name": "l2", "device": "light", "window": "10:00-12:00"})], gpio=gpio)
+    s.plan(_ts("2024-05-01 07:00"), catch_up=False)
+    assert gpio.calls == [[("light", True)]] and ("device", "light") not in s._applied
+    gpio.defer = False
+    s.run_due(_ts("2024-05-01 10:00"))               # mốc của l2: vẫn muốn ON, gửi lại vì chưa áp
+    assert gpio.calls[-1] == [("light", True)] and s._applied[("device", "light")] is True
+    s.run_due(_ts("2024-05-01 12:00"))
+    assert len(gpio.calls) == 2                      # đã áp -> mốc không đổi trạng thái thì thôi
+
+
+def test_device_owned_by_one_automation_only():
+    cfg = {"rules": {"enabled": True, "items": [{"metric": "co2.ppm", "above": 1,
+                                                 "action": {"device": "Fan 1"}}]},
+           "climate_control": {"enabled": True, "loops": [{"metric": "env.temp_c", "outputs": ["fan1"]}]},
+           "schedules": {"enabled": True, "items": [{"device": "light", "window": "06:00-18:00"}]}}
+    normalize = lambda n: n.replace(" ", "").lower()
+    with pytest.raises(ValueError, match="fan1"):
+        check_device_owners(cfg, normalize)
+    cfg["climate_control"]["enabled"] = False
+    check_device_owners(cfg, normalize)
+    cfg["schedules"]["items"].append({"servo": "open", "window": "11:00-14:00"})
+    cfg["rules"]["items"].append({"metric": "env.temp_c", "above": 30, "action": {"servo": "open"}})
+    with pytest.raises(ValueError, match="vent"):
+        check_device_owners(cfg, normalize)
+
+
+def test_window_and_slots_across_dst(tz):
+    tz("Europe/Berlin")                              # 2024-03-31 02:00 -> 03:00, 2024-10-27 03:00 -> 02:00
+    w = Window("01:00-04:00")
+    on = w.next_change(_ts("2024-03-31 00:00"))
+    off = w.next_change(on)
+    assert (on, off) == (_ts("2024-03-31 01:00"), _ts("2024-03-31 04:00")) and off - on == 2 * 3600
+    assert w.next_change(_ts("2024-10-27 00:00") + 3600 * 1.5) - _ts("2024-10-27 00:00") == 5 * 3600
+
+    e = Entry({"name": "p", "device": "pump", "every": "2h", "duration": "30s"})
+    assert e.next_slot(_ts("2024-03-31 01:00")) == _ts("2024-03-31 03:00")   # 02:00 không tồn tại -> ngay sau khi nhảy
+    assert e.next_slot(_ts("2024-03-31 03:00")) == _ts("2024-03-31 04:00")
+    assert e.next_slot(_ts("2024-03-31 04:00")) == _ts("2024-03-31 06:00")
+    assert e.prev_slot(_ts("2024-03-31 05:00")) == _ts("2024-03-31 04:00")
+    assert e.next_slot(_ts("2024-10-27 03:30")) == _ts("2024-10-27 04:00")
+    assert datetime.fromtimestamp(e.prev_slot(_ts("2024-10-27 13:00"))).hour == 12
+
+
+def test_list_mode_over_dst_day(tz):
+    tz("Europe/Berlin")
+    s = Scheduler([Entry({"name": "p", "device": "pump", "every": "6h", "duration": "60s"})], dry_run=True)
+    now = _ts("2024-03-30 23:00")
+    s.plan(now, catch_up=False)
+    while s.next_due() is not None and s.next_due() < _ts("2024-03-31 23:00"):
+        s.run_due(s.next_due())
+    on = [datetime.fromtimestamp(t).strftime("%H:%M") for t, _, want in s.log if want is True]
+    assert on == ["00:00", "06:00", "12:00", "18:00"]
@@ -0,0 +1,63 @@
+# tests/test_sensor_cache.py
+import threading
+import time
+
+from app.sensor_cache import SensorCache
+
+
+class SlowCache(SensorCache):
+    def __init__(self, delay=0.1, fail=False):
+        super().__init__({"device_id": "T"}, interval_s=1.0, max_age_s=2.0)
+        self.delay = delay
+        self.fail = fail
+
+    def _read_hw(self):
+        time.sleep(self.delay)
+        self.hw_reads += 1
+        if self.fail:
+            raise TimeoutError("soil timeout")
+        return {"n": self.hw_reads}
+
+
+def test_concurrent_stale_reads_share_one_hardware_read():
+    cache = SlowCache()
+    out = []
+    threads = [threading.Thread(target=lambda: out.append(cache.get()[0])) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert cache.hw_reads == 1 and all(r == {"n": 1} for r in out)
+
+
+def test_fresh_cache_does_not_touch_hardware():
+    cache = SlowCache(delay=0)
+    cache.get()
+    reading, age = cache.get(max_age_s=10)
+    assert cache.hw_reads == 1 and reading == {"n": 1} and age >= 0
+    cache.get(max_age_s=0)
+    assert cache.hw_reads == 2
+
+
+def test_error_is_shared_with_waiters_and_listeners_get_readings():
+    cache = SlowCache(fail=True)
+    errors = []
+
+    def call():
+        try:
+            cache.get()
+        except TimeoutError as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 4 and cache.hw_reads == 1 and cache.latest() is None
+
+    seen = []
+    ok = SlowCache(delay=0)
+    ok.add_listener(seen.append)
+    ok.get()
+    assert seen == [{"n": 1}]
@@ -0,0 +1,16 @@
+# tests/test_startup.py
+import pytest
+
+from app import bench_startup
+
+# Import app.app chỉ dựng Flask + route; GPIO / luồng nền đợi init_services()
+LAZY = ("app.gpio_controller", "app.command_client", "app.rules", "app.climate_control",
+        "app.scheduler", "app.history", "app.config", "yaml")
+
+
+def test_app_import_within_budget():
+    pytest.importorskip("flask")
+    r = bench_startup.measure("app.app")
+    assert not [m for m in LAZY if m in r["modules"]]
+    # Ngân sách 150 ms, nới gấp đôi cho máy CI chậm / chạy song song
+    assert bench_startup.run("app.app", runs=3, budget_ms=300.0, forbidden=LAZY)
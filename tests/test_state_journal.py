@@ -0,0 +1,73 @@
+# tests/test_state_journal.py
+import json
+
+from app.state_journal import StateJournal
+
+S1 = {"fan1": True, "pump": False}
+S2 = {"fan1": False, "pump": True}
+
+
+def test_load_skips_torn_last_line(tmp_path):
+    path = str(tmp_path / "j.jsonl")
+    j = StateJournal(path, fsync=False)
+    assert j.load() == (None, 0)
+    j.append(S1, 1)
+    j.append(S2, 2)
+    j.close()
+    with open(path, "ab") as f:
+        f.write(b'{"t": 1, "rev": 3, "s": {"fan1": 1, "pu')  # mất điện giữa lúc ghi
+    assert StateJournal(path).load() == (S2, 2)
+
+
+def test_append_dedupes_same_state(tmp_path):
+    path = str(tmp_path / "j.jsonl")
+    j = StateJournal(path, fsync=False)
+    assert j.append(S1, 1) and not j.append(dict(S1), 2) and j.append(S2, 3)
+    j.close()
+    with open(path) as f:
+        assert [json.loads(line)["rev"] for line in f] == [1, 3]
+
+
+def test_compacts_when_over_max_bytes(tmp_path):
+    path = str(tmp_path / "j.jsonl")
+    j = StateJournal(path, max_bytes=300, fsync=False)
+    for i in range(50):
+        j.append(S1 if i % 2 else S2, i)
+    j.close()
+    with open(path, "rb") as f:
+        data = f.read()
+    assert len(data) <= 300 and data.endswith(b"\n")
+    assert json.loads(data.splitlines()[-1])["rev"] == 49
+    assert StateJournal(path).load() == (S1, 49)
+
+
+def test_restore_policies(gpio, tmp_path, monkeypatch):
+    path = str(tmp_path / "j.jsonl")
+    j = StateJournal(path, fsync=False)
+    j.append({"fan1": True, "fan2": True, "pump": True, "light": False}, 5)
+    j.close()
+    monkeypatch.setattr(gpio, "JOURNAL_PATH", path)
+    monkeypatch.setattr(gpio, "RESTORE_DEFAULT", "last")
+    monkeypatch.setattr(gpio, "RESTORE_POLICY", {"pump": "off", "light": "on"})
+    targets = gpio._restore_targets()
+    assert targets == {"fan1": True, "fan2": True, "pump": False, "light": True}
+    gpio._journal.close()
+
+    monkeypatch.setattr(gpio, "JOURNAL_PATH", str(tmp_path / "missing.jsonl"))
+    assert gpio._restore_targets() == {"fan1": False, "fan2": False, "pump": False, "light": True}
+
+
+def test_restore_rewrites_torn_file_and_journals_changes(gpio, tmp_path, monkeypatch):
+    path = str(tmp_path / "j.jsonl")
+    with open(path, "wb") as f:
+        f.write(b'{"t":1,"rev":1,"s":{"fan1":1,"fan2":0,"pump":0,"light":0}}\n{"t":2,"re')
+    monkeypatch.setattr(gpio, "JOURNAL_PATH", path)
+    monkeypatch.setattr(gpio, "JOURNAL_FSYNC", False)
+    monkeypatch.setattr(gpio, "RESTORE_POLICY", {})
+    gpio._restore(gpio._restore_targets(), 0.0)
+    assert gpio.get_device_state("fan1") is True
+    gpio.set_device("light", True)
+    gpio._journal.close()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]     # không còn dòng cắt dở dính vào dòng mới
+    assert [r["s"]["light"] for r in lines] == [0, 1]
@@ -0,0 +1,49 @@
+# tests/test_telemetry_hub.py
+import json
+
+from app.telemetry_hub import TelemetryHub
+
+
+def _reading(t, temp):
+    return {"ts": t, "env": {"temp_c": temp, "rh_pct": 50.0}, "co2": {"ppm": 400}}
+
+
+def test_clients_with_same_subscription_share_one_encode():
+    hub = TelemetryHub()
+    a = hub.connect(["env.temp_c"], max_hz=5)
+    b = hub.connect(["env.temp_c"], max_hz=5)
+    c = hub.connect(None, max_hz=5)
+    hub.publish_reading(_reading("t1", 25.0))
+    assert hub.encodes == 2                      # 1 cho {temp_c}, 1 cho "tất cả"
+    fa, fb, fc = a.take(0.1), b.take(0.1), c.take(0.1)
+    assert fa == fb and json.loads(fa[0])["values"] == {"env.temp_c": 25.0}
+    assert set(json.loads(fc[0])["values"]) == {"env.temp_c", "env.rh_pct", "co2.ppm"}
+
+
+def test_slow_client_gets_latest_reading_only():
+    hub = TelemetryHub()
+    c = hub.connect(["env.temp_c"], max_hz=0.5)
+    hub.publish_reading(_reading("t1", 1.0))
+    assert json.loads(c.take(0.1)[0])["ts"] == "t1"
+    for i in range(5):
+        hub.publish_reading(_reading(f"t{i + 2}", float(i)))
+    assert c.take(0.05) == []                    # chưa tới lượt (0.5 Hz)
+    assert c.conflated == 4
+    c._next_allowed = 0
+    assert json.loads(c.take(0.1)[0])["ts"] == "t6"
+
+
+def test_state_frames_bypass_rate_limit_and_new_client_gets_snapshot():
+    hub = TelemetryHub(state_body=lambda rev, st: {"revision": rev, "devices": st})
+    c = hub.connect(max_hz=0.1)
+    hub.publish_reading(_reading("t1", 1.0))
+    c.take(0.1)
+    hub.publish_reading(_reading("t2", 2.0))
+    hub.publish_state(7, {"pump": True})
+    out = c.take(0.1)
+    assert [json.loads(f)["type"] for f in out] == ["state"]
+    late = hub.connect()
+    kinds = [json.loads(f)["type"] for f in late.take(0.1)]
+    assert kinds == ["state", "reading"]
+    hub.disconnect(late)
+    assert hub.client_count() == 1
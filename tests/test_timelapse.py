@@ -0,0 +1,70 @@
+# tests/test_timelapse.py
+import os
+import threading
+from datetime import datetime
+
+from app.timelapse import ImageRingBuffer, TimelapseRunner, TimelapseSchedule
+
+
+def test_schedule_windows_and_midnight_wrap():
+    s = TimelapseSchedule([{"from": "05:30", "to": "18:30", "interval_s": 300},
+                           {"from": "22:00", "to": "05:00", "interval_s": 1800}],
+                          default_interval_s=600)
+    assert s.interval_for(datetime(2026, 1, 1, 12, 0)) == 300
+    assert s.interval_for(datetime(2026, 1, 1, 18, 30)) == 600
+    assert s.interval_for(datetime(2026, 1, 1, 23, 59)) == 1800
+    assert s.interval_for(datetime(2026, 1, 1, 4, 59)) == 1800
+    assert s.interval_for(datetime(2026, 1, 1, 5, 0)) == 600
+
+
+def _jpg(buf, i, size):
+    path = os.path.join(buf.dir, f"{i:04d}.jpg")
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    return buf.add(path, float(i))
+
+
+def test_ring_buffer_evicts_oldest_over_quota(tmp_path):
+    buf = ImageRingBuffer(str(tmp_path), max_bytes=250)
+    for i in range(4):
+        _jpg(buf, i, 100)
+    names = sorted(os.listdir(tmp_path))
+    assert names == ["0002.jpg", "0003.jpg", "index.json"]
+    assert buf.stats() == {"files": 2, "bytes": 200, "pending": 2}
+
+
+def test_ring_buffer_index_survives_restart(tmp_path):
+    buf = ImageRingBuffer(str(tmp_path), max_bytes=10_000, max_files=3)
+    for i in range(3):
+        _jpg(buf, i, 10)
+    buf.mark_uploaded("0000.jpg")
+    # ảnh có trên đĩa nhưng chưa vào index (mất điện giữa chừng)
+    (tmp_path / "0009.jpg").write_bytes(b"y" * 5)
+    again = ImageRingBuffer(str(tmp_path), max_bytes=10_000, max_files=3)
+    assert [e["name"] for e in again.pending()] == ["0001.jpg", "0002.jpg", "0009.jpg"]
+    assert again.stats()["bytes"] == 35
+
+
+def test_upload_backlog_sent_in_batches_and_failures_requeued(tmp_path):
+    buf = ImageRingBuffer(str(tmp_path), max_bytes=10_000)
+    for i in range(3):
+        _jpg(buf, i, 10)
+    calls, done = [], threading.Event()
+
+    def upload(paths):
+        calls.append([os.path.basename(p) for p in paths])
+        if len(calls) == 2:
+            done.set()
+        # lượt đầu: ảnh 0001 lỗi -> phải quay lại hàng đợi
+        return {p: RuntimeError("timeout") if len(calls) == 1 and p.endswith("0001.jpg") else {"ok": True}
+                for p in paths}
+
+    runner = TimelapseRunner({"timelapse": {"dir": str(tmp_path), "upload": {"min_interval_s": 0}}},
+                             upload_fn=upload, upload_batch=2)
+    t = threading.Thread(target=runner._upload_loop)
+    t.start()
+    done.wait(5)
+    runner._stop.set()
+    t.join(5)
+    assert calls == [["0000.jpg", "0001.jpg"], ["0002.jpg", "0001.jpg"]]
+    assert runner.buffer.stats()["pending"] == 0
@@ -0,0 +1,82 @@
+# tests/test_upload_chunked.py
+import os
+import random
+
+import pytest
+import requests
+
+from app.upload_standin import start_standin
+from app.uploader_greenimage import upload_green_image_chunked, upload_many_chunked
+
+CHUNK = 1024
+
+
+class Killed(BaseException):
+    """Tiến trình bị kill giữa chừng (không phải Exception -> không bị retry)."""
+
+
+class CountingSession(requests.Session):
+    def __init__(self, kill_after=None):
+        super().__init__()
+        self.kill_after = kill_after
+        self.puts = []
+        self.auth_headers = []
+
+    def request(self, method, url, **kw):
+        self.auth_headers.append((kw.get("headers") or {}).get("Authorization"))
+        if method == "PUT":
+            if self.kill_after is not None and len(self.puts) >= self.kill_after:
+                raise Killed()
+            self.puts.append(int(url.rsplit("/", 1)[1]))
+        return super().request(method, url, **kw)
+
+
+@pytest.fixture
+def standin():
+    server, state, base = start_standin()
+    yield state, base
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def image(tmp_path):
+    path = tmp_path / "img.jpg"
+    path.write_bytes(os.urandom(10 * CHUNK + 123))
+    return path
+
+
+def test_killed_upload_resumes_from_last_chunk(standin, image):
+    state, base = standin
+    first = CountingSession(kill_after=4)
+    with pytest.raises(Killed):
+        upload_green_image_chunked(base, str(image), "CAM-T", chunk_size=CHUNK, session=first)
+    assert first.puts == [0, 1, 2, 3] and not state.completed
+
+    second = CountingSession()
+    res = upload_green_image_chunked(base, str(image), "CAM-T", chunk_size=CHUNK, session=second)
+    assert second.puts == list(range(4, 11))           # không gửi lại 0..3
+    assert state.completed[res["id"]] == image.read_bytes()
+
+
+def test_flaky_server_still_completes(image, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda s: None)
+    random.seed(1)
+    server, state, base = start_standin(fail_rate=0.3)
+    try:
+        res = upload_many_chunked(base, [str(image)], "CAM-T", chunk_size=CHUNK, max_retries=50,
+                                  session=None)
+    finally:
+        server.shutdown()
+        server.server_close()
+    out = res[str(image)]
+    assert not isinstance(out, Exception) and out["size"] == image.stat().st_size
+
+
+def test_token_sent_per_request_without_touching_session(standin, image, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda s: None)
+    _, base = standin
+    sess = CountingSession()
+    upload_green_image_chunked(base, str(image), "CAM-T", token="abc", chunk_size=CHUNK, session=sess)
+    assert "Authorization" not in sess.headers
+    assert set(sess.auth_headers) == {"Bearer abc"}